@@ -1,10 +1,15 @@
 import requests
 import json
-import time
 import os # Для работы с файловой системой
+import sys
+
+# Общий клиент LM Studio (кэш ответов) лежит в папке 2_myGPTWiki
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "2_myGPTWiki"))
+from lmstudio_client import AdaptiveRateController, open_response_cache, post_chat_completion
 
 # --- НАСТРОЙКА LM STUDIO API ---
-API_URL = "http://localhost:1234/v1/chat/completions" # Порт LM Studio
+# Можно переопределить переменной окружения LMSTUDIO_API_URL (например, для замеров на заглушке)
+API_URL = os.environ.get("LMSTUDIO_API_URL", "http://localhost:1234/v1/chat/completions") # Порт LM Studio
 HEADERS = {
     "Content-Type": "application/json",
 }
@@ -19,7 +24,26 @@ INPUT_JSON_DIR = "titles_chunk1" # Папка из предыдущего скр
 OUTPUT_JSONL_DIR = "articles_chunk1"
 
 # --- НАСТРОЙКИ ГЕНЕРАЦИИ ---
-DELAY_BETWEEN_REQUESTS = 1 # Задержка между запросами (сек), чтобы не перегружать LM Studio
+DELAY_BETWEEN_REQUESTS = 1 # Задержка между запросами (сек), чтобы не перегружать LM Studio. При ADAPTIVE_RATE = True - начальное значение
+
+# Адаптивная пауза между запросами: уменьшается, пока LM Studio отвечает без ошибок и без роста задержки,
+# и увеличивается при ошибках (см. AdaptiveRateController в 2_myGPTWiki/lmstudio_client.py).
+# False - всегда ровно DELAY_BETWEEN_REQUESTS.
+ADAPTIVE_RATE = True
+
+# Сколько раз повторять запрос после временной ошибки API (соединение, таймаут, HTTP 429/5xx)
+# с экспоненциально растущей паузой
+MAX_RETRIES = 4
+
+# Дисковый кэш ответов: при повторном запуске статьи с теми же заголовком и описанием берутся из кэша,
+# а не генерируются заново. None - кэш выключен.
+RESPONSE_CACHE_PATH = None # Например, "lmstudio_response_cache.sqlite"
+RESPONSE_CACHE_MAX_MB = 1024 # Максимальный размер кэша; при превышении вытесняются давно не использованные ответы
+
+# Открывается в main(), если задан RESPONSE_CACHE_PATH
+response_cache = None
+# Контроллер паузы между запросами и повторов, создается в main()
+rate_controller = None
 
 # Шаблон промта для генерации статьи (используем {title} И {description})
 PROMPT_TEMPLATE = """
@@ -52,10 +76,8 @@ def generate_article_text(title: str, description: str) -> str | None:
     }
     try:
         # print(f"Отправка промпта для статьи: «{title}»") # Отладочный вывод
-        response = requests.post(API_URL, headers=HEADERS, data=json.dumps(payload))
-        response.raise_for_status() # Вызовет исключение HTTPError для плохих ответов (4xx or 5xx)
-
-        response_data = response.json()
+        # Вызовет исключение HTTPError для плохих ответов (4xx or 5xx)
+        response_data = post_chat_completion(None, API_URL, payload, cache=response_cache, rate_controller=rate_controller)
         # Извлекаем текст из стандартного OpenAI-совместимого формата ответа
         if 'choices' in response_data and len(response_data['choices']) > 0 and 'message' in response_data['choices'][0] and 'content' in response_data['choices'][0]['message']:
             text = response_data['choices'][0]['message']['content'].strip()
@@ -63,20 +85,20 @@ def generate_article_text(title: str, description: str) -> str | None:
             return text
         else:
             print(f"Предупреждение: Неожиданная структура ответа LM Studio API для '{title}'.")
-            print(f"API ответ: {response.text}")
+            print(f"API ответ: {json.dumps(response_data, ensure_ascii=False)}")
             return None
 
     except requests.exceptions.RequestException as e:
         print(f"Ошибка запроса к LM Studio API при генерации '{title}': {e}")
-        if hasattr(response, 'text'):
-             print(f"API ответ (если есть): {response.text}")
+        if getattr(e, 'response', None) is not None:
+             print(f"API ответ (если есть): {e.response.text}")
         return None
     except Exception as e:
         print(f"Непредвиденная ошибка при генерации текста для '{title}': {e}")
         return None
 
 
-def process_json_file(input_filepath: str, output_filepath: str, delay: float, api_url: str, headers: dict, model_name_payload: str):
+def process_json_file(input_filepath: str, output_filepath: str, api_url: str, headers: dict, model_name_payload: str):
     """
     Обрабатывает один входной JSON файл, генерирует статьи и сохраняет в один JSONL файл.
     """
@@ -119,7 +141,7 @@ def process_json_file(input_filepath: str, output_filepath: str, delay: float, a
 
                 print(f"[{idx}/{total_items}] (№{item_number}) Генерация текста для статьи: «{title}»")
 
-                # Генерируем текст статьи
+                # Генерируем текст статьи (пауза между запросами и повторы после ошибок - в rate_controller)
                 article_text = generate_article_text(title, description)
 
                 if article_text:
@@ -136,10 +158,6 @@ def process_json_file(input_filepath: str, output_filepath: str, delay: float, a
                 else:
                     print(f"Не удалось сгенерировать текст для статьи «{title}».")
 
-                # Пауза между запросами
-                if idx < total_items: # Пауза после всех, кроме последнего
-                     time.sleep(delay)
-
         print(f"Обработка файла '{input_filepath}' завершена. Успешно сгенерировано {generated_count} статей, сохранено в '{output_filepath}'.")
 
     except Exception as e:
@@ -150,6 +168,16 @@ def main():
     """
     Основная логика скрипта: сканирует входную папку, обрабатывает каждый JSON файл.
     """
+    global response_cache, rate_controller
+    rate_controller = AdaptiveRateController(
+        max_concurrency=1, # Статьи генерируются последовательно, подбирается только пауза
+        initial_delay=DELAY_BETWEEN_REQUESTS,
+        max_retries=MAX_RETRIES,
+        adaptive=ADAPTIVE_RATE,
+    )
+    # Ключ кэша - по модели, реально загруженной в LM Studio: MODEL_NAME_PAYLOAD сервер может игнорировать
+    response_cache = open_response_cache(RESPONSE_CACHE_PATH, API_URL, MODEL_NAME_PAYLOAD, RESPONSE_CACHE_MAX_MB * 1024 * 1024)
+
     # Создаем выходную папку, если она не существует
     os.makedirs(OUTPUT_JSONL_DIR, exist_ok=True)
     print(f"Папка для сохранения статей (JSONL): '{OUTPUT_JSONL_DIR}' (создана или уже существует).")
@@ -176,12 +204,15 @@ def main():
         process_json_file(
             input_filepath=input_filepath,
             output_filepath=output_filepath,
-            delay=DELAY_BETWEEN_REQUESTS,
             api_url=API_URL,
             headers=HEADERS,
             model_name_payload=MODEL_NAME_PAYLOAD
         )
         print("-" * 30)
+        print(f"Нагрузка: {rate_controller.format_stats()}")
+
+    if response_cache is not None:
+        print(response_cache.format_stats())
 
 
 if __name__ == "__main__":
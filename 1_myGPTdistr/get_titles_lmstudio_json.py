@@ -1,13 +1,19 @@
 import os
+import sys
 import time
 import re
 import json
 import requests # Импортируем библиотеку для HTTP-запросов
 
+# Общий клиент LM Studio (кэш ответов) лежит в папке 2_myGPTWiki
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "2_myGPTWiki"))
+from lmstudio_client import ResponseCache, open_response_cache, post_chat_completion
+
 # --- НАСТРОЙКА ---
 # URL локального API, который предоставляет LM Studio
 # Убедитесь, что порт соответствует настройкам LM Studio (обычно 1234)
-API_URL = "http://localhost:1234/v1/chat/completions"
+# Можно переопределить переменной окружения LMSTUDIO_API_URL (например, для замеров на заглушке)
+API_URL = os.environ.get("LMSTUDIO_API_URL", "http://localhost:1234/v1/chat/completions")
 
 # Имя файла с темами
 THEMES_FILE = "themes/1.txt"
@@ -35,6 +41,11 @@ HEADERS = {
 # MODEL_NAME_PAYLOAD = "gpt-3.5-turbo" # Пример
 MODEL_NAME_PAYLOAD = "gpt-3.5-turbo" # Или такое название
 
+# Дисковый кэш ответов: при повторном запуске с теми же темами и промптом ответы берутся из кэша,
+# а не генерируются заново (например, после исправления парсинга JSON). None - кэш выключен.
+RESPONSE_CACHE_PATH = None # Например, "lmstudio_response_cache.sqlite"
+RESPONSE_CACHE_MAX_MB = 1024 # Максимальный размер кэша; при превышении вытесняются давно не использованные ответы
+
 # --- ФУНКЦИИ ---
 
 def generate_prompt(title: str, number: int) -> str:
@@ -133,10 +144,11 @@ def extract_json_from_text(text: str) -> str | None:
         return None
 
 
-def process_themes_lmstudio(api_url: str, themes_file: str, output_dir: str, failed_dir_name: str, num_items: int, request_delay: int, headers: dict, model_name_payload: str):
+def process_themes_lmstudio(api_url: str, themes_file: str, output_dir: str, failed_dir_name: str, num_items: int, request_delay: int, headers: dict, model_name_payload: str, response_cache: ResponseCache | None = None):
     """
     Главная функция: считывает темы, генерирует промпты, отправляет их в локальный API
     LM Studio, парсит JSON, выводит количество объектов и сохраняет результаты.
+    Если передан response_cache, ответы на уже встречавшиеся промпты берутся из кэша.
     """
     # Определяем пути к папкам
     main_output_dir = output_dir
@@ -183,14 +195,17 @@ def process_themes_lmstudio(api_url: str, themes_file: str, output_dir: str, fai
 
         try:
             print(f"Отправка запроса к локальному API для темы «{theme}»...")
-            response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status() # Вызовет исключение для кодов ответа 4xx/5xx
+            hits_before = response_cache.hits if response_cache else 0
+            # Вызовет исключение для кодов ответа 4xx/5xx
+            response_data = post_chat_completion(None, api_url, payload, cache=response_cache)
 
             response_successful = True # API запрос успешен (Status 200)
-            print("API запрос успешен (Status 200). Попытка получить текст ответа модели...")
+            if response_cache and response_cache.hits > hits_before:
+                print("Ответ взят из кэша. Попытка получить текст ответа модели...")
+            else:
+                print("API запрос успешен (Status 200). Попытка получить текст ответа модели...")
 
             # Парсим ответ от LM Studio API (OpenAI-совместимый формат)
-            response_data = response.json()
             if 'choices' in response_data and len(response_data['choices']) > 0 and 'message' in response_data['choices'][0] and 'content' in response_data['choices'][0]['message']:
                  raw_response_text = response_data['choices'][0]['message']['content']
                  if raw_response_text:
@@ -232,15 +247,15 @@ def process_themes_lmstudio(api_url: str, themes_file: str, output_dir: str, fai
             else:
                 print(f"Предупреждение: Структура ответа LM Studio API неожиданна для темы «{theme}». Не найден 'choices[0].message.content'.")
                 print("Полученный API ответ:")
-                print(response.text) # Выводим сырой ответ API для отладки
+                print(json.dumps(response_data, ensure_ascii=False)) # Выводим сырой ответ API для отладки
                 # raw_response_text не получен, сохранять нечего в ошибки
                 response_successful = False # Ответ не в ожидаемом формате, считаем неуспешным
 
 
         except requests.exceptions.RequestException as e:
             print(f"Ошибка запроса к локальному API для темы «{theme}»: {e}")
-            if response is not None and hasattr(response, 'text'):
-                 print(f"API ответ (если есть): {response.text}") # Выводим ответ, если он был получен до ошибки
+            if getattr(e, 'response', None) is not None:
+                 print(f"API ответ (если есть): {e.response.text}") # Выводим ответ, если он был получен до ошибки
             # raw_response_text не получен в случае ошибки запроса
             response_successful = False # Ошибка запроса, считаем неуспешным
 
@@ -260,18 +275,22 @@ def process_themes_lmstudio(api_url: str, themes_file: str, output_dir: str, fai
         # В остальных случаях (нет raw_response_text, ошибка запроса, пустой ответ) ничего не сохраняем
 
 
-        # Пауза между запросами, если это не последняя тема
-        if i < total_themes - 1:
+        # Пауза между запросами, если это не последняя тема (ответ из кэша модель не нагружает)
+        if i < total_themes - 1 and not (response_cache and response_cache.hits > hits_before):
             print(f"Пауза {request_delay} секунд...")
             time.sleep(request_delay)
 
     print("\n--- Обработка тем завершена ---")
+    if response_cache is not None:
+        print(response_cache.format_stats())
 
 
 # --- ЗАПУСК ---
 if __name__ == "__main__":
     # Убедитесь, что LM Studio запущен и модель загружена,
     # и API сервер запущен (обычно на http://localhost:1234/v1)
+    # Ключ кэша - по модели, реально загруженной в LM Studio: MODEL_NAME_PAYLOAD сервер может игнорировать
+    response_cache = open_response_cache(RESPONSE_CACHE_PATH, API_URL, MODEL_NAME_PAYLOAD, RESPONSE_CACHE_MAX_MB * 1024 * 1024)
     process_themes_lmstudio(
         api_url=API_URL,
         themes_file=THEMES_FILE,
@@ -280,5 +299,6 @@ if __name__ == "__main__":
         num_items=NUMBER_OF_ITEMS,
         request_delay=REQUEST_DELAY,
         headers=HEADERS,
-        model_name_payload=MODEL_NAME_PAYLOAD # Передаем имя модели для payload
+        model_name_payload=MODEL_NAME_PAYLOAD, # Передаем имя модели для payload
+        response_cache=response_cache
     )
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import traceback
 import sys
 import collections
+
+from columnar_io import RecordWriter, open_article_numbers, read_article_heads, read_records, resolve_input_path, with_format
 # import re # Не нужен для простой эвристики
 
 # --- Конфигурация ---
@@ -23,8 +24,16 @@ output_full_path = os.path.join(output_directory, output_filename)
 
 # Параметр для извлечения "начала статьи"
 MAX_CHARS = 1000         # Берем первые N символов после заголовка
+
+# Формат промежуточных файлов: 'jsonl', 'parquet' или 'arrow' (см. columnar_io.py, для колоночных нужен pyarrow).
+# Выходной файл пишется в этом формате; входные файлы берутся в этом формате, если такие есть, иначе - по путям выше.
+DATA_FORMAT = 'jsonl'
 # --- Конец Конфигурации ---
 
+original_wiki_jsonl_path = resolve_input_path(original_wiki_jsonl_path, DATA_FORMAT)
+selected_titles_jsonl_path = resolve_input_path(selected_titles_jsonl_path, DATA_FORMAT)
+output_full_path = with_format(output_full_path, DATA_FORMAT)
+
 
 # --- Шаг 1: Загрузка списка отобранных статей с заголовками ---
 print("="*50)
@@ -35,29 +44,24 @@ processed_titles_count = 0
 error_titles_lines = 0
 
 try:
-    with open(selected_titles_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            try:
-                item = json.loads(line)
-                number = item.get('number')
-                category = item.get('predicted_category')
-                title = item.get('title')
-
-                if number is None or category is None or title is None:
-                     print(f"  Пропущена строка {line_num + 1} в файле заголовков: Неполные данные.")
-                     error_titles_lines += 1
-                     continue
-
-                selected_articles_info.append({'number': number, 'predicted_category': category, 'title': title})
-                processed_titles_count += 1
-
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1} в файле заголовков: Ошибка парсинга JSON.")
-                error_titles_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1} в файле заголовков: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_titles_lines += 1
+    bad_lines = []
+    for line_num, item in enumerate(read_records(selected_titles_jsonl_path, columns=['number', 'predicted_category', 'title'],
+                                                 bad_lines=bad_lines)):
+        number = item.get('number')
+        category = item.get('predicted_category')
+        title = item.get('title')
+
+        if number is None or category is None or title is None:
+             print(f"  Пропущена запись {line_num + 1} в файле заголовков: Неполные данные.")
+             error_titles_lines += 1
+             continue
+
+        selected_articles_info.append({'number': number, 'predicted_category': category, 'title': title})
+        processed_titles_count += 1
+
+    for line_num, error in bad_lines:
+        print(f"\n  Пропущена строка {line_num} в файле заголовков: Ошибка парсинга JSON: {error}")
+    error_titles_lines += len(bad_lines)
 
     print("Шаг 1 завершен.")
     print(f"Всего записей заголовков обработано: {processed_titles_count}")
@@ -79,44 +83,16 @@ if processed_titles_count == 0:
     sys.exit(0)
 
 
-# --- Шаг 2: Загрузка оригинальных текстов по номерам ---
+# --- Шаг 2: Индекс оригинальных статей по номерам ---
 print("\n" + "="*50)
-print(f"Шаг 2: Загрузка оригинальных текстов статей из '{original_wiki_jsonl_path}' для быстрого доступа...")
-print(f"ВНИМАНИЕ: Этот файл (~1.6ГБ) будет загружен в оперативную память.")
-
-original_texts_by_number = {}
-processed_original_count = 0
-error_original_lines = 0
+print(f"Шаг 2: Открытие индекса номеров статей для '{original_wiki_jsonl_path}'...")
+print("Тексты в память не загружаются: позже читаются только нужные статьи (JSONL - по смещению из файла .numidx,")
+print("Parquet/Arrow - по колонке 'number').")
 
 try:
-    with open(original_wiki_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            try:
-                item = json.loads(line)
-                number = item.get('number')
-                text = item.get('text')
-
-                if number is None or text is None:
-                    # print(f"  Пропущена строка {line_num + 1} в оригинальном файле: Неполные данные.")
-                    error_original_lines += 1
-                    continue
-
-                original_texts_by_number[number] = text
-                processed_original_count += 1
-
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1} в оригинальном файле: Ошибка парсинга JSON.")
-                error_original_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1} в оригинальном файле: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_original_lines += 1
-
+    original_number_index = open_article_numbers(original_wiki_jsonl_path)
     print("Шаг 2 завершен.")
-    print(f"Всего записей оригинальных статей обработано: {processed_original_count}")
-    if error_original_lines > 0:
-        print(f"  Строк с ошибками в оригинальном файле: {error_original_lines}")
-    print(f"Тексты загружены в память для {len(original_texts_by_number)} уникальных номеров.")
+    print(f"В индексе {len(original_number_index)} статей.")
 
 except FileNotFoundError:
     print(f"\nКритическая ошибка: Оригинальный файл статей '{original_wiki_jsonl_path}' не найден.")
@@ -127,7 +103,7 @@ except Exception as e:
     traceback.print_exc()
     sys.exit(1)
 
-if len(original_texts_by_number) == 0:
+if len(original_number_index) == 0:
     print("\nНе удалось загрузить оригинальные тексты. Скрипт завершен.")
     sys.exit(0)
 
@@ -136,6 +112,11 @@ if len(original_texts_by_number) == 0:
 print("\n" + "="*50)
 print(f"Шаг 3: Извлечение начала текста (первые {MAX_CHARS} символов после заголовка) и подготовка данных для генерации описаний...")
 
+# Один проход по файлу: читаются только нужные статьи, в памяти - только их начало
+article_heads = read_article_heads(original_wiki_jsonl_path, [item.get('number') for item in selected_articles_info if item.get('number') is not None],
+                                   max_chars=MAX_CHARS, number_index=original_number_index)
+print(f"  Прочитано статей: {len(article_heads)}")
+
 seeds_for_description_gen = []
 processed_count = 0
 errors_text_extraction = 0
@@ -149,24 +130,10 @@ for item in selected_articles_info:
         errors_text_extraction += 1
         continue
 
-    full_text = original_texts_by_number.get(number)
-
-    beginning_of_text = ""
-    if full_text:
-        # Находим позицию первого переноса строки
-        first_newline_pos = full_text.find('\n')
-
-        if first_newline_pos != -1:
-            # Берем текст после первого переноса строки и до MAX_CHARS
-            # Используем strip() на всякий случай для удаления пробелов в начале или конце
-            beginning_of_text = full_text[first_newline_pos + 1:].strip()[:MAX_CHARS]
-        else:
-            # Если переноса строки нет (вся статья - одна строка), считаем началом статьи весь текст (хотя это странно для вики)
-            # Или можно взять первые MAX_CHARS от всей строки, но так можем обрезать сам заголовок.
-            # Давайте все же считать, что если переноса нет, то нет и тела статьи после заголовка в стандартном вики-смысле.
-            # Оставим beginning_of_text пустой строкой в этом случае.
-            pass # beginning_of_text уже ""
+    head = article_heads.get(number)
 
+    # Текст после первого переноса строки (первые MAX_CHARS символов); пусто, если переноса нет
+    beginning_of_text = head['beginning_of_text'] if head else ""
 
     # Сохраняем данные, готовые для генерации описания
     seeds_for_description_gen.append({
@@ -194,10 +161,9 @@ if not seeds_for_description_gen:
 else:
     try:
         os.makedirs(output_directory, exist_ok=True)
-        with open(output_full_path, 'w', encoding='utf-8') as outfile:
+        with RecordWriter(output_full_path) as writer:
             for i, item in enumerate(seeds_for_description_gen):
-                json_line = json.dumps(item, ensure_ascii=False)
-                outfile.write(json_line + '\n')
+                writer.write(item)
 
                 if (i + 1) % 1000 == 0:
                      print(f"  Записано {i + 1}/{len(seeds_for_description_gen)} записей...")
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import traceback
 import sys
 import collections
 import random # Не нужен для разделения, но оставим для консистентности с предыдущими скриптами
 
+from columnar_io import FORMAT_EXTENSIONS, RecordWriter, read_records, resolve_input_path
+from seed_queue import SeedQueue
+
 # --- Конфигурация ---
 # Путь к файлу с подготовленными данными для генерации описаний
 # Создан скриптом 4_prepare_description_seeds.py
@@ -15,7 +17,16 @@ input_jsonl_path = "./wiki_seeds_for_description/wiki_seeds_for_description.json
 # Папка для сохранения разделенных файлов
 output_directory = "./wiki_description_seeds_split"
 
-# --- Веса ваших машин ---
+# Режим распределения затравок между машинами:
+# 'queue'  - загрузить все затравки в общую очередь (SQLite-база), из которой машины сами берут пачки
+#            по мере готовности (см. seed_queue.py). Веса машин не нужны: быстрые машины просто
+#            берут больше пачек, и никто не простаивает в ожидании самой медленной.
+# 'static' - заранее разделить файл на части по весам machine_weights (старый режим).
+SPLIT_MODE = 'queue'
+# База очереди для режима 'queue'
+queue_db_path = os.path.join(output_directory, "seed_queue.sqlite")
+
+# --- Веса ваших машин (только для SPLIT_MODE = 'static') ---
 # Укажите имена ваших машин (или идентификаторы) и их относительные веса GPU
 # Веса примерные, можете скорректировать, если есть более точные данные о производительности на данной задаче.
 machine_weights = {
@@ -24,8 +35,14 @@ machine_weights = {
     '3080_machine': 1.0,
     '3070_laptop': 0.75,
 }
+
+# Формат промежуточных файлов: 'jsonl', 'parquet' или 'arrow' (см. columnar_io.py, для колоночных нужен pyarrow).
+# Файлы частей (SPLIT_MODE = 'static') пишутся в этом формате; входной файл берется в этом формате, если такой есть.
+DATA_FORMAT = 'jsonl'
 # --- Конец Конфигурации ---
 
+input_jsonl_path = resolve_input_path(input_jsonl_path, DATA_FORMAT)
+
 
 # --- Шаг 1: Загрузка данных из входного файла ---
 print("="*50)
@@ -36,25 +53,19 @@ processed_input_count = 0
 error_input_lines = 0
 
 try:
-    with open(input_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            try:
-                item = json.loads(line)
-                # Проверяем наличие хотя бы номера или какого-то ключа, чтобы убедиться, что это валидный объект
-                if isinstance(item, dict) and len(item) > 0:
-                     loaded_data.append(item)
-                     processed_input_count += 1
-                else:
-                    print(f"  Пропущена строка {line_num + 1}: Некорректный JSON объект или пустая строка.")
-                    error_input_lines += 1
-
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1}: Ошибка парсинга JSON.")
-                error_input_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1}: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_input_lines += 1
+    bad_lines = []
+    for line_num, item in enumerate(read_records(input_jsonl_path, bad_lines=bad_lines)):
+        # Проверяем наличие хотя бы номера или какого-то ключа, чтобы убедиться, что это валидный объект
+        if len(item) > 0:
+             loaded_data.append(item)
+             processed_input_count += 1
+        else:
+            print(f"  Пропущена запись {line_num + 1}: Пустой JSON объект.")
+            error_input_lines += 1
+
+    for line_num, error in bad_lines:
+        print(f"\n  Пропущена строка {line_num}: Ошибка парсинга JSON: {error}")
+    error_input_lines += len(bad_lines)
 
     print("Шаг 1 завершен.")
     print(f"Всего записей загружено для разделения: {processed_input_count}")
@@ -75,6 +86,38 @@ if processed_input_count == 0:
     print("\nНет данных для разделения. Скрипт завершен.")
     sys.exit(0)
 
+# --- Шаг 2 (режим 'queue'): Загрузка затравок в общую очередь ---
+if SPLIT_MODE == 'queue':
+    print("\n" + "="*50)
+    print(f"Шаг 2: Загрузка затравок в очередь '{queue_db_path}'...")
+    try:
+        os.makedirs(output_directory, exist_ok=True)
+        seed_queue = SeedQueue(queue_db_path)
+        added_count = seed_queue.add_seeds(item for item in loaded_data if 'number' in item)
+        queue_stats = seed_queue.stats()
+    except Exception as e:
+        print(f"\nКритическая ошибка во время Шага 2: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+    print("Шаг 2 завершен.")
+    print(f"  Добавлено новых затравок: {added_count} (уже были в очереди: {processed_input_count - added_count})")
+    print(f"  Состояние очереди: {queue_stats['by_status']}")
+
+    print("\n" + "="*50)
+    print("Скрипт разделения файла завершил работу.")
+    print("Дальнейшие действия:")
+    print("1. На машине с базой очереди запустите координатор: python seed_queue.py")
+    print("   (путь к базе и порт задаются в конфигурации seed_queue.py).")
+    print("2. На каждой машине в скрипте генерации описаний (12_generate_descriptions.py) укажите:")
+    print("   `SEED_QUEUE_ADDRESS = \"http://<ip-координатора>:8765\"`")
+    print("   Файлы частей копировать не нужно - затравки будут выдаваться пачками по мере готовности машин.")
+    print("3. Запустите 12_generate_descriptions.py на всех машинах. Машины можно добавлять и перезапускать в любой момент:")
+    print("   пачки упавшей машины вернутся в очередь после истечения срока аренды (QUEUE_LEASE_SECONDS).")
+    print("="*50)
+    sys.exit(0)
+
+
 # --- Шаг 2: Расчет количества записей для каждой машины ---
 print("\n" + "="*50)
 print("Шаг 2: Расчет количества записей для каждой машины...")
@@ -140,15 +183,14 @@ for machine_name, count in items_per_machine.items():
     split_data = loaded_data[current_index:end_index]
 
     # Определяем имя выходного файла
-    output_filename = f"part_{machine_name}.jsonl"
+    output_filename = f"part_{machine_name}{FORMAT_EXTENSIONS[DATA_FORMAT]}"
     output_full_path = os.path.join(output_directory, output_filename)
 
     try:
         # Сохраняем данные в файл
-        with open(output_full_path, 'w', encoding='utf-8') as outfile:
-            for i, item in enumerate(split_data):
-                json_line = json.dumps(item, ensure_ascii=False)
-                outfile.write(json_line + '\n')
+        with RecordWriter(output_full_path) as writer:
+            for item in split_data:
+                writer.write(item)
 
         print(f"  Сохранен файл '{output_full_path}' с {len(split_data)} записями.")
         saved_files_count += 1
@@ -170,14 +212,14 @@ print("\n" + "="*50)
 print("Скрипт разделения файла завершил работу.")
 print("Дальнейшие действия:")
 print(f"1. Скопируйте файлы из папки '{output_directory}' на соответствующие машины.")
-print(f"   - На Машину 1 (3080 Ti) скопируйте файл 'part_3080ti_1.jsonl'.")
-print(f"   - На Машину 2 (3080 Ti) скопируйте файл 'part_3080ti_2.jsonl'.")
-print(f"   - На Машину 3 (3080) скопируйте файл 'part_3080_machine.jsonl'.")
-print(f"   - На Ноутбук (3070) скопируйте файл 'part_3070_laptop.jsonl'.")
+print(f"   - На Машину 1 (3080 Ti) скопируйте файл 'part_3080ti_1{FORMAT_EXTENSIONS[DATA_FORMAT]}'.")
+print(f"   - На Машину 2 (3080 Ti) скопируйте файл 'part_3080ti_2{FORMAT_EXTENSIONS[DATA_FORMAT]}'.")
+print(f"   - На Машину 3 (3080) скопируйте файл 'part_3080_machine{FORMAT_EXTENSIONS[DATA_FORMAT]}'.")
+print(f"   - На Ноутбук (3070) скопируйте файл 'part_3070_laptop{FORMAT_EXTENSIONS[DATA_FORMAT]}'.")
 print(f"2. На каждой машине отредактируйте скрипт генерации описаний (12_generate_descriptions.py):")
 print(f"   Измените переменную `input_jsonl_path` так, чтобы она указывала на скопированный файл части.")
 print(f"   Например, на Машине 1 измените:")
-print(f"   `input_jsonl_path = \"{output_directory}/part_3080ti_1.jsonl\"`")
+print(f"   `input_jsonl_path = \"{output_directory}/part_3080ti_1{FORMAT_EXTENSIONS[DATA_FORMAT]}\"`")
 print(f"   Аналогично для других машин.")
 print("3. Запустите скрипт 5_generate_descriptions.py на каждой машине параллельно.")
 print("="*50)
\ No newline at end of file
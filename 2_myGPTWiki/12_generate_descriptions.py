@@ -1,16 +1,24 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import traceback
 import sys
 import time
 import requests # Импортируем библиотеку для HTTP запросов
 import re       # Импортируем для обработки тегов <think>
+import socket
+
+from columnar_io import read_records
+from generation_checkpoint import ResumableJsonlWriter
+from seed_queue import open_seed_queue
+from lmstudio_client import (AdaptiveRateController, create_session, open_response_cache, post_chat_completion,
+                             stream_chat_completion, run_concurrently)
 
 # --- Конфигурация ---
 # Путь к файлу с подготовленными данными для генерации описаний
 # Создан предыдущим скриптом 10_prepare_description_seeds.py
+# Можно указать и файл части в формате Parquet/Arrow (part_3080_machine.parquet / .arrow, см. columnar_io.py) -
+# из него читаются только нужные колонки. Результаты всегда дописываются в JSONL (режим возобновления).
 input_jsonl_path = "./wiki_description_seeds_split/part_3080_machine.jsonl"
 
 # Папка и имя файла для сохранения результатов генерации описаний
@@ -19,7 +27,8 @@ output_filename = "wiki_seeds_with_descriptions.jsonl"
 output_full_path = os.path.join(output_directory, output_filename)
 
 # --- Параметры LMStudio API ---
-LMSTUDIO_API_URL = "http://localhost:1234/v1/chat/completions" # Уточните в LMStudio
+# Можно переопределить переменной окружения LMSTUDIO_API_URL (например, для замеров на заглушке, см. benchmark_suite.py)
+LMSTUDIO_API_URL = os.environ.get("LMSTUDIO_API_URL", "http://localhost:1234/v1/chat/completions") # Уточните в LMStudio
 MODEL_NAME_IN_LMSTUDIO = "qwen3-8b" # Уточните точное имя вашей модели в LMStudio
 
 # Параметры генерации описаний
@@ -29,9 +38,58 @@ MAX_TOKENS_DESCRIPTION = 100 # Максимальное количество т
 # Маркер, который модель возвращает в случае неясности
 UNCLEAR_MARKER = "НЕЯСНО"
 
-# Задержка между запросами к API (в секундах), чтобы не перегружать LMStudio
+# Статусы, при которых номер считается обработанным и не генерируется повторно (и при RESUME, и в режиме очереди):
+# ответ НЕЯСНО - окончательный ответ модели, повтор с теми же данными его не изменит
+DONE_STATUSES = ("ok", "unclear")
+
+# Задержка между запросами к API (в секундах), чтобы не перегружать LMStudio.
+# При ADAPTIVE_RATE = True - только начальное значение, дальше подбирается автоматически.
 RATE_LIMIT_DELAY = 0.1 # Начните с 0.1 или 0.5, если возникают ошибки связи
 
+# Количество запросов, одновременно находящихся "в полёте" к LMStudio. При ADAPTIVE_RATE = True -
+# верхняя граница, фактическое число подбирается автоматически. 1 - последовательный режим.
+CONCURRENT_REQUESTS = 8
+
+# Адаптивное управление нагрузкой: количество одновременных запросов и пауза между ними подбираются
+# по задержке ответов и ошибкам API (см. AdaptiveRateController в lmstudio_client.py).
+# False - фиксированные CONCURRENT_REQUESTS и RATE_LIMIT_DELAY.
+ADAPTIVE_RATE = True
+
+# Сколько раз повторять запрос после временной ошибки API (соединение, таймаут, HTTP 429/5xx)
+# с экспоненциально растущей паузой, прежде чем записать статус 'api_error'
+MAX_RETRIES = 4
+
+# Потоковый режим: ответ читается по частям ("stream": true), и запрос прерывается, если модель
+# "зациклилась" в рассуждениях <think> или пишет слишком длинный ответ (статусы 'think_overflow', 'output_overflow').
+STREAM_MODE = True
+MAX_THINK_CHARS = 4000   # Максимальная длина рассуждений <think>...</think> в символах (0 - без ограничения)
+MAX_OUTPUT_CHARS = 8000  # Максимальная длина всего вывода, включая рассуждения (0 - без ограничения)
+
+# Режим возобновления: True - дописывать в существующий выходной файл, генерируя описания только
+# для номеров, у которых еще нет записи со статусом 'ok' (пропущенные и неудачные).
+# False - начать заново (выходной файл будет перезаписан).
+RESUME = True
+
+# Дисковый кэш ответов API: одинаковые запросы (модель + промпт + параметры) при повторном запуске
+# берутся из кэша, а не генерируются заново. None - кэш выключен.
+RESPONSE_CACHE_PATH = None # Например, "./lmstudio_response_cache.sqlite"
+RESPONSE_CACHE_MAX_MB = 1024 # Максимальный размер кэша; при превышении вытесняются давно не использованные ответы
+
+# --- Динамическая очередь затравок (см. seed_queue.py и 11_split_description_seeds.py) ---
+# None - обработать весь файл input_jsonl_path (старый режим со статическим делением по машинам).
+# "http://<ip-координатора>:8765" - брать пачки затравок у координатора очереди по мере готовности.
+# Путь к файлу .sqlite - брать пачки напрямую из базы очереди (если все процессы на одной машине).
+SEED_QUEUE_ADDRESS = None
+# Имя этой машины в очереди (для учета аренды и статистики)
+WORKER_NAME = socket.gethostname()
+# Сколько затравок брать за одну аренду
+QUEUE_BATCH_SIZE = 20
+# Срок аренды пачки (в секундах). Если машина не отчиталась за это время, пачка выдается другим машинам.
+# Должен с запасом превышать время обработки одной пачки.
+QUEUE_LEASE_SECONDS = 600
+# Пауза перед повторной попыткой, когда свободных затравок нет, но другие машины еще не отчитались по своим пачкам
+QUEUE_POLL_SECONDS = 30
+
 
 # Пример текста промпта (будет форматироваться данными из файла)
 # Изменяем формулировку про категорию и условие "НЕЯСНО"
@@ -62,51 +120,116 @@ THINK_TAG_REGEX = re.compile(r'<think>.*?</think>', re.DOTALL)
 
 # --- Шаг 1: Загрузка подготовленных данных для генерации ---
 print("="*50)
-print(f"Шаг 1: Загрузка подготовленных данных для генерации описаний из '{input_jsonl_path}'...")
-
 seeds_for_description_gen = []
 processed_input_count = 0
 error_input_lines = 0
+seed_queue = None
+
+if SEED_QUEUE_ADDRESS:
+    # Затравки будут выдаваться пачками из очереди на Шаге 2, входной файл не нужен
+    print(f"Шаг 1: Подключение к очереди затравок '{SEED_QUEUE_ADDRESS}' (машина '{WORKER_NAME}')...")
+    try:
+        seed_queue = open_seed_queue(SEED_QUEUE_ADDRESS)
+        queue_stats = seed_queue.stats()
+    except Exception as e:
+        print(f"\nКритическая ошибка: Не удалось подключиться к очереди затравок '{SEED_QUEUE_ADDRESS}': {e}")
+        print("Убедитесь, что очередь создана скриптом 11_split_description_seeds.py и координатор (seed_queue.py) запущен.")
+        sys.exit(1)
+    print("Шаг 1 завершен.")
+    print(f"  Состояние очереди: {queue_stats['by_status']}")
+else:
+    print(f"Шаг 1: Загрузка подготовленных данных для генерации описаний из '{input_jsonl_path}'...")
+    try:
+        required_keys = ['number', 'predicted_category', 'title', 'beginning_of_text']
+        bad_lines = []
+        for line_num, item in enumerate(read_records(input_jsonl_path, columns=required_keys, bad_lines=bad_lines)):
+            # Проверяем наличие необходимых полей
+            if all(item.get(key) is not None for key in required_keys):
+                 seeds_for_description_gen.append(item)
+                 processed_input_count += 1
+            else:
+                print(f"  Пропущена запись {line_num + 1} во входном файле: Отсутствуют необходимые поля.")
+                error_input_lines += 1
 
-try:
-    with open(input_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            try:
-                item = json.loads(line)
-                # Проверяем наличие необходимых полей
-                if all(key in item for key in ['number', 'predicted_category', 'title', 'beginning_of_text']):
-                     seeds_for_description_gen.append(item)
-                     processed_input_count += 1
-                else:
-                    print(f"  Пропущена строка {line_num + 1} во входном файле: Отсутствуют необходимые поля.")
-                    error_input_lines += 1
+        for line_num, error in bad_lines:
+            print(f"\n  Пропущена строка {line_num} во входном файле: Ошибка парсинга JSON: {error}")
+        error_input_lines += len(bad_lines)
 
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1} во входном файле: Ошибка парсинга JSON.")
-                error_input_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1} во входном файле: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_input_lines += 1
+        print("Шаг 1 завершен.")
+        print(f"Всего записей для генерации описаний загружено: {processed_input_count}")
+        if error_input_lines > 0:
+            print(f"  Строк с ошибками во входном файле: {error_input_lines}")
 
-    print("Шаг 1 завершен.")
-    print(f"Всего записей для генерации описаний загружено: {processed_input_count}")
-    if error_input_lines > 0:
-        print(f"  Строк с ошибками во входном файле: {error_input_lines}")
 
+    except FileNotFoundError:
+        print(f"\nКритическая ошибка: Входной файл '{input_jsonl_path}' не найден.")
+        print("Пожалуйста, убедитесь, что предыдущий скрипт успешно его создал.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\nКритическая ошибка во время Шага 1: {e}")
+        traceback.print_exc()
+        sys.exit(1)
 
-except FileNotFoundError:
-    print(f"\nКритическая ошибка: Входной файл '{input_jsonl_path}' не найден.")
-    print("Пожалуйста, убедитесь, что предыдущий скрипт успешно его создал.")
+    if processed_input_count == 0:
+        print("\nНет данных для генерации описаний. Скрипт завершен.")
+        sys.exit(0)
+
+
+# --- Шаг 1.5: Проверка уже обработанных записей (режим возобновления) ---
+# Создаем выходную директорию, если она не существует
+try:
+    os.makedirs(output_directory, exist_ok=True)
+except Exception as e:
+    print(f"\nКритическая ошибка: Не удалось создать директорию для выходного файла '{output_directory}': {e}")
     sys.exit(1)
+
+try:
+    # Открываем выходной файл: в режиме RESUME - на дозапись, с загрузкой списка готовых номеров
+    writer = ResumableJsonlWriter(output_full_path, status_key='description_status', ok_status=DONE_STATUSES, resume=RESUME)
 except Exception as e:
-    print(f"\nКритическая ошибка во время Шага 1: {e}")
+    print(f"\nКритическая ошибка: Не удалось открыть выходной файл '{output_full_path}': {e}")
     traceback.print_exc()
     sys.exit(1)
 
-if processed_input_count == 0:
-    print("\nНет данных для генерации описаний. Скрипт завершен.")
-    sys.exit(0)
+if RESUME and seed_queue is None and (writer.completed_numbers or writer.failed_numbers):
+    total_before_resume = len(seeds_for_description_gen)
+    seeds_for_description_gen = [item for item in seeds_for_description_gen if item.get('number') not in writer.completed_numbers]
+    print("\n" + "="*50)
+    print(f"Режим возобновления: найден существующий выходной файл '{output_full_path}'.")
+    print(f"  Уже успешно обработано: {total_before_resume - len(seeds_for_description_gen)}")
+    print(f"  Повторная обработка неудачных номеров (ошибки API и парсинга): {len([item for item in seeds_for_description_gen if item.get('number') in writer.failed_numbers])}")
+    print(f"  Осталось обработать: {len(seeds_for_description_gen)}")
+    print(f"  Записей прочитано из выходного файла (хвост, не попавший в индекс): {writer.scanned_records}")
+
+    if len(seeds_for_description_gen) == 0:
+        writer.close()
+        print("\nВсе описания уже сгенерированы. Скрипт завершен.")
+        sys.exit(0)
+elif RESUME and seed_queue is not None and writer.completed_numbers:
+    # В режиме очереди уже готовые номера отмечаются в очереди выполненными сразу после аренды, без повторной генерации
+    print(f"\nРежим возобновления: в выходном файле уже {len(writer.completed_numbers)} успешных описаний, они не будут генерироваться повторно.")
+
+
+def iter_seed_batches():
+    """
+    Отдает затравки пачками: весь входной файл одной пачкой, либо пачки, арендованные у очереди,
+    пока в ней не закончится работа (включая пачки других машин, чья аренда истекла).
+    """
+    if seed_queue is None:
+        yield seeds_for_description_gen
+        return
+    while True:
+        batch = seed_queue.lease(WORKER_NAME, QUEUE_BATCH_SIZE, QUEUE_LEASE_SECONDS)
+        if not batch:
+            # Свободных затравок нет. Если другие машины еще держат пачки, ждем: вдруг какая-то из них упала
+            if seed_queue.stats()['by_status'].get('leased', 0) == 0:
+                return
+            time.sleep(QUEUE_POLL_SECONDS)
+            continue
+        already_done = [item.get('number') for item in batch if item.get('number') in writer.completed_numbers]
+        if already_done:
+            seed_queue.complete(WORKER_NAME, already_done)
+        yield [item for item in batch if item.get('number') not in writer.completed_numbers]
 
 
 # --- Шаг 2: Генерация описаний с помощью LMStudio API и сохранение результатов ---
@@ -115,131 +238,205 @@ print("Шаг 2: Генерация описаний с помощью LMStudio
 print(f"API URL: {LMSTUDIO_API_URL}")
 print(f"Модель: {MODEL_NAME_IN_LMSTUDIO}")
 print(f"Выходной файл результатов: '{output_full_path}'")
-print(f"Всего записей для обработки: {len(seeds_for_description_gen)}")
+if seed_queue is None:
+    print(f"Всего записей для обработки: {len(seeds_for_description_gen)}")
+    total_label = len(seeds_for_description_gen)
+else:
+    print(f"Затравки берутся из очереди '{SEED_QUEUE_ADDRESS}' пачками по {QUEUE_BATCH_SIZE} (аренда {QUEUE_LEASE_SECONDS} сек).")
+    total_label = "?" # Общее количество для этой машины заранее неизвестно
 
 
 generated_descriptions_count = 0
 api_errors_count = 0
 parse_errors_count = 0 # Ошибки при парсинге или очистке ответа модели
 unclear_count = 0      # Количество записей, помеченных моделью как НЕЯСНО
+processed_count = 0    # Количество обработанных этой машиной записей
+overflow_count = 0     # Генерации, прерванные из-за превышения лимита символов (потоковый режим)
 
-# Создаем выходную директорию, если она не существует
+# Одна HTTP-сессия с пулом соединений и общий для всех потоков контроллер нагрузки
+session = create_session(pool_size=CONCURRENT_REQUESTS)
+
+# Ключ кэша включает модель, реально загруженную в LMStudio (GET /v1/models)
 try:
-    os.makedirs(output_directory, exist_ok=True)
-    print(f"Директория '{output_directory}' готова.")
+    response_cache = open_response_cache(RESPONSE_CACHE_PATH, LMSTUDIO_API_URL, MODEL_NAME_IN_LMSTUDIO,
+                                         RESPONSE_CACHE_MAX_MB * 1024 * 1024, session=session)
 except Exception as e:
-    print(f"\nКритическая ошибка: Не удалось создать директорию для выходного файла '{output_directory}': {e}")
+    print(f"\nКритическая ошибка: Не удалось открыть кэш ответов '{RESPONSE_CACHE_PATH}': {e}")
     sys.exit(1)
-
+rate_controller = AdaptiveRateController(
+    max_concurrency=CONCURRENT_REQUESTS,
+    initial_delay=RATE_LIMIT_DELAY,
+    max_retries=MAX_RETRIES,
+    adaptive=ADAPTIVE_RATE,
+)
+if ADAPTIVE_RATE:
+    print(f"Одновременных запросов к API: подбирается автоматически, до {CONCURRENT_REQUESTS}")
+else:
+    print(f"Одновременных запросов к API: {CONCURRENT_REQUESTS}, пауза между запросами: {RATE_LIMIT_DELAY} сек")
+
+
+def generate_description_for_item(item):
+    """
+    Генерирует описание для одной затравки. Выполняется в рабочем потоке.
+
+    Returns:
+        tuple: (output_item, error_message) - запись для выходного файла и текст ошибки (или None).
+    """
+    number = item.get('number') # Сохраняем оригинальный номер
+    predicted_category = item.get('predicted_category')
+    title = item.get('title')
+    beginning_of_text = item.get('beginning_of_text')
+
+    # Формируем полный текст промпта для текущей записи
+    full_prompt = PROMPT_TEMPLATE.format(
+        predicted_category=predicted_category,
+        title=title,
+        beginning_of_text=beginning_of_text,
+        unclear_marker=UNCLEAR_MARKER # Передаем маркер в промпт
+    )
+
+    # Формируем тело запроса к API в формате OpenAI Chat Completions
+    api_payload = {
+        "model": MODEL_NAME_IN_LMSTUDIO,
+        "messages": [
+            # Можно использовать роль system, но часто user/user + assistant chain тоже работает
+            {"role": "user", "content": full_prompt}
+        ],
+        #"temperature": TEMPERATURE,
+        #"max_tokens": MAX_TOKENS_DESCRIPTION,
+        # Другие полезные параметры могут быть добавлены здесь, если нужно
+    }
+
+    generated_description = ""
+    description_status = "api_error" # Статус по умолчанию
+    error_message = None
+
+    try:
+        # Отправляем запрос к LMStudio API (или берем ответ из кэша).
+        # Временные ошибки повторяются контроллером; вызовет исключение, если повторы не помогли
+        if STREAM_MODE:
+            response_json, abort_reason = stream_chat_completion(
+                session, LMSTUDIO_API_URL, api_payload, cache=response_cache,
+                max_think_chars=MAX_THINK_CHARS, max_output_chars=MAX_OUTPUT_CHARS, rate_controller=rate_controller)
+        else:
+            response_json, abort_reason = post_chat_completion(
+                session, LMSTUDIO_API_URL, api_payload, cache=response_cache, rate_controller=rate_controller), None
+
+        if abort_reason is not None:
+            # Генерация прервана досрочно - ответ неполный, не сохраняем его
+            description_status = abort_reason
+            error_message = f"Генерация прервана: {abort_reason}."
+        elif response_json and 'choices' in response_json and len(response_json['choices']) > 0:
+            # Извлекаем сгенерированный текст
+            generated_text = response_json['choices'][0]['message']['content']
+
+            # Очищаем от тегов <think>...</think>
+            cleaned_text = THINK_TAG_REGEX.sub('', generated_text)
+            cleaned_text = cleaned_text.strip() # Удаляем ведущие/завершающие пробелы
+
+            # Проверяем на маркер НЕЯСНО
+            if cleaned_text.upper() == UNCLEAR_MARKER.upper():
+                generated_description = "" # Описание пустое, если модель неясна
+                description_status = "unclear"
+            else:
+                generated_description = cleaned_text
+                description_status = "ok"
+
+        else:
+            # Ответ API не содержит ожидаемой структуры choices/message
+            description_status = "parse_error"
+            error_message = "Ошибка парсинга ответа API: Неожиданная структура ответа."
+
+    except requests.exceptions.RequestException as req_err:
+        # Ошибки запроса (соединение, таймаут, HTTP ошибки), не исправившиеся после MAX_RETRIES повторов
+        description_status = "api_error"
+        error_message = f"API Ошибка: {req_err}"
+
+    except Exception as e:
+        # Другие ошибки при обработке ответа или парсинге
+        description_status = "parse_error"
+        error_message = f"Ошибка при обработке ответа: {e}"
+
+    # Сохраняем результат обработки этой записи
+    output_item = {
+        "number": number,
+        "predicted_category": predicted_category,
+        "title": title,
+        "beginning_of_text": beginning_of_text, # Сохраняем исходное начало текста
+        "description": generated_description,   # Сгенерированное описание (или пустая строка)
+        "description_status": description_status# Статус генерации ('ok', 'unclear', 'api_error', 'parse_error', 'think_overflow', 'output_overflow')
+    }
+    return output_item, error_message
+
+
+start_time = time.time()
 
 try:
-    # Открываем выходной файл для записи
-    with open(output_full_path, 'w', encoding='utf-8') as outfile:
-
-        for i, item in enumerate(seeds_for_description_gen):
-            number = item.get('number') # Сохраняем оригинальный номер
-            predicted_category = item.get('predicted_category')
-            title = item.get('title')
-            beginning_of_text = item.get('beginning_of_text')
-
-            # Формируем полный текст промпта для текущей записи
-            full_prompt = PROMPT_TEMPLATE.format(
-                predicted_category=predicted_category,
-                title=title,
-                beginning_of_text=beginning_of_text,
-                unclear_marker=UNCLEAR_MARKER # Передаем маркер в промпт
-            )
-
-            # Формируем тело запроса к API в формате OpenAI Chat Completions
-            api_payload = {
-                "model": MODEL_NAME_IN_LMSTUDIO,
-                "messages": [
-                    # Можно использовать роль system, но часто user/user + assistant chain тоже работает
-                    {"role": "user", "content": full_prompt}
-                ],
-                #"temperature": TEMPERATURE,
-                #"max_tokens": MAX_TOKENS_DESCRIPTION,
-                # Другие полезные параметры могут быть добавлены здесь, если нужно
-            }
-
-            generated_description = ""
-            description_status = "api_error" # Статус по умолчанию
-
-            try:
-                # Отправляем запрос к LMStudio API
-                response = requests.post(LMSTUDIO_API_URL, json=api_payload)
-                response.raise_for_status() # Вызовет исключение для плохих статусов (4xx или 5xx)
-
-                # Парсим ответ
-                response_json = response.json()
-                if response_json and 'choices' in response_json and len(response_json['choices']) > 0:
-                    # Извлекаем сгенерированный текст
-                    generated_text = response_json['choices'][0]['message']['content']
-
-                    # Очищаем от тегов <think>...</think>
-                    cleaned_text = THINK_TAG_REGEX.sub('', generated_text)
-                    cleaned_text = cleaned_text.strip() # Удаляем ведущие/завершающие пробелы
-
-                    # Проверяем на маркер НЕЯСНО
-                    if cleaned_text.upper() == UNCLEAR_MARKER.upper():
-                        generated_description = "" # Описание пустое, если модель неясна
-                        description_status = "unclear"
-                        unclear_count += 1
-                    else:
-                        generated_description = cleaned_text
-                        description_status = "ok"
-                        generated_descriptions_count += 1
-
+    # Выходной файл уже открыт на Шаге 1.5 (на запись или дозапись в режиме RESUME)
+    with writer:
+
+        for batch in iter_seed_batches():
+            batch_done_numbers = []
+            batch_retry_numbers = []
+
+            # Результаты приходят в порядке завершения запросов, каждая запись содержит 'number'
+            for item, (output_item, error_message) in run_concurrently(batch, generate_description_for_item, CONCURRENT_REQUESTS):
+                processed_count += 1
+                number = output_item['number']
+                description_status = output_item['description_status']
+                if description_status == "ok":
+                    generated_descriptions_count += 1
+                elif description_status == "unclear":
+                    unclear_count += 1
+                elif description_status == "api_error":
+                    api_errors_count += 1
+                elif description_status in ("think_overflow", "output_overflow"):
+                    overflow_count += 1
                 else:
-                    # Ответ API не содержит ожидаемой структуры choices/message
-                    description_status = "parse_error"
                     parse_errors_count += 1
-                    print(f"\n  [{i+1}/{len(seeds_for_description_gen)}] Ошибка парсинга ответа API для номера {number}: Неожиданная структура ответа.")
-                    # print(response_json) # Опционально вывести весь ответ для отладки
-
-            except requests.exceptions.RequestException as req_err:
-                # Ошибки запроса (соединение, таймаут, HTTP ошибки)
-                api_errors_count += 1
-                description_status = "api_error"
-                print(f"\n  [{i+1}/{len(seeds_for_description_gen)}] API Ошибка для номера {number}: {req_err}")
-
-            except Exception as e:
-                 # Другие ошибки при обработке ответа или парсинге
-                 parse_errors_count += 1
-                 description_status = "parse_error"
-                 print(f"\n  [{i+1}/{len(seeds_for_description_gen)}] Ошибка при обработке ответа для номера {number}: {e}")
-                 # traceback.print_exc() # Опционально для подробной отладки
-
-
-            # Сохраняем результат обработки этой записи
-            output_item = {
-                "number": number,
-                "predicted_category": predicted_category,
-                "title": title,
-                "beginning_of_text": beginning_of_text, # Сохраняем исходное начало текста
-                "description": generated_description,   # Сгенерированное описание (или пустая строка)
-                "description_status": description_status# Статус генерации ('ok', 'unclear', 'api_error', 'parse_error')
-            }
-
-            json_line = json.dumps(output_item, ensure_ascii=False)
-            outfile.write(json_line + '\n')
-
-            # Выводим прогресс
-            if (i + 1) % 100 == 0: # Выводим прогресс чаще, так как каждый запрос занимает время
-                 print(f"  Обработано {i + 1}/{len(seeds_for_description_gen)}. API ошибки: {api_errors_count}, Ошибки парсинга: {parse_errors_count}, Неясные: {unclear_count}")
-
-            # Добавляем задержку между запросами
-            time.sleep(RATE_LIMIT_DELAY)
+
+                if error_message:
+                    print(f"\n  [{processed_count}/{total_label}] {error_message} (номер {number})")
+
+                # Записываем строку и индекс обработанных номеров, сразу сбрасывая на диск
+                writer.write(output_item)
+                if description_status in DONE_STATUSES:
+                    batch_done_numbers.append(number)
+                else:
+                    batch_retry_numbers.append(number)
+
+                # Выводим прогресс
+                if processed_count % 100 == 0: # Выводим прогресс чаще, так как каждый запрос занимает время
+                     print(f"  Обработано {processed_count}/{total_label}. API ошибки: {api_errors_count}, Ошибки парсинга: {parse_errors_count}, Неясные: {unclear_count}")
+                     print(f"    Нагрузка: {rate_controller.format_stats()}")
+
+            # Отчитываемся перед очередью только после записи результатов пачки на диск:
+            # если машина упадет раньше, пачка вернется в очередь по истечении аренды
+            if seed_queue is not None:
+                seed_queue.complete(WORKER_NAME, batch_done_numbers)
+                # Ошибочные затравки возвращаем в очередь, чтобы их повторила любая машина
+                seed_queue.release(WORKER_NAME, batch_retry_numbers)
 
         # --- Конец цикла по записям ---
 
     print("\nШаг 2 завершен.")
-    print(f"Всего записей обработано: {len(seeds_for_description_gen)}")
+    print(f"Всего записей обработано: {processed_count}")
     print(f"  Успешно сгенерировано описаний: {generated_descriptions_count}")
     print(f"  Модель ответила '{UNCLEAR_MARKER}': {unclear_count}")
     print(f"  Ошибки API запросов: {api_errors_count}")
     print(f"  Ошибки парсинга/обработки ответа: {parse_errors_count}")
+    print(f"  Прервано из-за превышения лимита символов: {overflow_count}")
+    elapsed = time.time() - start_time
+    if elapsed > 0:
+        print(f"  Время генерации: {elapsed:.1f} сек ({processed_count / elapsed:.2f} описаний/сек)")
+    print(f"  Нагрузка в конце работы: {rate_controller.format_stats()}")
     print(f"Результаты сохранены в файл: '{output_full_path}'")
+    if response_cache is not None:
+        print(response_cache.format_stats())
+    if seed_queue is not None:
+        queue_stats = seed_queue.stats()
+        print(f"Состояние очереди: {queue_stats['by_status']}")
+        print(f"  Обработано по машинам: {queue_stats['done_by_worker']}")
 
 
 except FileNotFoundError:
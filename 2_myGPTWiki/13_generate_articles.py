@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import traceback
 import sys
@@ -8,9 +7,15 @@ import time
 import requests
 import re
 
+from columnar_io import FORMAT_EXTENSIONS, read_records
+from generation_checkpoint import ResumableJsonlWriter
+from lmstudio_client import (AdaptiveRateController, create_session, get_models_url, post_chat_completion,
+                             stream_chat_completion, extract_message_content, run_concurrently)
+
 # --- Конфигурация ---
 # Путь к ВХОДНОМУ файлу части с описаниями (например, part_3080ti_1.jsonl)
 # ЭТОТ ПУТЬ НЕОБХОДИМО БУДЕТ СКОРРЕКТИРОВАТЬ НА КАЖДОЙ МАШИНЕ!
+# Файл части может быть и в формате Parquet/Arrow (part_3080.parquet / .arrow, см. columnar_io.py)
 input_jsonl_path = "./wiki_seeds_with_descriptions/part_3080.jsonl"
 
 # Папка для сохранения сгенерированных полных статей
@@ -20,16 +25,52 @@ output_directory = "./generated_wiki_articles"
 output_filename_pattern = "generated_wiki_articles_{machine_name}.jsonl"
 
 # --- Параметры LMStudio API ---
-LMSTUDIO_API_URL = "http://localhost:1234/v1/chat/completions" # Уточните в LMStudio
+# Можно переопределить переменной окружения LMSTUDIO_API_URL (например, для замеров на заглушке, см. benchmark_suite.py)
+LMSTUDIO_API_URL = os.environ.get("LMSTUDIO_API_URL", "http://localhost:1234/v1/chat/completions") # Уточните в LMStudio
 MODEL_NAME_IN_LMSTUDIO = "qwen3-8b" # Уточните точное имя вашей модели в LMStudio
 
 # Параметры генерации статьи
 # Temperature устанавливается глобально в LMStudio
 MAX_TOKENS_ARTICLE = 2500 # Безопасный лимит токенов для статьи (больше 7000 символов)
 
-# Задержка между запросами к API (в секундах)
+# Задержка между запросами к API (в секундах). При ADAPTIVE_RATE = True - только начальное значение.
 RATE_LIMIT_DELAY = 0.1
 
+# Количество запросов, одновременно находящихся "в полёте" к LMStudio. При ADAPTIVE_RATE = True -
+# верхняя граница, фактическое число подбирается автоматически. 1 - старый последовательный режим.
+# Для параллельной обработки в LMStudio должно быть разрешено несколько одновременных предсказаний
+# (parallel / max concurrent predictions).
+CONCURRENT_REQUESTS = 8
+
+# Адаптивное управление нагрузкой: количество одновременных запросов и пауза между ними
+# подбираются по задержке ответов и ошибкам API (см. AdaptiveRateController в lmstudio_client.py),
+# поэтому их не нужно настраивать вручную под каждую видеокарту.
+# False - фиксированные CONCURRENT_REQUESTS и RATE_LIMIT_DELAY.
+ADAPTIVE_RATE = True
+
+# Сколько раз повторять запрос после временной ошибки API (соединение, таймаут, HTTP 429/5xx)
+# с экспоненциально растущей паузой, прежде чем записать статус 'api_error'
+MAX_RETRIES = 4
+
+# Таймаут одного запроса к API (в секундах), чтобы зависший запрос не занимал слот навсегда
+REQUEST_TIMEOUT = 900
+
+# Потоковый режим: ответ читается по частям ("stream": true), и запрос прерывается, как только модель
+# "зацикливается" в рассуждениях <think> или пишет слишком длинный текст. GPU сразу освобождается
+# для следующей затравки, а не тратит минуты на текст, который все равно будет удален.
+STREAM_MODE = True
+# Максимальная длина рассуждений <think>...</think> в символах (0 - без ограничения).
+# При превышении запрос прерывается со статусом 'think_overflow'.
+MAX_THINK_CHARS = 8000
+# Максимальная длина всего вывода модели, включая рассуждения, в символах (0 - без ограничения).
+# При превышении запрос прерывается со статусом 'output_overflow'. Статья в 5-6 абзацев - около 5000-7000 символов.
+MAX_OUTPUT_CHARS = 24000
+
+# Режим возобновления: True - дописывать в существующий выходной файл, генерируя только
+# затравки, для которых еще нет записи со статусом 'ok' (пропущенные и неудачные).
+# False - начать заново (выходной файл будет перезаписан).
+RESUME = True
+
 # Флаг, указывающий, нужно ли пропускать записи с description_status != 'ok'
 SKIP_UNCLEAR_SEEDS = True # Рекомендуется True
 
@@ -67,9 +108,10 @@ error_input_lines = 0
 # Определяем имя машины из имени входного файла части
 try:
     input_filename = os.path.basename(input_jsonl_path)
-    # Ожидаем формат "part_machine_name.jsonl"
-    if input_filename.startswith("part_") and input_filename.endswith(".jsonl"):
-        machine_name = input_filename[len("part_"):-len(".jsonl")]
+    # Ожидаем формат "part_machine_name.jsonl" (или .parquet / .arrow)
+    input_stem, input_extension = os.path.splitext(input_filename)
+    if input_filename.startswith("part_") and input_extension in FORMAT_EXTENSIONS.values():
+        machine_name = input_stem[len("part_"):]
         if not machine_name:
              raise ValueError("Имя машины не определено после 'part_'.")
     else:
@@ -91,40 +133,35 @@ except Exception as e:
 
 
 try:
-    with open(input_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            total_input_items += 1
-            try:
-                item = json.loads(line)
-
-                # Проверяем наличие необходимых полей для генерации статьи
-                required_keys = ['number', 'title', 'description', 'description_status']
-                if not all(key in item for key in required_keys):
-                     print(f"  Пропущена строка {line_num + 1}: Отсутствуют необходимые поля {required_keys}.")
-                     skipped_other_status += 1
-                     continue
-
-                # Проверяем статус описания
-                status = item.get('description_status')
-                if SKIP_UNCLEAR_SEEDS and status != 'ok':
-                    if status == 'unclear':
-                        skipped_unclear_items += 1
-                    else:
-                        skipped_other_status += 1 # Ошибки API или парсинга на шаге описаний
-                    # print(f"  Пропущена строка {line_num + 1}: Статус описания '{status}'.")
-                    continue
-
-                # Если статус 'ok' или SKIP_UNCLEAR_SEEDS=False
-                items_to_generate.append(item)
-
-
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1}: Ошибка парсинга JSON.")
-                error_input_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1}: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_input_lines += 1
+    # Все колонки: исходная запись целиком сохраняется в 'original_seed_info'
+    bad_lines = []
+    for line_num, item in enumerate(read_records(input_jsonl_path, bad_lines=bad_lines)):
+        total_input_items += 1
+
+        # Проверяем наличие необходимых полей для генерации статьи
+        required_keys = ['number', 'title', 'description', 'description_status']
+        if not all(key in item for key in required_keys):
+             print(f"  Пропущена запись {line_num + 1}: Отсутствуют необходимые поля {required_keys}.")
+             skipped_other_status += 1
+             continue
+
+        # Проверяем статус описания
+        status = item.get('description_status')
+        if SKIP_UNCLEAR_SEEDS and status != 'ok':
+            if status == 'unclear':
+                skipped_unclear_items += 1
+            else:
+                skipped_other_status += 1 # Ошибки API или парсинга на шаге описаний
+            # print(f"  Пропущена запись {line_num + 1}: Статус описания '{status}'.")
+            continue
+
+        # Если статус 'ok' или SKIP_UNCLEAR_SEEDS=False
+        items_to_generate.append(item)
+
+    for line_num, error in bad_lines:
+        print(f"\n  Пропущена строка {line_num}: Ошибка парсинга JSON: {error}")
+    error_input_lines += len(bad_lines)
+    total_input_items += len(bad_lines)
 
     print("Шаг 1 завершен.")
     print(f"Всего записей во входном файле: {total_input_items}")
@@ -148,6 +185,38 @@ if len(items_to_generate) == 0:
     sys.exit(0)
 
 
+# --- Шаг 1.5: Проверка уже сгенерированных статей (режим возобновления) ---
+# Создаем выходную директорию, если она не существует
+try:
+    os.makedirs(output_directory, exist_ok=True)
+except Exception as e:
+    print(f"\nКритическая ошибка: Не удалось создать директорию для выходного файла '{output_directory}': {e}")
+    sys.exit(1)
+
+try:
+    # Открываем выходной файл: в режиме RESUME - на дозапись, с загрузкой списка готовых номеров
+    writer = ResumableJsonlWriter(output_full_path, status_key='generation_status', resume=RESUME)
+except Exception as e:
+    print(f"\nКритическая ошибка: Не удалось открыть выходной файл '{output_full_path}': {e}")
+    traceback.print_exc()
+    sys.exit(1)
+
+if RESUME and (writer.completed_numbers or writer.failed_numbers):
+    total_before_resume = len(items_to_generate)
+    items_to_generate = [item for item in items_to_generate if item.get('number') not in writer.completed_numbers]
+    print("\n" + "="*50)
+    print(f"Режим возобновления: найден существующий выходной файл '{output_full_path}'.")
+    print(f"  Уже успешно сгенерировано: {total_before_resume - len(items_to_generate)}")
+    print(f"  Повторная генерация для неудачных номеров: {len([item for item in items_to_generate if item.get('number') in writer.failed_numbers])}")
+    print(f"  Осталось сгенерировать: {len(items_to_generate)}")
+    print(f"  Записей прочитано из выходного файла (хвост, не попавший в индекс): {writer.scanned_records}")
+
+    if len(items_to_generate) == 0:
+        writer.close()
+        print("\nВсе статьи уже сгенерированы. Скрипт завершен.")
+        sys.exit(0)
+
+
 # --- Шаг 2: Генерация полных статей с помощью LMStudio API и сохранение результатов ---
 print("\n" + "="*50)
 print("Шаг 2: Генерация полных статей с помощью LMStudio API и сохранение результатов...")
@@ -161,18 +230,22 @@ print(f"Безопасный лимит токенов для статьи: {MAX
 generated_count = 0
 api_errors_count = 0
 parse_errors_count = 0
+overflow_count = 0 # Генерации, прерванные из-за превышения лимита символов (потоковый режим)
 
-# Создаем выходную директорию, если она не существует
-try:
-    os.makedirs(output_directory, exist_ok=True)
-    print(f"Директория '{output_directory}' готова.")
-except Exception as e:
-    print(f"\nКритическая ошибка: Не удалось создать директорию для выходного файла '{output_directory}': {e}")
-    sys.exit(1)
+# Одна HTTP-сессия с пулом соединений на все запросы (переиспользует TCP-соединения)
+session = create_session(pool_size=CONCURRENT_REQUESTS)
+
+# Общий для всех потоков контроллер нагрузки: лимит одновременных запросов, паузы, повторы
+rate_controller = AdaptiveRateController(
+    max_concurrency=CONCURRENT_REQUESTS,
+    initial_delay=RATE_LIMIT_DELAY,
+    max_retries=MAX_RETRIES,
+    adaptive=ADAPTIVE_RATE,
+)
 
 # Проверяем доступность API перед началом
 try:
-    response = requests.get(f"{LMSTUDIO_API_URL.rsplit('/', 1)[0]}/models") # Пробуем получить список моделей или просто пингануть
+    response = session.get(get_models_url(LMSTUDIO_API_URL)) # Пробуем получить список моделей или просто пингануть
     response.raise_for_status()
     print("LMStudio API доступен.")
 except requests.exceptions.RequestException as req_err:
@@ -182,96 +255,124 @@ except requests.exceptions.RequestException as req_err:
     sys.exit(1)
 
 
+def generate_article_for_item(item):
+    """
+    Генерирует статью для одной затравки. Выполняется в рабочем потоке.
+
+    Returns:
+        tuple: (output_item, error_message) - запись для выходного файла и текст ошибки (или None).
+    """
+    title = item.get('title', '')
+    description = item.get('description', '')
+
+    # Формируем полный текст промпта для текущей записи
+    full_prompt_article = PROMPT_TEMPLATE_ARTICLE.format(
+        title=title,
+        description=description
+    )
+
+    # Формируем тело запроса к API в формате OpenAI Chat Completions
+    api_payload = {
+        "model": MODEL_NAME_IN_LMSTUDIO,
+        "messages": [
+            {"role": "user", "content": full_prompt_article}
+        ],
+        # Температура не задается здесь, используется глобальная из LMStudio
+        # "max_tokens": MAX_TOKENS_ARTICLE, # Безопасный лимит токенов
+        # Другие полезные параметры могут быть добавлены, например, stop sequences
+    }
+
+    cleaned_text = ""
+    generation_status = "api_error" # Статус по умолчанию
+    error_message = None
+
+    try:
+        # Отправляем запрос к LMStudio API
+        if STREAM_MODE:
+            response_json, abort_reason = stream_chat_completion(
+                session, LMSTUDIO_API_URL, api_payload, timeout=REQUEST_TIMEOUT,
+                max_think_chars=MAX_THINK_CHARS, max_output_chars=MAX_OUTPUT_CHARS, rate_controller=rate_controller)
+        else:
+            response_json, abort_reason = post_chat_completion(
+                session, LMSTUDIO_API_URL, api_payload, timeout=REQUEST_TIMEOUT, rate_controller=rate_controller), None
+
+        generated_text = extract_message_content(response_json)
+        if abort_reason is not None:
+            # Генерация прервана досрочно - текст неполный, не сохраняем его
+            generation_status = abort_reason
+            limit = MAX_THINK_CHARS if abort_reason == "think_overflow" else MAX_OUTPUT_CHARS
+            error_message = f"Генерация прервана ({abort_reason}): превышен лимит {limit} символов."
+        elif generated_text is not None:
+            # Очищаем от тегов <think>...</think>
+            cleaned_text = THINK_TAG_REGEX.sub('', generated_text).strip()
+
+            if cleaned_text: # Проверяем, что сгенерированный текст не пустой
+                generation_status = "ok"
+            else:
+                generation_status = "empty_response" # Модель сгенерировала пустоту после чистки
+        else:
+            # Ответ API не содержит ожидаемой структуры choices/message
+            generation_status = "parse_error"
+            error_message = "Ошибка парсинга ответа API: Неожиданная структура ответа."
+
+    except requests.exceptions.RequestException as req_err:
+        # Ошибки запроса (соединение, таймаут, HTTP ошибки), не исправившиеся после MAX_RETRIES повторов
+        generation_status = "api_error"
+        error_message = f"API Ошибка: {req_err}"
+
+    except Exception as e:
+        # Другие ошибки при обработке ответа или парсинге
+        generation_status = "parse_error"
+        error_message = f"Ошибка при обработке ответа: {e}"
+
+    output_item = {
+        "number": item.get('number'),             # Номер затравки - результаты пишутся в порядке завершения
+        "original_seed_info": item,               # Вся исходная информация о затравке
+        "generated_text": cleaned_text,           # Сгенерированный текст статьи (или пустая строка)
+        "generation_status": generation_status,   # Статус генерации ('ok', 'api_error', 'parse_error', 'empty_response', 'think_overflow', 'output_overflow')
+        "source": "wiki_generated"                # Указываем источник данных
+    }
+    return output_item, error_message
+
+
+if ADAPTIVE_RATE:
+    print(f"Одновременных запросов к API: подбирается автоматически, до {CONCURRENT_REQUESTS}")
+else:
+    print(f"Одновременных запросов к API: {CONCURRENT_REQUESTS}, пауза между запросами: {RATE_LIMIT_DELAY} сек")
+if STREAM_MODE:
+    print(f"Потоковый режим: лимит рассуждений {MAX_THINK_CHARS or 'нет'}, лимит вывода {MAX_OUTPUT_CHARS or 'нет'} символов")
+start_time = time.time()
+
 try:
-    # Открываем выходной файл для записи
-    with open(output_full_path, 'w', encoding='utf-8') as outfile:
-
-        for i, item in enumerate(items_to_generate):
-            # Исходные данные затравки для сохранения
-            original_seed_info = item # Сохраняем всю входную запись как инфо о затравке
-
-            title = item.get('title', '')
-            description = item.get('description', '')
-
-            # Формируем полный текст промпта для текущей записи
-            full_prompt_article = PROMPT_TEMPLATE_ARTICLE.format(
-                title=title,
-                description=description
-            )
-
-            # Формируем тело запроса к API в формате OpenAI Chat Completions
-            api_payload = {
-                "model": MODEL_NAME_IN_LMSTUDIO,
-                "messages": [
-                    {"role": "user", "content": full_prompt_article}
-                ],
-                # Температура не задается здесь, используется глобальная из LMStudio
-                # "max_tokens": MAX_TOKENS_ARTICLE, # Безопасный лимит токенов
-                # Другие полезные параметры могут быть добавлены, например, stop sequences
-            }
-
-            generated_text = ""
-            generation_status = "api_error" # Статус по умолчанию
-
-            try:
-                # Отправляем запрос к LMStudio API
-                response = requests.post(LMSTUDIO_API_URL, json=api_payload)
-                response.raise_for_status() # Вызовет исключение для плохих статусов
-
-                # Парсим ответ
-                response_json = response.json()
-                if response_json and 'choices' in response_json and len(response_json['choices']) > 0:
-                    generated_text = response_json['choices'][0]['message']['content']
-
-                    # Очищаем от тегов <think>...</think>
-                    cleaned_text = THINK_TAG_REGEX.sub('', generated_text)
-                    cleaned_text = cleaned_text.strip()
-
-                    if cleaned_text: # Проверяем, что сгенерированный текст не пустой
-                         generation_status = "ok"
-                         generated_count += 1
-                    else:
-                         generation_status = "empty_response" # Модель сгенерировала пустоту после чистки
-                         parse_errors_count += 1 # Считаем как ошибку парсинга/обработки
-
-                else:
-                    # Ответ API не содержит ожидаемой структуры choices/message
-                    generation_status = "parse_error"
-                    parse_errors_count += 1
-                    print(f"\n  [{i+1}/{len(items_to_generate)}] Ошибка парсинга ответа API для номера {item.get('number')}: Неожиданная структура ответа.")
-                    # print(response_json) # Опционально для отладки
-
-            except requests.exceptions.RequestException as req_err:
-                # Ошибки запроса (соединение, таймаут, HTTP ошибки)
+    # Выходной файл уже открыт на Шаге 1.5 (на запись или дозапись в режиме RESUME)
+    with writer:
+
+        # Результаты приходят в порядке завершения запросов, а не в порядке входного файла.
+        # Каждая запись содержит 'number', поэтому порядок строк в выходном файле не важен.
+        for i, (item, (output_item, error_message)) in enumerate(
+                run_concurrently(items_to_generate, generate_article_for_item, CONCURRENT_REQUESTS)):
+
+            generation_status = output_item['generation_status']
+            if generation_status == "ok":
+                generated_count += 1
+            elif generation_status == "api_error":
                 api_errors_count += 1
-                generation_status = "api_error"
-                print(f"\n  [{i+1}/{len(items_to_generate)}] API Ошибка для номера {item.get('number')}: {req_err}")
+            elif generation_status in ("think_overflow", "output_overflow"):
+                overflow_count += 1
+            else:
+                parse_errors_count += 1 # 'parse_error' и 'empty_response' считаем ошибками парсинга/обработки
 
-            except Exception as e:
-                 # Другие ошибки при обработке ответа или парсинге
-                 parse_errors_count += 1
-                 generation_status = "parse_error"
-                 print(f"\n  [{i+1}/{len(items_to_generate)}] Ошибка при обработке ответа для номера {item.get('number')}: {e}")
-                 # traceback.print_exc() # Опционально для подробной отладки
+            if error_message:
+                print(f"\n  [{i+1}/{len(items_to_generate)}] {error_message} (номер {item.get('number')})")
 
-
-            # Сохраняем результат обработки этой записи
-            output_item = {
-                "original_seed_info": original_seed_info, # Вся исходная информация о затравке
-                "generated_text": cleaned_text,         # Сгенерированный текст статьи (или пустая строка)
-                "generation_status": generation_status,   # Статус генерации ('ok', 'api_error', 'parse_error', 'empty_response')
-                "source": "wiki_generated"                # Указываем источник данных
-            }
-
-            json_line = json.dumps(output_item, ensure_ascii=False)
-            outfile.write(json_line + '\n')
+            # Записываем строку и индекс готовых номеров, сразу сбрасывая на диск
+            writer.write(output_item)
 
             # Выводим прогресс
             if (i + 1) % 50 == 0: # Выводим прогресс каждые 50 статей
-                 print(f"  Обработано {i + 1}/{len(items_to_generate)}. Сгенерировано: {generated_count}, API ошибки: {api_errors_count}, Ошибки парсинга/пусто: {parse_errors_count}")
-
-            # Добавляем задержку между запросами
-            time.sleep(RATE_LIMIT_DELAY)
+                 elapsed = time.time() - start_time
+                 print(f"  Обработано {i + 1}/{len(items_to_generate)}. Сгенерировано: {generated_count}, API ошибки: {api_errors_count}, Ошибки парсинга/пусто: {parse_errors_count}, Прервано: {overflow_count}, Скорость: {(i + 1) / elapsed * 3600:.0f} статей/час")
+                 print(f"    Нагрузка: {rate_controller.format_stats()}")
 
         # --- Конец цикла по записям ---
 
@@ -280,6 +381,11 @@ try:
     print(f"  Успешно сгенерировано статей: {generated_count}")
     print(f"  Ошибки API запросов: {api_errors_count}")
     print(f"  Ошибки парсинга/пустой ответ: {parse_errors_count}")
+    print(f"  Прервано из-за превышения лимита символов: {overflow_count}")
+    elapsed = time.time() - start_time
+    if elapsed > 0:
+        print(f"  Время генерации: {elapsed:.1f} сек ({len(items_to_generate) / elapsed * 3600:.0f} статей/час)")
+    print(f"  Нагрузка в конце работы: {rate_controller.format_stats()}")
     print(f"Результаты сохранены в файл: '{output_full_path}'")
 
 
@@ -1,7 +1,7 @@
 from datasets import load_from_disk
 import os
 import traceback
-import ast # Импортируем модуль ast для оценки строкового литерала
+from wiki40b_text import decode_bytes_literal # Быстрый разбор строкового литерала байтов (вместо ast.literal_eval)
 
 # --- Конфигурация ---
 base_save_directory = "./google_wiki40b_ru"
@@ -91,7 +91,7 @@ def get_article_text_by_global_index(global_index, loaded_datasets_dict, split_o
                         # Если содержимое является строкой (как показал тип и файл)
                         try:
                             # Попытаемся оценить строку как Python литерал
-                            evaluated_content = ast.literal_eval(article_content)
+                            evaluated_content = decode_bytes_literal(article_content)
 
                             if isinstance(evaluated_content, bytes):
                                 # Если результатом оценки оказались байты, декодируем их
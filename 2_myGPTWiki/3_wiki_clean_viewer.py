@@ -1,7 +1,7 @@
 from datasets import load_from_disk
 import os
 import traceback
-import ast # Импортируем модуль ast для оценки строкового литерала
+from wiki40b_text import clean_wiki_text, decode_bytes_literal # Очистка маркеров и быстрый разбор литерала байтов (вместо ast.literal_eval)
 
 # --- Конфигурация ---
 base_save_directory = "./google_wiki40b_ru"
@@ -91,7 +91,7 @@ def get_article_text_by_global_index(global_index, loaded_datasets_dict, split_o
                         # Если содержимое является строкой (как показал тип и файл)
                         try:
                             # Попытаемся оценить строку как Python литерал
-                            evaluated_content = ast.literal_eval(article_content)
+                            evaluated_content = decode_bytes_literal(article_content)
 
                             if isinstance(evaluated_content, bytes):
                                 # Если результатом оценки оказались байты, декодируем их
@@ -136,28 +136,6 @@ def get_article_text_by_global_index(global_index, loaded_datasets_dict, split_o
     return None
 
 
-# Импортируем модуль re для регулярных выражений
-import re
-
-# --- Функция для очистки текста (вставьте сюда код функции clean_wiki_text) ---
-def clean_wiki_text(text_with_markers: str) -> str:
-    """
-    Очищает текст статьи от специфических маркеров wiki40b
-    и преобразует его в формат с абзацами.
-    """
-    cleaned_text = text_with_markers
-    cleaned_text = cleaned_text.replace('_NEWLINE_', '\n')
-    cleaned_text = cleaned_text.replace('_START_PARAGRAPH_', '\n\n')
-    cleaned_text = cleaned_text.replace('_START_SECTION_', '\n\n')
-    cleaned_text = cleaned_text.replace('_START_ARTICLE_', '')
-    # Удаляем любые оставшиеся одиночные маркеры на всякий случай
-    cleaned_text = re.sub(r'_[A-Z_]+_', '', cleaned_text)
-    cleaned_text = cleaned_text.strip()
-    # Заменяем множественные переносы строк (3 и более) на двойные
-    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
-    return cleaned_text
-# --- Конец функции clean_wiki_text ---
-
 # 3. Бесконечный цикл для интерактивного просмотра
 print("-" * 30)
 while True:
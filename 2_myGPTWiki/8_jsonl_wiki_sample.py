@@ -1,28 +1,19 @@
 import json
 import os
 
+from jsonl_index import JsonlIndex
+
 def build_article_index(filepath):
     """
-    Проходит по JSONL файлу и записывает байтовые смещения начала каждой строки.
-    Возвращает общее количество строк/статей и список смещений.
+    Открывает индекс байтовых смещений строк JSONL файла (файл .idx рядом с JSONL;
+    строится при первом запуске и после изменения файла).
+    Возвращает общее количество строк/статей и индекс.
     """
-    print(f"Построение индекса для файла: {filepath}...")
-    offsets = []
-    article_count = 0
+    print(f"Загрузка индекса для файла: {filepath}...")
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            while True:
-                offset = f.tell() # Запоминаем текущее положение в файле
-                line = f.readline()
-                if not line: # Конец файла
-                    break
-                # Можно добавить минимальную проверку на валидность JSON здесь,
-                # но для построения индекса достаточно просто записать смещение строки.
-                # Полная проверка и парсинг будут при запросе конкретной статьи.
-                offsets.append(offset)
-                article_count += 1
-        print(f"Индекс успешно построен. Найдено {article_count} строк.")
-        return article_count, offsets
+        index = JsonlIndex(filepath)
+        print(f"Индекс загружен. Найдено {len(index)} строк.")
+        return len(index), index
     except FileNotFoundError:
         print(f"Ошибка при построении индекса: Файл не найден по пути {filepath}")
         return 0, None
@@ -30,35 +21,25 @@ def build_article_index(filepath):
         print(f"Произошла непредвиденная ошибка при построении индекса: {e}")
         return 0, None
 
-def get_article_by_index(filepath, offsets, index):
+def get_article_by_index(index_obj, index):
     """
-    Извлекает и парсит статью по ее индексу, используя список смещений.
+    Извлекает и парсит статью по ее индексу, читая только нужную строку по смещению из индекса.
     """
-    if offsets is None or not 0 <= index < len(offsets):
+    if index_obj is None or not 0 <= index < len(index_obj):
         print(f"Ошибка: Некорректный индекс {index} или индекс не загружен.")
         return None
 
-    offset = offsets[index]
-
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            f.seek(offset) # Перемещаемся к началу нужной строки
-            line = f.readline() # Читаем только эту строку
-
-            try:
-                article = json.loads(line)
-                 # Опционально: проверяем наличие нужных ключей при извлечении
-                if 'text' in article and 'number' in article:
-                    return article
-                else:
-                     print(f"Предупреждение: Статья по индексу {index} не содержит ключ 'text' или 'number'.")
-                     return None # Возвращаем None, если статья неполная
-            except json.JSONDecodeError:
-                print(f"Предупреждение: Некорректная JSON строка по индексу {index}.")
-                return None # Возвращаем None для некорректных строк
-    except FileNotFoundError:
-        print(f"Ошибка при чтении файла: Файл не найден по пути {filepath}")
-        return None
+        article = index_obj.read_json(index)
+         # Опционально: проверяем наличие нужных ключей при извлечении
+        if 'text' in article and 'number' in article:
+            return article
+        else:
+             print(f"Предупреждение: Статья по индексу {index} не содержит ключ 'text' или 'number'.")
+             return None # Возвращаем None, если статья неполная
+    except json.JSONDecodeError:
+        print(f"Предупреждение: Некорректная JSON строка по индексу {index}.")
+        return None # Возвращаем None для некорректных строк
     except Exception as e:
         print(f"Произошла непредвиденная ошибка при извлечении статьи: {e}")
         return None
@@ -69,10 +50,10 @@ def get_article_by_index(filepath, offsets, index):
 file_to_inspect = input("Введите имя JSONL файла для проверки (например, random_wiki_sample_10000.jsonl): ").strip()
 
 # Строим индекс
-num_articles, article_offsets = build_article_index(file_to_inspect)
+num_articles, article_index = build_article_index(file_to_inspect)
 
 # Если индекс не удалось построить, выходим
-if article_offsets is None or num_articles == 0:
+if article_index is None or num_articles == 0:
     print("Не удалось загрузить или найти статьи в файле. Завершение работы.")
     exit()
 
@@ -98,7 +79,7 @@ while True:
         # Проверяем, находится ли индекс в допустимом диапазоне
         if 0 <= index < num_articles:
             # Извлекаем статью по индексу
-            article = get_article_by_index(file_to_inspect, article_offsets, index)
+            article = get_article_by_index(article_index, index)
 
             if article:
                 print("-" * 50) # Разделительная линия для удобства
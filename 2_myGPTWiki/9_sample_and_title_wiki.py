@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import traceback
 import sys
 import collections
 import random
 
+from columnar_io import RecordWriter, open_article_numbers, read_article_heads, read_records, resolve_input_path, with_format
+
 # --- Конфигурация ---
 # Путь к файлу с оригинальными статьями Wiki40b, отобранными по длине (1.6ГБ)
 original_wiki_jsonl_path = "./selected_wiki_jsonl/selected_wiki_articles.jsonl"
@@ -19,6 +20,10 @@ output_directory = "./wiki_seed_titles"
 output_filename = "selected_wiki_titles.jsonl"
 output_full_path = os.path.join(output_directory, output_filename)
 
+# Формат промежуточных файлов: 'jsonl', 'parquet' или 'arrow' (см. columnar_io.py, для колоночных нужен pyarrow).
+# Выходной файл пишется в этом формате; входные файлы берутся в этом формате, если такие есть, иначе - по путям выше.
+DATA_FORMAT = 'jsonl'
+
 # --- ПЛАН ВЫБОРКИ: Сколько статей взять из каждой категории ---
 # Заполните этот словарь! Ключи - названия категорий из вашего classes.txt.
 # Значения - желаемое количество статей для выборки ИЗ ЭТОЙ КОНКРЕТНОЙ КАТЕГОРИИ.
@@ -122,6 +127,10 @@ category_sampling_counts = {
 # Используем этот словарь category_sampling_counts в скрипте.
 # --- Конец ПЛАНА ВЫБОРКИ ---
 
+original_wiki_jsonl_path = resolve_input_path(original_wiki_jsonl_path, DATA_FORMAT)
+classified_results_jsonl_path = resolve_input_path(classified_results_jsonl_path, DATA_FORMAT)
+output_full_path = with_format(output_full_path, DATA_FORMAT)
+
 
 # --- Шаг 1: Загрузка результатов классификации и группировка по категориям ---
 print("="*50)
@@ -133,30 +142,26 @@ processed_classified_count = 0
 error_classified_lines = 0
 
 try:
-    with open(classified_results_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            try:
-                item = json.loads(line)
-                category = item.get('predicted_category')
-                number = item.get('number')
-                score = item.get('score')
-
-                if category is None or number is None or score is None:
-                    print(f"  Пропущена строка {line_num + 1} в файле классификации: Неполные данные.")
-                    error_classified_lines += 1
-                    continue
-
-                articles_by_category[category].append({'number': number, 'score': score})
-                available_counts[category] += 1
-                processed_classified_count += 1
-
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1} в файле классификации: Ошибка парсинга JSON.")
-                error_classified_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1} в файле классификации: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_classified_lines += 1
+    # Из колоночного файла читаются только эти три колонки
+    bad_lines = []
+    for line_num, item in enumerate(read_records(classified_results_jsonl_path, columns=['number', 'predicted_category', 'score'],
+                                                 bad_lines=bad_lines)):
+        category = item.get('predicted_category')
+        number = item.get('number')
+        score = item.get('score')
+
+        if category is None or number is None or score is None:
+            print(f"  Пропущена запись {line_num + 1} в файле классификации: Неполные данные.")
+            error_classified_lines += 1
+            continue
+
+        articles_by_category[category].append({'number': number, 'score': score})
+        available_counts[category] += 1
+        processed_classified_count += 1
+
+    for line_num, error in bad_lines:
+        print(f"\n  Пропущена строка {line_num} в файле классификации: Ошибка парсинга JSON: {error}")
+    error_classified_lines += len(bad_lines)
 
     print("Шаг 1 завершен.")
     print(f"Всего записей классификации обработано: {processed_classified_count}")
@@ -181,44 +186,16 @@ if processed_classified_count == 0:
     print("\nНет данных классификации для обработки. Скрипт завершен.")
     sys.exit(0)
 
-# --- Шаг 2: Загрузка оригинальных текстов по номерам ---
+# --- Шаг 2: Индекс оригинальных статей по номерам ---
 print("\n" + "="*50)
-print(f"Шаг 2: Загрузка оригинальных текстов статей из '{original_wiki_jsonl_path}'...")
-print(f"ВНИМАНИЕ: Этот файл (~1.6ГБ) будет загружен в оперативную память.")
-
-original_texts_by_number = {}
-processed_original_count = 0
-error_original_lines = 0
+print(f"Шаг 2: Открытие индекса номеров статей для '{original_wiki_jsonl_path}'...")
+print("Тексты в память не загружаются: позже читаются только нужные статьи (JSONL - по смещению из файла .numidx,")
+print("Parquet/Arrow - по колонке 'number').")
 
 try:
-    with open(original_wiki_jsonl_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f):
-            try:
-                item = json.loads(line)
-                number = item.get('number')
-                text = item.get('text')
-
-                if number is None or text is None:
-                    print(f"  Пропущена строка {line_num + 1} в оригинальном файле: Неполные данные.")
-                    error_original_lines += 1
-                    continue
-
-                original_texts_by_number[number] = text
-                processed_original_count += 1
-
-            except json.JSONDecodeError:
-                print(f"\n  Пропущена строка {line_num + 1} в оригинальном файле: Ошибка парсинга JSON.")
-                error_original_lines += 1
-            except Exception as e:
-                print(f"\n  Пропущена строка {line_num + 1} в оригинальном файле: Непредвиденная ошибка: {e}")
-                # traceback.print_exc()
-                error_original_lines += 1
-
+    original_number_index = open_article_numbers(original_wiki_jsonl_path)
     print("Шаг 2 завершен.")
-    print(f"Всего записей оригинальных статей обработано: {processed_original_count}")
-    if error_original_lines > 0:
-        print(f"  Строк с ошибками в оригинальном файле: {error_original_lines}")
-    print(f"Тексты загружены в память для {len(original_texts_by_number)} уникальных номеров.")
+    print(f"В индексе {len(original_number_index)} статей.")
 
 except FileNotFoundError:
     print(f"\nКритическая ошибка: Оригинальный файл статей '{original_wiki_jsonl_path}' не найден.")
@@ -229,7 +206,7 @@ except Exception as e:
     traceback.print_exc()
     sys.exit(1)
 
-if len(original_texts_by_number) == 0:
+if len(original_number_index) == 0:
     print("\nНе удалось загрузить оригинальные тексты. Скрипт завершен.")
     sys.exit(0)
 
@@ -279,6 +256,11 @@ if total_actually_sampled < total_desired:
 print("\n" + "="*50)
 print("Шаг 4: Извлечение заголовков для отобранных статей...")
 
+# Один проход по файлу: читаются только отобранные статьи, в памяти - только заголовки
+article_heads = read_article_heads(original_wiki_jsonl_path, [item.get('number') for item in selected_articles_info if item.get('number') is not None],
+                                   number_index=original_number_index)
+print(f"  Прочитано статей: {len(article_heads)}")
+
 final_output_seeds = []
 processed_sampled_count = 0
 errors_title_extraction = 0
@@ -291,13 +273,12 @@ for item in selected_articles_info:
         errors_title_extraction += 1
         continue # Пропускаем, если нет номера или категории
 
-    article_text = original_texts_by_number.get(number)
+    head = article_heads.get(number)
 
     title = "" # Заголовок по умолчанию - пустая строка
-    if article_text:
-        # Извлекаем первую строку как заголовок
-        lines = article_text.split('\n', 1) # Делим строку максимум на 2 части по первому переносу
-        title = lines[0].strip() # Берем первую часть и удаляем пробелы
+    if head:
+        # Первая строка статьи - заголовок
+        title = head['title']
 
     # Сохраняем информацию
     final_output_seeds.append({
@@ -324,10 +305,9 @@ if not final_output_seeds:
 else:
     try:
         os.makedirs(output_directory, exist_ok=True)
-        with open(output_full_path, 'w', encoding='utf-8') as outfile:
+        with RecordWriter(output_full_path) as writer:
             for i, seed_item in enumerate(final_output_seeds):
-                json_line = json.dumps(seed_item, ensure_ascii=False)
-                outfile.write(json_line + '\n')
+                writer.write(seed_item)
 
                 if (i + 1) % 1000 == 0:
                      print(f"  Записано {i + 1}/{len(final_output_seeds)} записей...")
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Проверка и замер однопроходной очистки маркеров wiki40b (wiki40b_text.clean_wiki_text)
+против прежней шестипроходной clean_wiki_text_reference.
+
+1) Эталонные (golden) случаи: набор краевых примеров + статьи датасета (или синтетические) -
+   результат clean_wiki_text должен совпадать с clean_wiki_text_reference символ в символ,
+   а parse_wiki_article - давать тот же текст, если собрать его обратно.
+2) Скорость: символов/сек для эталона, clean_wiki_text и parse_wiki_article.
+
+$ python benchmark_clean_markers.py
+"""
+
+import os
+import sys
+import time
+
+from wiki40b_text import clean_wiki_text, clean_wiki_text_reference, decode_wiki40b_text, parse_wiki_article
+
+# --- Конфигурация ---
+base_wiki_data_directory = "./google_wiki40b_ru"
+BENCH_SPLIT = 'validation'
+NUM_ARTICLES = 5000
+REPEATS = 3 # Лучшее время из нескольких повторов
+# --- Конец конфигурации ---
+
+GOLDEN_CASES = [
+    "",
+    "\n_START_ARTICLE_\nЗаголовок\n_START_PARAGRAPH_\nТекст_NEWLINE_строка 2\n",
+    "\n_START_ARTICLE_\nT\n_START_SECTION_\nРаздел\n_START_PARAGRAPH_\nА\n_START_PARAGRAPH_\nБ\n",
+    "_START_ARTICLE__START_PARAGRAPH_слитно_NEWLINE__NEWLINE_",
+    "текст _UNKNOWN_MARKER_ и snake_case_name и A_B_C_",
+    "ABC_NEWLINE_DEF _FOO_NEWLINE_BAR_ _START_SECTION_X",
+    "__ ___ _A _A_ _a_ _\n\n\n\n_ \n \n\n\n",
+    "  \t_START_ARTICLE_  \n\n\n\n  ",
+]
+
+
+def load_articles():
+    if os.path.isdir(os.path.join(base_wiki_data_directory, BENCH_SPLIT)):
+        from datasets import load_from_disk
+        dataset = load_from_disk(os.path.join(base_wiki_data_directory, BENCH_SPLIT))
+        subset = dataset.select(range(min(NUM_ARTICLES, len(dataset))))
+        return [decode_wiki40b_text(text) for text in subset['text']], f"{base_wiki_data_directory}/{BENCH_SPLIT}"
+    from benchmark_decode_wiki import synthetic_literals
+    return [decode_wiki40b_text(literal) for literal in synthetic_literals(NUM_ARTICLES, 1337)], "синтетические статьи"
+
+
+def rebuild_text(article):
+    """Текст из parse_wiki_article в формате clean_wiki_text: блоки через пустую строку."""
+    blocks = [article['title']]
+    for section in article['sections']:
+        blocks.append(section['title'])
+        blocks.extend(section['paragraphs'])
+    return '\n\n'.join(block for block in blocks if block)
+
+
+def best_rate(function, texts, total_chars):
+    best = None
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for text in texts:
+            function(text)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return total_chars / best
+
+
+def main():
+    articles, source = load_articles()
+    total_chars = sum(len(text) for text in articles)
+    print(f"Источник: {source}, статей: {len(articles)}, символов: {total_chars}")
+
+    failed = [text for text in GOLDEN_CASES + articles if clean_wiki_text(text) != clean_wiki_text_reference(text)]
+    print(f"Совпадение с эталонной очисткой: {len(GOLDEN_CASES) + len(articles) - len(failed)}/{len(GOLDEN_CASES) + len(articles)}")
+    for text in failed[:3]:
+        print(f"  расхождение: {text[:200]!r}")
+    structure_mismatch = sum(1 for text in articles if rebuild_text(parse_wiki_article(text)) != clean_wiki_text(text))
+    print(f"parse_wiki_article, собранный обратно, совпадает с clean_wiki_text: {len(articles) - structure_mismatch}/{len(articles)}")
+
+    print("="*50)
+    baseline = None
+    for name, function in [("clean_wiki_text_reference", clean_wiki_text_reference),
+                           ("clean_wiki_text", clean_wiki_text),
+                           ("parse_wiki_article", parse_wiki_article)]:
+        rate = best_rate(function, articles, total_chars)
+        baseline = baseline or rate
+        print(f"{name:<26} {rate / 1e6:>8.1f} млн символов/сек (x{rate / baseline:.1f})")
+    print("="*50)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+Скорость декодирования и очистки статей wiki40b (статей/сек): прежний цикл по примерам
+(как в 4_wiki_get_stats.py и 5_select_and_save_wiki.py) против пакетного Dataset.map
+(wiki40b_text.map_cleaned_articles) в 1 и нескольких процессах.
+Проверяется, что все варианты дают одинаковые очищенные тексты.
+
+$ python benchmark_clean_wiki.py
+"""
+
+import os
+import time
+
+from datasets import load_from_disk
+
+from wiki40b_text import clean_wiki_text, decode_wiki40b_text, map_cleaned_articles
+
+# --- Конфигурация ---
+base_wiki_data_directory = "./google_wiki40b_ru"
+BENCH_SPLIT = 'train'
+NUM_ARTICLES = 20000 # Первые статьи раздела
+NUM_PROC_LEVELS = sorted({1, os.cpu_count() or 1}) # Число процессов для пакетного map
+MAP_BATCH_SIZE = 1000
+# --- Конец конфигурации ---
+
+
+def main():
+    dataset = load_from_disk(os.path.join(base_wiki_data_directory, BENCH_SPLIT))
+    subset = dataset.select(range(min(NUM_ARTICLES, len(dataset))))
+    print(f"Раздел '{BENCH_SPLIT}': {len(subset)} статей")
+    print("="*50)
+
+    t0 = time.time()
+    reference = [clean_wiki_text(decode_wiki40b_text(example.get('text'))) for example in subset]
+    loop_rate = len(subset) / (time.time() - t0)
+    print(f"{'цикл по примерам':<28} {loop_rate:>10.0f} статей/сек")
+
+    for num_proc in NUM_PROC_LEVELS:
+        t0 = time.time()
+        # Без кэша: каждый замер действительно очищает статьи
+        cleaned = map_cleaned_articles(subset, num_proc=num_proc, batch_size=MAP_BATCH_SIZE,
+                                       load_from_cache_file=False)['cleaned_text']
+        rate = len(subset) / (time.time() - t0)
+        status = "совпадает" if cleaned == reference else "РАСХОЖДЕНИЕ"
+        print(f"{f'Dataset.map, num_proc={num_proc}':<28} {rate:>10.0f} статей/сек (x{rate / loop_rate:.2f}, {status})")
+    print("="*50)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Время всего конвейера промежуточных файлов (этапы 5, 9, 10, 11, 12) в форматах JSONL, Parquet и Arrow IPC.
+Запросы к LMStudio и классификатор не запускаются: каждый этап делает те же чтения и записи,
+что и скрипт (columnar_io.py), на синтетических статьях во временной папке:
+  5  - запись отобранных статей (number, text);
+  9  - чтение классификации (3 колонки), выборка, заголовки выбранных статей, запись заголовков;
+  10 - чтение заголовков, начало текста выбранных статей, запись затравок;
+  11 - чтение затравок и запись частей по машинам (SPLIT_MODE = 'static');
+  12 - чтение частей (4 колонки).
+Для JSONL в время этапа 9 входит построение индекса номеров .numidx (первый запуск после этапа 5).
+Проверяется, что заголовки и начало текста совпадают во всех форматах.
+
+$ python benchmark_columnar_pipeline.py
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from columnar_io import (RecordWriter, open_article_numbers, read_article_heads, read_records,
+                         write_records, with_format)
+
+# --- Конфигурация ---
+NUM_ARTICLES = 20000     # Статей в файле этапа 5 (в реальном конвейере - около 300 тысяч, 1.6ГБ JSONL)
+SAMPLE_SIZE = 3000       # Статей, отбираемых на этапе 9
+MAX_CHARS = 1000         # Начало текста на этапе 10
+NUM_PARTS = 4            # Частей на этапе 11
+FORMATS = ['jsonl', 'parquet', 'arrow']
+SEED = 1337
+# --- Конец конфигурации ---
+
+CATEGORIES = ["Наука", "Технология", "История", "География", "Культура", "Спорт", "Биография", "Политика"]
+
+
+def synthetic_articles(num_articles, seed):
+    rng = random.Random(seed)
+    words = ["история", "город", "река", "год", "война", "музыка", "Москва", "наука", "область", "район",
+             "население", "century", "«цитата»", "—", "2024", "он", "была", "в", "и", "на"]
+    for number in range(num_articles):
+        body = " ".join(rng.choices(words, k=rng.randint(300, 1000)))
+        yield {"number": number, "text": f"Статья {number}\n{body}"}
+
+
+def classification_rows(num_articles, seed):
+    rng = random.Random(seed)
+    return [{"number": number, "predicted_category": rng.choice(CATEGORIES), "score": round(rng.random(), 4)}
+            for number in range(num_articles)]
+
+
+def run_pipeline(workdir, fmt, articles, classification):
+    """Этапы конвейера в формате fmt. Возвращает ({этап: секунды}, размер файла статей в МБ, записи частей для сверки)."""
+    def path(name):
+        return with_format(os.path.join(workdir, name + '.jsonl'), fmt)
+
+    times = {}
+
+    t0 = time.perf_counter()
+    write_records(path("selected_wiki_articles"), articles)
+    times['5: запись статей'] = time.perf_counter() - t0
+    write_records(path("classified_wiki_results"), classification) # результат классификатора, вне замера
+
+    t0 = time.perf_counter()
+    by_category = {}
+    for item in read_records(path("classified_wiki_results"), columns=['number', 'predicted_category', 'score']):
+        by_category.setdefault(item['predicted_category'], []).append(item['number'])
+    rng = random.Random(SEED)
+    per_category = SAMPLE_SIZE // len(by_category)
+    sampled = [(number, category) for category in sorted(by_category)
+               for number in rng.sample(by_category[category], min(per_category, len(by_category[category])))]
+    number_index = open_article_numbers(path("selected_wiki_articles"))
+    heads = read_article_heads(path("selected_wiki_articles"), [number for number, _ in sampled], number_index=number_index)
+    write_records(path("selected_wiki_titles"), ({'number': number, 'predicted_category': category,
+                                                  'title': heads[number]['title'] if number in heads else ""}
+                                                 for number, category in sampled))
+    times['9: выборка и заголовки'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    titles = list(read_records(path("selected_wiki_titles"), columns=['number', 'predicted_category', 'title']))
+    heads = read_article_heads(path("selected_wiki_articles"), [item['number'] for item in titles],
+                               max_chars=MAX_CHARS, number_index=number_index)
+    write_records(path("wiki_seeds_for_description"), (dict(item, beginning_of_text=heads[item['number']]['beginning_of_text'])
+                                                      for item in titles))
+    times['10: начало текста'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    seeds = list(read_records(path("wiki_seeds_for_description")))
+    part_size = -(-len(seeds) // NUM_PARTS)
+    for part in range(NUM_PARTS):
+        with RecordWriter(path(f"part_{part}")) as writer:
+            for item in seeds[part * part_size:(part + 1) * part_size]:
+                writer.write(item)
+    times['11: разделение'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    loaded = []
+    for part in range(NUM_PARTS):
+        loaded.extend(read_records(path(f"part_{part}"), columns=['number', 'predicted_category', 'title', 'beginning_of_text']))
+    times['12: чтение части'] = time.perf_counter() - t0
+
+    return times, os.path.getsize(path("selected_wiki_articles")) / 2**20, loaded
+
+
+def main():
+    # Статьи генерируются заранее: в замер этапа 5 входит только запись
+    articles = list(synthetic_articles(NUM_ARTICLES, SEED))
+    classification = classification_rows(NUM_ARTICLES, SEED)
+    results = {}
+    reference = None
+    for fmt in FORMATS:
+        workdir = tempfile.mkdtemp(prefix=f"columnar_{fmt}_")
+        try:
+            times, size_mb, loaded = run_pipeline(workdir, fmt, articles, classification)
+        except ImportError as e:
+            print(f"Формат '{fmt}' пропущен: {e}")
+            continue
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        reference = reference if reference is not None else loaded
+        results[fmt] = (times, size_mb, "совпадает" if loaded == reference else "РАСХОЖДЕНИЕ")
+
+    print(f"Статей: {NUM_ARTICLES}, отбирается: {SAMPLE_SIZE}, частей: {NUM_PARTS}")
+    print("="*50)
+    stages = list(next(iter(results.values()))[0])
+    print(f"{'этап':<26}" + "".join(f"{fmt:>12}" for fmt in results))
+    for stage in stages:
+        print(f"{stage:<26}" + "".join(f"{results[fmt][0][stage]:>11.2f}с" for fmt in results))
+    totals = {fmt: sum(results[fmt][0].values()) for fmt in results}
+    print(f"{'всего':<26}" + "".join(f"{totals[fmt]:>11.2f}с" for fmt in results))
+    print(f"{'всего без этапа 5':<26}" + "".join(f"{totals[fmt] - results[fmt][0][stages[0]]:>11.2f}с" for fmt in results))
+    print(f"{'файл статей, МБ':<26}" + "".join(f"{results[fmt][1]:>12.1f}" for fmt in results))
+    print(f"{'результат':<26}" + "".join(f"{results[fmt][2]:>12}" for fmt in results))
+    print("="*50)
+
+
+if __name__ == '__main__':
+    main()
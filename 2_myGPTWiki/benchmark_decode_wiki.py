@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Микробенчмарк разбора поля 'text' wiki40b (строка-литерал байтов b'...'):
+ast.literal_eval против wiki40b_text.decode_bytes_literal (codecs.escape_decode).
+Выводит статей/сек и МБ/сек литералов и проверяет побайтовое совпадение результатов.
+
+Статьи берутся из сохраненного датасета (если он есть), иначе генерируются синтетические
+русскоязычные статьи с маркерами wiki40b, переносами строк и кавычками.
+
+$ python benchmark_decode_wiki.py
+"""
+
+import ast
+import os
+import random
+import time
+
+from wiki40b_text import decode_bytes_literal
+
+# --- Конфигурация ---
+base_wiki_data_directory = "./google_wiki40b_ru"
+BENCH_SPLIT = 'validation'
+NUM_ARTICLES = 5000
+REPEATS = 3 # Лучшее время из нескольких повторов
+SEED = 1337
+# --- Конец конфигурации ---
+
+
+def synthetic_literals(num_articles, seed):
+    rng = random.Random(seed)
+    words = ["история", "город", "река", "год", "война", "музыка", "Москва", "наука", "«цитата»",
+             "O'Brien", 'он сказал "да"', "C:\\путь", "—", "2024", "e=mc²", "tab\there"]
+    literals = []
+    for _ in range(num_articles):
+        parts = ["_START_ARTICLE_\n", "Статья\n"]
+        for _ in range(rng.randint(2, 6)):
+            parts.append("_START_SECTION_\nРаздел\n_START_PARAGRAPH_\n")
+            parts.append(" ".join(rng.choice(words) for _ in range(rng.randint(200, 600))))
+            parts.append("_NEWLINE_")
+        literals.append(repr("".join(parts).encode('utf-8')))
+    return literals
+
+
+def dataset_literals(num_articles):
+    from datasets import load_from_disk
+    dataset = load_from_disk(os.path.join(base_wiki_data_directory, BENCH_SPLIT))
+    return [text for text in dataset.select(range(min(num_articles, len(dataset))))['text'] if isinstance(text, str)]
+
+
+def best_time(decode, literals):
+    best = None
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for literal in literals:
+            decode(literal)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    if os.path.isdir(os.path.join(base_wiki_data_directory, BENCH_SPLIT)):
+        literals = dataset_literals(NUM_ARTICLES)
+        source = f"{base_wiki_data_directory}/{BENCH_SPLIT}"
+    else:
+        literals = synthetic_literals(NUM_ARTICLES, SEED)
+        source = "синтетические статьи"
+    total_mb = sum(len(literal) for literal in literals) / 2**20
+    print(f"Источник: {source}, статей: {len(literals)}, объем литералов: {total_mb:.1f} МБ")
+
+    mismatches = sum(1 for literal in literals if decode_bytes_literal(literal) != ast.literal_eval(literal))
+    print(f"Побайтовое совпадение с ast.literal_eval: {len(literals) - mismatches}/{len(literals)}")
+
+    print("="*50)
+    baseline = None
+    for name, decode in [("ast.literal_eval", ast.literal_eval), ("decode_bytes_literal", decode_bytes_literal)]:
+        elapsed = best_time(decode, literals)
+        baseline = baseline or elapsed
+        print(f"{name:<22} {len(literals) / elapsed:>10.0f} статей/сек {total_mb / elapsed:>8.1f} МБ/сек (x{baseline / elapsed:.1f})")
+    print("="*50)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Замер пропускной способности параллельной генерации (как в 13_generate_articles.py)
+против локальной заглушки LMStudio. GPU и LMStudio не нужны.
+
+Вторая часть сравнивает фиксированный параллелизм с адаптивным контроллером нагрузки
+(AdaptiveRateController) на заглушке с ограниченным числом слотов генерации и короткой
+очередью: лишние запросы получают HTTP 503, как перегруженный сервер.
+
+$ python benchmark_generate_articles.py
+"""
+
+import time
+
+from lmstudio_client import AdaptiveRateController, create_session, post_chat_completion, extract_message_content, run_concurrently
+from mock_lmstudio_server import reset_mock_stats, start_mock_server
+
+# --- Конфигурация ---
+# Уровни параллелизма для сравнения
+CONCURRENCY_LEVELS = [1, 4, 16]
+# Количество "статей" на каждый уровень
+NUM_ARTICLES = 64
+# Задержка заглушки на один запрос (в секундах), имитирует время генерации статьи
+MOCK_LATENCY = 0.25
+# Заглушка для сравнения с адаптивным контроллером: слотов генерации и максимальная очередь
+MOCK_PARALLEL_SLOTS = 4
+MOCK_MAX_QUEUE = 2
+# Верхняя граница параллелизма для адаптивного контроллера
+ADAPTIVE_MAX_CONCURRENCY = 16
+# --- Конец Конфигурации ---
+
+
+def run_benchmark(api_url: str, concurrency: int, num_articles: int, rate_controller=None) -> float:
+    """Генерирует num_articles "статей" с заданным параллелизмом, возвращает статей/час."""
+    session = create_session(pool_size=concurrency)
+    items = [{'number': n, 'title': f"Статья {n}", 'description': "Описание"} for n in range(num_articles)]
+
+    def worker(item):
+        payload = {
+            "model": "mock-model",
+            "messages": [{"role": "user", "content": f"<title>{item['title']}</title>\n<description>{item['description']}</description>"}],
+        }
+        try:
+            return extract_message_content(post_chat_completion(session, api_url, payload, timeout=60, rate_controller=rate_controller))
+        except Exception:
+            return None # Ошибка API - статья не сгенерирована
+
+    start_time = time.perf_counter()
+    completed = 0
+    for item, text in run_concurrently(items, worker, concurrency):
+        if text:
+            completed += 1
+    elapsed = time.perf_counter() - start_time
+    session.close()
+
+    if completed != num_articles:
+        print(f"  Внимание: успешно только {completed}/{num_articles} запросов.")
+    return completed / elapsed * 3600
+
+
+if __name__ == "__main__":
+    server, base_url = start_mock_server(latency=MOCK_LATENCY)
+    api_url = f"{base_url}/chat/completions"
+    print("="*50)
+    print(f"Заглушка LMStudio: {base_url} (задержка {MOCK_LATENCY} сек/запрос)")
+    print(f"Статей на уровень: {NUM_ARTICLES}")
+    print("="*50)
+
+    baseline = None
+    for concurrency in CONCURRENCY_LEVELS:
+        articles_per_hour = run_benchmark(api_url, concurrency, NUM_ARTICLES)
+        baseline = baseline or articles_per_hour
+        print(f"  Параллелизм {concurrency:>3}: {articles_per_hour:>10.0f} статей/час (x{articles_per_hour / baseline:.2f})")
+
+    server.shutdown()
+
+    print("="*50)
+    print(f"Перегружаемая заглушка: {MOCK_PARALLEL_SLOTS} слота генерации, очередь до {MOCK_MAX_QUEUE}, сверх нее - HTTP 503")
+    print("="*50)
+    server, base_url = start_mock_server(latency=MOCK_LATENCY, parallel_slots=MOCK_PARALLEL_SLOTS, max_queue=MOCK_MAX_QUEUE)
+    api_url = f"{base_url}/chat/completions"
+
+    for concurrency in CONCURRENCY_LEVELS:
+        reset_mock_stats(server)
+        articles_per_hour = run_benchmark(api_url, concurrency, NUM_ARTICLES)
+        print(f"  Фиксированно {concurrency:>3}: {articles_per_hour:>10.0f} статей/час, отклонено сервером: {server.rejected}")
+
+    reset_mock_stats(server)
+    controller = AdaptiveRateController(max_concurrency=ADAPTIVE_MAX_CONCURRENCY, backoff_base=0.1)
+    articles_per_hour = run_benchmark(api_url, ADAPTIVE_MAX_CONCURRENCY, NUM_ARTICLES, rate_controller=controller)
+    print(f"  Адаптивно (до {ADAPTIVE_MAX_CONCURRENCY}): {articles_per_hour:>7.0f} статей/час, отклонено сервером: {server.rejected}")
+    print(f"    Состояние контроллера: {controller.format_stats()}")
+
+    server.shutdown()
+    print("="*50)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Набор замеров клиентов LMStudio без GPU: каждый скрипт генерации запускается как отдельный
+процесс во временной папке с подготовленными входными файлами против локальной заглушки
+(mock_lmstudio_server.py). Адрес заглушки передается через переменную окружения LMSTUDIO_API_URL.
+
+Для каждого скрипта выводится:
+- запросов/сек (успешных ответов заглушки за время работы скрипта),
+- p50/p99 задержки ответа, измеренные на стороне заглушки,
+- процессорное время клиента (user+sys дочернего процесса) всего и на один запрос.
+
+$ python benchmark_suite.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource # Только Unix; на Windows процессорное время клиента не измеряется
+except ImportError:
+    resource = None
+
+from mock_lmstudio_server import get_mock_stats, reset_mock_stats, start_mock_server
+
+# --- Конфигурация ---
+# Параметры заглушки
+MOCK_LATENCY = 0.05        # Задержка до первого токена (сек)
+MOCK_TOKEN_RATE = 2000     # Токенов/сек на один ответ
+MOCK_FAILURE_RATE = 0.02   # Доля ответов HTTP 500
+MOCK_THINK_CHARS = 300     # Длина блока <think> в каждом ответе
+MOCK_PARALLEL_SLOTS = 4    # Одновременно генерируемых ответов
+
+# Размер входных данных
+NUM_SEEDS = 60             # Затравок для 12_generate_descriptions.py и 13_generate_articles.py
+NUM_TITLES = 20            # Заголовков для get_articles_lmstudio.py
+NUM_THEMES = 3             # Тем для get_titles_lmstudio_json.py (между темами скрипт ждет REQUEST_DELAY)
+
+# Максимальное время работы одного скрипта (сек)
+SCRIPT_TIMEOUT = 600
+# --- Конец Конфигурации ---
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DISTR_DIR = os.path.join(SCRIPT_DIR, "..", "1_myGPTdistr")
+
+
+def write_jsonl(path, items):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+def prepare_titles(workdir):
+    os.makedirs(os.path.join(workdir, "themes"), exist_ok=True)
+    with open(os.path.join(workdir, "themes", "1.txt"), 'w', encoding='utf-8') as f:
+        for n in range(NUM_THEMES):
+            f.write(f"Тестовая тема {n}\n")
+
+
+def prepare_articles_distr(workdir):
+    os.makedirs(os.path.join(workdir, "titles_chunk1"), exist_ok=True)
+    items = [{"number": n, "title": f"Заголовок {n}", "description": "Описание статьи."} for n in range(1, NUM_TITLES + 1)]
+    with open(os.path.join(workdir, "titles_chunk1", "test.json"), 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False)
+
+
+def prepare_descriptions(workdir):
+    write_jsonl(os.path.join(workdir, "wiki_description_seeds_split", "part_3080_machine.jsonl"), [
+        {"number": n, "predicted_category": "Наука", "title": f"Заголовок {n}", "beginning_of_text": "Начало текста статьи."}
+        for n in range(NUM_SEEDS)
+    ])
+
+
+def prepare_articles_wiki(workdir):
+    write_jsonl(os.path.join(workdir, "wiki_seeds_with_descriptions", "part_3080.jsonl"), [
+        {"number": n, "title": f"Заголовок {n}", "description": "Описание статьи.", "description_status": "ok"}
+        for n in range(NUM_SEEDS)
+    ])
+
+
+# (название, путь к скрипту, функция подготовки входных файлов во временной папке)
+BENCHMARKS = [
+    ("get_titles_lmstudio_json", os.path.join(DISTR_DIR, "get_titles_lmstudio_json.py"), prepare_titles),
+    ("get_articles_lmstudio", os.path.join(DISTR_DIR, "get_articles_lmstudio.py"), prepare_articles_distr),
+    ("12_generate_descriptions", os.path.join(SCRIPT_DIR, "12_generate_descriptions.py"), prepare_descriptions),
+    ("13_generate_articles", os.path.join(SCRIPT_DIR, "13_generate_articles.py"), prepare_articles_wiki),
+]
+
+
+def get_children_cpu_time() -> float | None:
+    """Суммарное процессорное время (user+sys) завершенных дочерних процессов."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_script_benchmark(server, api_url, script_path, prepare) -> dict:
+    """Запускает один скрипт генерации против заглушки и возвращает замеры."""
+    with tempfile.TemporaryDirectory() as workdir:
+        prepare(workdir)
+        env = dict(os.environ, LMSTUDIO_API_URL=api_url, PYTHONIOENCODING="utf-8")
+        reset_mock_stats(server)
+        cpu_before = get_children_cpu_time()
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, script_path], cwd=workdir, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=SCRIPT_TIMEOUT)
+        elapsed = time.perf_counter() - start_time
+        cpu_after = get_children_cpu_time()
+
+    stats = get_mock_stats(server)
+    stats['elapsed'] = elapsed
+    stats['returncode'] = result.returncode
+    stats['output'] = result.stdout.decode('utf-8', errors='replace')
+    stats['cpu_time'] = cpu_after - cpu_before if cpu_before is not None else None
+    return stats
+
+
+if __name__ == "__main__":
+    server, base_url = start_mock_server(latency=MOCK_LATENCY, token_rate=MOCK_TOKEN_RATE, failure_rate=MOCK_FAILURE_RATE,
+                                         think_chars=MOCK_THINK_CHARS, parallel_slots=MOCK_PARALLEL_SLOTS)
+    api_url = f"{base_url}/chat/completions"
+    print("="*50)
+    print(f"Заглушка LMStudio: {base_url}")
+    print(f"  Задержка до первого токена: {MOCK_LATENCY} сек, скорость: {MOCK_TOKEN_RATE} токенов/сек, "
+          f"сбоев: {MOCK_FAILURE_RATE:.0%}, <think>: {MOCK_THINK_CHARS} символов, слотов: {MOCK_PARALLEL_SLOTS}")
+    print("="*50)
+
+    results = []
+    for name, script_path, prepare in BENCHMARKS:
+        print(f"Запуск {name}...")
+        try:
+            stats = run_script_benchmark(server, api_url, script_path, prepare)
+        except subprocess.TimeoutExpired:
+            print(f"  Превышено время ожидания ({SCRIPT_TIMEOUT} сек), скрипт пропущен.")
+            continue
+        if stats['returncode'] != 0:
+            print(f"  Скрипт завершился с кодом {stats['returncode']}. Последние строки вывода:")
+            for line in stats['output'].strip().splitlines()[-10:]:
+                print(f"    {line}")
+        results.append((name, stats))
+
+    print("\n" + "="*50)
+    print(f"{'Скрипт':<26} {'Время, с':>9} {'Ответов':>8} {'Сбоев':>6} {'Запр/с':>8} {'p50, с':>7} {'p99, с':>7} {'CPU, с':>7} {'CPU мс/запр':>11}")
+    for name, stats in results:
+        requests_per_second = stats['completed'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+        if stats['cpu_time'] is not None:
+            cpu_total = f"{stats['cpu_time']:.2f}"
+            cpu_per_request = f"{stats['cpu_time'] / stats['completed'] * 1000:.1f}" if stats['completed'] else "-"
+        else:
+            cpu_total = cpu_per_request = "н/д"
+        print(f"{name:<26} {stats['elapsed']:>9.2f} {stats['completed']:>8} {stats['failures'] + stats['rejected']:>6} "
+              f"{requests_per_second:>8.2f} {stats['p50_latency']:>7.3f} {stats['p99_latency']:>7.3f} {cpu_total:>7} {cpu_per_request:>11}")
+    print("="*50)
+    print("CPU - процессорное время клиента (включая запуск интерпретатора и импорт модулей).")
+
+    server.shutdown()
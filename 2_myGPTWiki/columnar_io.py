@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+Чтение и запись промежуточных файлов конвейера (скрипты 5, 9-13) в трех форматах:
+  'jsonl'   - прежний формат, по одному JSON-объекту в строке (.jsonl);
+  'parquet' - колоночный Parquet (.parquet): читаются только нужные колонки;
+  'arrow'   - файл Arrow IPC без сжатия (.arrow): открывается через memory map без копирования,
+              с диска читаются только страницы нужных колонок и строк.
+Формат определяется по расширению файла (detect_format). Для колоночных форматов нужен pyarrow
+(pip install pyarrow); он импортируется только при работе с такими файлами.
+
+    with RecordWriter("titles.parquet") as writer:
+        writer.write({'number': 1, 'predicted_category': 'Наука', 'title': 'Атом'})
+    for item in read_records("titles.parquet", columns=['number', 'title']):
+        ...
+
+Сравнение времени всего конвейера JSONL против колоночных форматов: benchmark_columnar_pipeline.py.
+"""
+
+import json
+import os
+
+FORMAT_EXTENSIONS = {'jsonl': '.jsonl', 'parquet': '.parquet', 'arrow': '.arrow'}
+_EXTENSION_FORMATS = {'.jsonl': 'jsonl', '.json': 'jsonl', '.parquet': 'parquet', '.arrow': 'arrow',
+                      '.feather': 'arrow', '.ipc': 'arrow'}
+WRITE_BATCH_ROWS = 10000 # Строк в одном пакете (row group Parquet / record batch Arrow) при записи
+READ_BATCH_ROWS = 10000  # Строк в одном пакете при чтении Parquet
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+        import pyarrow.compute
+    except ImportError:
+        raise ImportError("Для форматов 'parquet' и 'arrow' нужен pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def detect_format(path):
+    """'jsonl', 'parquet' или 'arrow' по расширению файла (ValueError для неизвестного расширения)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _EXTENSION_FORMATS:
+        raise ValueError(f"Неизвестный формат файла '{path}': ожидается одно из расширений {sorted(_EXTENSION_FORMATS)}")
+    return _EXTENSION_FORMATS[extension]
+
+
+def with_format(path, fmt):
+    """Тот же путь с расширением формата fmt: with_format('a/b.jsonl', 'parquet') -> 'a/b.parquet'."""
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Неизвестный формат '{fmt}': ожидается одно из {sorted(FORMAT_EXTENSIONS)}")
+    return os.path.splitext(path)[0] + FORMAT_EXTENSIONS[fmt]
+
+
+def resolve_input_path(path, fmt):
+    """
+    Входной файл этапа: вариант пути в формате fmt, если он существует, иначе path как есть
+    или вариант в другом формате (предыдущий этап мог быть запущен в другом формате).
+    Если не найден ни один, возвращается вариант в формате fmt (для сообщения об ошибке).
+    """
+    preferred = with_format(path, fmt)
+    for candidate in [preferred, path] + [with_format(path, other) for other in FORMAT_EXTENSIONS]:
+        if os.path.exists(candidate):
+            return candidate
+    return preferred
+
+
+class RecordWriter:
+    """
+    Запись словарей в файл JSONL, Parquet или Arrow IPC. Колонки и их типы берутся из первого пакета;
+    колонка, во всем первом пакете равная None, считается строковой.
+    """
+
+    def __init__(self, path, fmt=None, batch_rows=WRITE_BATCH_ROWS):
+        self.path = path
+        self.fmt = fmt or detect_format(path)
+        self.batch_rows = batch_rows
+        self.count = 0
+        self._rows = []
+        self._schema = None
+        self._writer = None
+        if self.fmt == 'jsonl':
+            self._file = open(path, 'w', encoding='utf-8')
+        else:
+            self._pa = _pyarrow()
+            self._file = None
+
+    def write(self, record):
+        self.count += 1
+        if self._file is not None:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            return
+        self._rows.append(record)
+        if len(self._rows) >= self.batch_rows:
+            self._flush()
+
+    def _flush(self):
+        pa = self._pa
+        rows, self._rows = self._rows, []
+        if self._schema is None:
+            table = pa.Table.from_pylist(rows)
+            self._schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                      for field in table.schema])
+            if self.fmt == 'parquet':
+                self._writer = pa.parquet.ParquetWriter(self.path, self._schema)
+            else:
+                self._sink = pa.OSFile(self.path, 'wb')
+                self._writer = pa.ipc.new_file(self._sink, self._schema)
+        if rows:
+            unknown = set().union(*(row.keys() for row in rows)).difference(self._schema.names)
+            if unknown:
+                raise ValueError(f"Колонки {sorted(unknown)} отсутствуют в первом пакете записей файла '{self.path}'")
+            self._writer.write_table(pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            return
+        if self._writer is None:
+            self._flush() # Ни одной записи не было: файл с пустой схемой
+        elif self._rows:
+            self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if self.fmt == 'arrow':
+                self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_records(path, records, fmt=None):
+    """Записывает все словари records в path. Возвращает число записей."""
+    with RecordWriter(path, fmt=fmt) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+def _iter_batches(path, fmt, columns):
+    """Пакеты pyarrow.RecordBatch колоночного файла; columns - только существующие в файле колонки."""
+    pa = _pyarrow()
+    if fmt == 'parquet':
+        parquet_file = pa.parquet.ParquetFile(path, memory_map=True)
+        names = parquet_file.schema_arrow.names
+        selected = None if columns is None else [name for name in columns if name in names]
+        yield from parquet_file.iter_batches(batch_size=READ_BATCH_ROWS, columns=selected)
+    else:
+        with pa.memory_map(path, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            names = reader.schema.names
+            indices = None if columns is None else [names.index(name) for name in columns if name in names]
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield batch if indices is None else batch.select(indices)
+
+
+def read_records(path, columns=None, bad_lines=None):
+    """
+    Словари записей файла по порядку. columns - список нужных колонок (None - все); отсутствующих
+    в файле колонок в словарях нет. Для JSONL некорректные строки пропускаются и добавляются
+    в список bad_lines как (номер строки, ошибка), если он передан, иначе вызывают исключение.
+    """
+    fmt = detect_format(path)
+    if fmt == 'jsonl':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_num, line in enumerate(f):
+                try:
+                    item = json.loads(line)
+                    if not isinstance(item, dict):
+                        raise ValueError("строка не является JSON-объектом")
+                except ValueError as e:
+                    if bad_lines is None:
+                        raise
+                    bad_lines.append((line_num + 1, e))
+                    continue
+                if columns is not None:
+                    item = {name: item[name] for name in columns if name in item}
+                yield item
+        return
+    for batch in _iter_batches(path, fmt, columns):
+        yield from batch.to_pylist()
+
+
+def count_records(path):
+    """Число записей: для колоночных форматов из метаданных файла, для JSONL - число непустых строк."""
+    fmt = detect_format(path)
+    if fmt == 'jsonl':
+        with open(path, 'rb') as f:
+            return sum(1 for line in f if line.strip())
+    pa = _pyarrow()
+    if fmt == 'parquet':
+        return pa.parquet.ParquetFile(path).metadata.num_rows
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+class ColumnarNumbers:
+    """Число статей колоночного файла статей (аналог jsonl_index.NumberIndex для Шага 2 скриптов 9-10)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._count = count_records(path)
+
+    def __len__(self):
+        return self._count
+
+
+def open_article_numbers(path):
+    """jsonl_index.NumberIndex для JSONL или ColumnarNumbers для файла Parquet/Arrow."""
+    if detect_format(path) == 'jsonl':
+        from jsonl_index import NumberIndex
+        return NumberIndex(path)
+    return ColumnarNumbers(path)
+
+
+def read_article_heads(path, numbers, max_chars=1000, number_index=None):
+    """
+    То же, что jsonl_index.read_article_heads, для файла статей любого формата. В Parquet/Arrow
+    сначала проверяется колонка 'number', и тексты читаются только у строк с нужными номерами.
+    """
+    fmt = detect_format(path)
+    from jsonl_index import article_head, read_article_heads as read_jsonl_article_heads
+    if fmt == 'jsonl':
+        return read_jsonl_article_heads(path, numbers, max_chars=max_chars, number_index=number_index)
+    pa = _pyarrow()
+    wanted = pa.array(sorted({number for number in numbers if type(number) is int}), type=pa.int64())
+    heads = {}
+    for batch in _iter_batches(path, fmt, ['number', 'text']):
+        mask = pa.compute.is_in(batch.column('number'), value_set=wanted)
+        selected = batch.filter(mask)
+        # Повторяющийся номер: остается последняя строка файла, как в jsonl_index.NumberIndex
+        for number, text in zip(selected.column('number').to_pylist(), selected.column('text').to_pylist()):
+            if isinstance(text, str):
+                heads[number] = article_head(text, max_chars)
+    return heads
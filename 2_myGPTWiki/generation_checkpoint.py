@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Возобновляемая запись результатов генерации в JSONL.
+
+Рядом с выходным файлом ведется индекс '<output>.done' - по одной строке
+"номер<TAB>статус<TAB>смещение_конца_записи" на каждую записанную запись.
+При перезапуске индекс читается целиком (он в сотни раз меньше самого JSONL),
+а сам выходной файл сканируется только "хвостом" - от последнего смещения,
+известного индексу, до конца файла. Полное сканирование выполняется лишь если
+индекса нет или он не согласуется с выходным файлом.
+"""
+
+import json
+import os
+
+
+def get_record_number(record: dict):
+    """Номер затравки из записи (в старых выходах 13-го скрипта он лежит только в original_seed_info)."""
+    number = record.get('number')
+    if number is None:
+        number = (record.get('original_seed_info') or {}).get('number')
+    return number
+
+
+class ResumableJsonlWriter:
+    """
+    Дописывает результаты в выходной JSONL и помнит, какие номера уже успешно обработаны.
+
+    Args:
+        output_path: Путь к выходному JSONL файлу.
+        status_key: Имя поля статуса в записи ('description_status', 'generation_status').
+        ok_status: Значение статуса, которое считается успешным (или кортеж таких значений).
+        resume: True - продолжить существующий файл, False - начать заново (перезаписать).
+
+    После создания в completed_numbers лежит множество номеров со статусом из ok_status.
+    """
+
+    def __init__(self, output_path: str, status_key: str, ok_status: str | tuple = 'ok', resume: bool = True):
+        self.output_path = output_path
+        self.index_path = output_path + '.done'
+        self.status_key = status_key
+        self.ok_statuses = (ok_status,) if isinstance(ok_status, str) else tuple(ok_status)
+        self.completed_numbers = set()
+        self.failed_numbers = set() # Номера, у которых есть только неуспешные записи
+        self.scanned_records = 0    # Сколько записей пришлось разобрать из самого JSONL при загрузке
+
+        if resume and os.path.exists(output_path):
+            self._load_existing()
+            self._outfile = open(output_path, 'ab')
+            self._indexfile = open(self.index_path, 'a', encoding='utf-8')
+        else:
+            self._outfile = open(output_path, 'wb')
+            self._indexfile = open(self.index_path, 'w', encoding='utf-8')
+        self._offset = self._outfile.tell()
+
+    # --- Загрузка состояния ---
+
+    def _load_existing(self):
+        output_size = os.path.getsize(self.output_path)
+        index_entries, indexed_offset = self._read_index()
+
+        if index_entries is None or indexed_offset > output_size:
+            # Индекса нет или выходной файл короче, чем думает индекс (файл заменен/обрезан) - полный пересчет
+            index_entries = []
+            indexed_offset = 0
+            with open(self.index_path, 'w', encoding='utf-8'):
+                pass # Индекс будет перестроен ниже
+
+        for number, status in index_entries:
+            self._register(number, status)
+
+        # Дочитываем хвост выходного файла, который не попал в индекс (сбой между записью строки и индекса)
+        tail_entries, valid_end = self._scan_output(indexed_offset)
+        if tail_entries:
+            with open(self.index_path, 'a', encoding='utf-8') as indexfile:
+                for number, status, end_offset in tail_entries:
+                    self._register(number, status)
+                    indexfile.write(f"{json.dumps(number)}\t{status}\t{end_offset}\n")
+
+        # Последняя строка могла быть записана не полностью - отрезаем ее, чтобы дописывать с чистой границы
+        if valid_end < output_size:
+            with open(self.output_path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def _read_index(self):
+        """Возвращает ([(номер, статус), ...], смещение конца последней проиндексированной записи) или (None, 0)."""
+        if not os.path.exists(self.index_path):
+            return None, 0
+        entries = []
+        last_offset = 0
+        valid_bytes = 0
+        with open(self.index_path, 'rb') as f:
+            for raw_line in f:
+                parts = raw_line.decode('utf-8', errors='replace').rstrip('\n').split('\t')
+                if not raw_line.endswith(b'\n') or len(parts) != 3:
+                    break # Оборванная последняя строка индекса - хвост выходного файла дочитаем сами
+                number_str, status, offset_str = parts
+                try:
+                    number = json.loads(number_str)
+                    offset = int(offset_str)
+                except ValueError:
+                    break
+                entries.append((number, status))
+                last_offset = offset
+                valid_bytes += len(raw_line)
+        if valid_bytes < os.path.getsize(self.index_path):
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return entries, last_offset
+
+    def _scan_output(self, start_offset: int):
+        """Разбирает выходной JSONL начиная с start_offset. Возвращает (записи, конец последней целой строки)."""
+        entries = []
+        valid_end = start_offset
+        with open(self.output_path, 'rb') as f:
+            f.seek(start_offset)
+            offset = start_offset
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    break # Неполная строка в конце файла
+                offset += len(raw_line)
+                valid_end = offset
+                self.scanned_records += 1
+                try:
+                    record = json.loads(raw_line)
+                except json.JSONDecodeError:
+                    continue
+                number = get_record_number(record)
+                if number is None:
+                    continue
+                entries.append((number, str(record.get(self.status_key)), offset))
+        return entries, valid_end
+
+    def _register(self, number, status):
+        if status in self.ok_statuses:
+            self.completed_numbers.add(number)
+            self.failed_numbers.discard(number)
+        elif number not in self.completed_numbers:
+            self.failed_numbers.add(number)
+
+    # --- Запись ---
+
+    def write(self, record: dict):
+        """Записывает одну запись в выходной файл и индекс (с немедленным сбросом на диск)."""
+        data = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        self._outfile.write(data)
+        self._outfile.flush()
+        self._offset += len(data)
+
+        number = get_record_number(record)
+        status = str(record.get(self.status_key))
+        self._register(number, status)
+        self._indexfile.write(f"{json.dumps(number)}\t{status}\t{self._offset}\n")
+        self._indexfile.flush()
+
+    def close(self):
+        self._outfile.close()
+        self._indexfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+Постоянный индекс байтовых смещений строк JSONL-файла для доступа к статье по номеру за O(1).
+
+Рядом с файлом data.jsonl сохраняется data.jsonl.idx:
+  заголовок (32 байта): b'JSONLIDX', размер JSONL-файла, mtime_ns JSONL-файла, число строк (uint64 little-endian),
+  затем массив uint64 - смещение начала каждой строки.
+Массив открывается через numpy.memmap и не читается в память целиком. Если размер или время
+изменения JSONL-файла не совпадают с заголовком, индекс строится заново (поиск b'\\n' в numpy по блокам).
+
+    index = JsonlIndex("selected_wiki_jsonl/selected_wiki_articles.jsonl")
+    len(index), index.read_json(12345)
+
+Для файлов статей с полем 'number' (selected_wiki_articles.jsonl) есть второй индекс - data.jsonl.numidx:
+тот же заголовок (с b'JSONLNUM'), затем отсортированные номера (int64) и смещения их строк (uint64).
+Номер ищется np.searchsorted; iter_articles_by_number/read_article_heads читают только нужные строки.
+
+$ python jsonl_index.py файл.jsonl [файл2.jsonl ...]   # построить/проверить индексы заранее
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'JSONLIDX'
+NUMBER_INDEX_SUFFIX = '.numidx'
+NUMBER_INDEX_MAGIC = b'JSONLNUM'
+_HEADER = struct.Struct('<8sQQQ')
+SCAN_BLOCK_BYTES = 64 * 1024 * 1024 # Сколько байт JSONL читать за раз при построении индекса
+
+
+def index_path_for(jsonl_path):
+    return jsonl_path + INDEX_SUFFIX
+
+
+def scan_line_offsets(jsonl_path, file_size):
+    """Смещения начала всех строк (включая пустые): 0 и позиции после каждого b'\\n', кроме конца файла."""
+    chunks = [np.zeros(1, dtype=np.uint64)] if file_size > 0 else []
+    with open(jsonl_path, 'rb') as f:
+        base = 0
+        while True:
+            block = f.read(SCAN_BLOCK_BYTES)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 0x0A)
+            chunks.append(newlines.astype(np.uint64) + np.uint64(base + 1))
+            base += len(block)
+    offsets = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint64)
+    if len(offsets) and offsets[-1] == file_size:
+        offsets = offsets[:-1] # файл заканчивается переводом строки - после него строки нет
+    return offsets
+
+
+def _read_header(index_path, expected_magic=INDEX_MAGIC, bytes_per_entry=8):
+    try:
+        with open(index_path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return None
+    if len(header) != _HEADER.size:
+        return None
+    magic, size, mtime_ns, count = _HEADER.unpack(header)
+    if magic != expected_magic or os.path.getsize(index_path) != _HEADER.size + bytes_per_entry * count:
+        return None
+    return size, mtime_ns, count
+
+
+def _write_index(index_path, magic, stat, count, arrays):
+    """Заголовок и массивы индекса во временный файл, затем os.replace. False, если сохранить не удалось."""
+    tmp_path = index_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(magic, stat.st_size, stat.st_mtime_ns, count))
+            for array in arrays:
+                f.write(array.tobytes())
+        os.replace(tmp_path, index_path)
+        return True
+    except OSError as e:
+        # Например, папка только для чтения: индекс останется в памяти на этот запуск
+        print(f"Предупреждение: не удалось сохранить индекс '{index_path}': {e}")
+        return False
+
+
+def build_index(jsonl_path, index_path=None, verbose=True):
+    """Строит индекс и сохраняет его в index_path (через временный файл). Возвращает массив смещений."""
+    index_path = index_path or index_path_for(jsonl_path)
+    stat = os.stat(jsonl_path)
+    t0 = time.time()
+    offsets = scan_line_offsets(jsonl_path, stat.st_size)
+    if os.stat(jsonl_path).st_mtime_ns != stat.st_mtime_ns:
+        # Файл дописывался во время сканирования - такой индекс не сохраняем
+        print(f"Предупреждение: '{jsonl_path}' изменился во время построения индекса, индекс не сохранен.")
+        return offsets
+    _write_index(index_path, INDEX_MAGIC, stat, len(offsets), [offsets.astype('<u8')])
+    if verbose:
+        print(f"Индекс '{index_path}' построен: {len(offsets)} строк за {time.time() - t0:.1f} сек.")
+    return offsets
+
+
+def load_offsets(jsonl_path, verbose=True):
+    """Смещения строк jsonl_path: memmap сохраненного индекса, если он актуален, иначе новый индекс."""
+    index_path = index_path_for(jsonl_path)
+    stat = os.stat(jsonl_path)
+    header = _read_header(index_path)
+    if header is not None and header[0] == stat.st_size and header[1] == stat.st_mtime_ns:
+        if header[2] == 0:
+            return np.zeros(0, dtype=np.uint64)
+        return np.memmap(index_path, dtype='<u8', mode='r', offset=_HEADER.size, shape=(header[2],))
+    if verbose and header is not None:
+        print(f"Индекс '{index_path}' устарел (файл изменился), перестраиваем...")
+    return build_index(jsonl_path, index_path, verbose=verbose)
+
+
+class JsonlIndex:
+    """Доступ к строкам JSONL-файла по номеру через сохраненный индекс смещений."""
+
+    def __init__(self, jsonl_path, verbose=True):
+        self.path = jsonl_path
+        self.offsets = load_offsets(jsonl_path, verbose=verbose)
+        self.file_size = os.path.getsize(jsonl_path)
+        self._file = open(jsonl_path, 'rb')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_line(self, index):
+        """Байты строки с номером index (без перевода строки)."""
+        if not 0 <= index < len(self.offsets):
+            raise IndexError(f"Индекс {index} вне диапазона (0 - {len(self.offsets) - 1})")
+        start = int(self.offsets[index])
+        end = int(self.offsets[index + 1]) if index + 1 < len(self.offsets) else self.file_size
+        self._file.seek(start)
+        return self._file.read(end - start).rstrip(b'\r\n')
+
+    def read_json(self, index):
+        """Разобранный JSON-объект строки index (json.JSONDecodeError для некорректной строки)."""
+        return json.loads(self.read_line(index))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_NUMBER_PREFIX = b'{"number": '
+
+
+def _line_number(line):
+    """Поле 'number' строки JSONL (bytes) или None. Строки из 5_select_and_save_wiki.py начинаются с {"number": N,"""
+    if line.startswith(_NUMBER_PREFIX):
+        end = line.find(b',', len(_NUMBER_PREFIX))
+        if end != -1:
+            try:
+                return int(line[len(_NUMBER_PREFIX):end])
+            except ValueError:
+                pass
+    try:
+        number = json.loads(line).get('number')
+    except (ValueError, AttributeError):
+        return None
+    return number if type(number) is int else None
+
+
+def build_number_index(jsonl_path, index_path=None, verbose=True):
+    """Один потоковый проход по JSONL: номер -> смещение строки. Возвращает (номера, смещения), отсортированные по номеру."""
+    index_path = index_path or jsonl_path + NUMBER_INDEX_SUFFIX
+    stat = os.stat(jsonl_path)
+    t0 = time.time()
+    numbers = []
+    offsets = []
+    bad_lines = 0
+    with open(jsonl_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            number = _line_number(line)
+            if number is None:
+                if line.strip():
+                    bad_lines += 1
+            else:
+                numbers.append(number)
+                offsets.append(offset)
+            offset += len(line)
+    numbers = np.array(numbers, dtype='<i8')
+    offsets = np.array(offsets, dtype='<u8')
+    # Стабильная сортировка: для повторяющегося номера последней остается последняя строка файла
+    order = np.argsort(numbers, kind='stable')
+    numbers, offsets = numbers[order], offsets[order]
+    if os.stat(jsonl_path).st_mtime_ns == stat.st_mtime_ns:
+        _write_index(index_path, NUMBER_INDEX_MAGIC, stat, len(numbers), [numbers, offsets])
+    if verbose:
+        print(f"Индекс номеров '{index_path}' построен: {len(numbers)} статей за {time.time() - t0:.1f} сек."
+              + (f" Строк без номера или с ошибкой JSON: {bad_lines}" if bad_lines else ""))
+    return numbers, offsets
+
+
+class NumberIndex:
+    """Смещение строки JSONL по полю 'number' (файл .numidx рядом с JSONL, перестраивается при изменении файла)."""
+
+    def __init__(self, jsonl_path, verbose=True):
+        self.path = jsonl_path
+        index_path = jsonl_path + NUMBER_INDEX_SUFFIX
+        stat = os.stat(jsonl_path)
+        header = _read_header(index_path, NUMBER_INDEX_MAGIC, bytes_per_entry=16)
+        if header is not None and header[0] == stat.st_size and header[1] == stat.st_mtime_ns:
+            count = header[2]
+            if count == 0:
+                self.numbers = np.zeros(0, dtype='<i8')
+                self.offsets = np.zeros(0, dtype='<u8')
+            else:
+                self.numbers = np.memmap(index_path, dtype='<i8', mode='r', offset=_HEADER.size, shape=(count,))
+                self.offsets = np.memmap(index_path, dtype='<u8', mode='r', offset=_HEADER.size + 8 * count, shape=(count,))
+        else:
+            if verbose and header is not None:
+                print(f"Индекс номеров '{index_path}' устарел (файл изменился), перестраиваем...")
+            self.numbers, self.offsets = build_number_index(jsonl_path, index_path, verbose=verbose)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def offset_of(self, number):
+        """Смещение строки статьи number или None, если такого номера нет."""
+        i = int(np.searchsorted(self.numbers, number, side='right')) - 1
+        if i < 0 or self.numbers[i] != number:
+            return None
+        return int(self.offsets[i])
+
+
+def iter_articles_by_number(jsonl_path, numbers, number_index=None, verbose=True):
+    """
+    (номер, текст) для запрошенных номеров: строки читаются по смещениям в порядке файла,
+    в памяти одновременно только одна статья. Отсутствующие номера и строки без текста пропускаются.
+    """
+    number_index = number_index or NumberIndex(jsonl_path, verbose=verbose)
+    located = []
+    for number in set(numbers):
+        offset = number_index.offset_of(number)
+        if offset is not None:
+            located.append((offset, number))
+    located.sort()
+    with open(jsonl_path, 'rb') as f:
+        for offset, number in located:
+            f.seek(offset)
+            try:
+                text = json.loads(f.readline()).get('text')
+            except ValueError:
+                continue
+            if isinstance(text, str):
+                yield number, text
+
+
+def article_head(text, max_chars=1000):
+    """
+    {'title': первая строка текста, 'beginning_of_text': до max_chars символов после первой строки
+    (пусто, если перевода строки нет)}. Общая для файлов статей JSONL и Parquet/Arrow (columnar_io.py).
+    """
+    first_newline_pos = text.find('\n')
+    if first_newline_pos != -1:
+        return {'title': text[:first_newline_pos].strip(),
+                'beginning_of_text': text[first_newline_pos + 1:].strip()[:max_chars]}
+    return {'title': text.strip(), 'beginning_of_text': ""}
+
+
+def read_article_heads(jsonl_path, numbers, max_chars=1000, number_index=None, verbose=True):
+    """
+    Для каждого найденного номера - article_head(текст, max_chars). Полные тексты в памяти не хранятся.
+    """
+    return {number: article_head(text, max_chars)
+            for number, text in iter_articles_by_number(jsonl_path, numbers, number_index=number_index, verbose=verbose)}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Использование: python jsonl_index.py файл.jsonl [файл2.jsonl ...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        with JsonlIndex(path) as index:
+            print(f"{path}: {len(index)} строк, индекс: {index_path_for(path)}")
@@ -0,0 +1,557 @@
+# -*- coding: utf-8 -*-
+
+"""
+Общий клиент для OpenAI-совместимого API LMStudio (/v1/chat/completions).
+
+Используется скриптами генерации (12_generate_descriptions.py, 13_generate_articles.py
+и др.), чтобы держать несколько запросов "в полёте" одновременно через пул соединений
+одной HTTP-сессии, а не ждать каждый ответ по очереди.
+
+Здесь же - необязательный дисковый кэш ответов (ResponseCache): повторный запуск скрипта
+с теми же промптами получает ответы из кэша, не обращаясь к модели.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size: int = 16) -> requests.Session:
+    """
+    Создает HTTP-сессию с пулом соединений нужного размера.
+
+    Args:
+        pool_size: Максимальное количество одновременно открытых соединений к API.
+
+    Returns:
+        requests.Session: Сессия, которую можно безопасно использовать из нескольких потоков.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_models_url(api_url: str) -> str:
+    """Возвращает адрес /v1/models по адресу /v1/chat/completions (для проверки доступности API)."""
+    if '/chat/completions' in api_url:
+        return api_url.rsplit('/chat/completions', 1)[0] + '/models'
+    return api_url.rsplit('/', 1)[0] + '/models'
+
+
+def resolve_model_identity(api_url: str, payload_model: str | None, session: requests.Session | None = None,
+                           timeout: float = 10) -> str:
+    """
+    Имя модели, которая на самом деле ответит на запросы (для ключа ResponseCache).
+
+    LM Studio отвечает загруженной моделью и игнорирует неизвестное имя "model" в payload (например,
+    "gpt-3.5-turbo"), поэтому имя из payload принимается, только если сервер его знает (GET /v1/models).
+    Иначе берется единственная модель из списка. Если моделей несколько, а имя в payload не из списка,
+    модель определить нельзя - ValueError (кэш в таком случае включать нельзя).
+    """
+    response = (session or requests).get(get_models_url(api_url), timeout=timeout)
+    response.raise_for_status()
+    model_ids = sorted(item['id'] for item in response.json().get('data', []) if item.get('id'))
+    if payload_model in model_ids:
+        return payload_model
+    if len(model_ids) == 1:
+        return model_ids[0]
+    raise ValueError(f"модель '{payload_model}' не найдена среди моделей сервера {model_ids}; "
+                     f"укажите в payload точное имя загруженной модели")
+
+
+def post_chat_completion(session: requests.Session | None, api_url: str, payload: dict, timeout: float | None = None,
+                         cache: "ResponseCache | None" = None,
+                         rate_controller: "AdaptiveRateController | None" = None) -> dict:
+    """
+    Отправляет один запрос к /v1/chat/completions и возвращает распарсенный JSON ответа.
+
+    Исключения requests (соединение, таймаут, HTTP 4xx/5xx) пробрасываются вызывающему коду,
+    чтобы он мог выставить статус 'api_error'.
+
+    Args:
+        session: HTTP-сессия (None - отдельный запрос через requests.post).
+        cache: Кэш ответов. Если ответ на такой же payload уже есть в кэше, запрос к API не отправляется.
+        rate_controller: Контроллер нагрузки (лимит одновременных запросов, паузы, повторы после временных ошибок).
+    """
+    if cache is not None:
+        cached_response = cache.get(payload)
+        if cached_response is not None:
+            return cached_response
+
+    def send_request():
+        response = (session or requests).post(api_url, json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    response_json = rate_controller.call(send_request) if rate_controller is not None else send_request()
+
+    # Кэшируем только ответы с текстом, чтобы не закрепить в кэше случайный сбой модели
+    if cache is not None and extract_message_content(response_json) is not None:
+        cache.put(payload, response_json)
+    return response_json
+
+
+def stream_chat_completion(session: requests.Session | None, api_url: str, payload: dict, timeout: float | None = None,
+                           cache: "ResponseCache | None" = None, max_think_chars: int = 0,
+                           max_output_chars: int = 0,
+                           rate_controller: "AdaptiveRateController | None" = None) -> tuple[dict, str | None]:
+    """
+    Отправляет запрос с "stream": true и читает ответ по частям (Server-Sent Events).
+
+    Если рассуждения модели (<think>...</think> или поле reasoning_content) превышают
+    max_think_chars символов, либо весь вывод превышает max_output_chars, соединение
+    разрывается - LMStudio прекращает генерацию и освобождает GPU для следующего запроса.
+    0 - без ограничения. Кэш и контроллер нагрузки - как в post_chat_completion.
+
+    Returns:
+        tuple: (response_json, abort_reason). response_json собран в формате обычного
+               (непотокового) ответа, поэтому с ним работает extract_message_content.
+               abort_reason - None, 'think_overflow' или 'output_overflow'.
+    """
+    if cache is not None:
+        cached_response = cache.get(payload)
+        if cached_response is not None:
+            return cached_response, None
+
+    def send_request():
+        return _read_stream(session, api_url, payload, timeout, max_think_chars, max_output_chars)
+
+    response_json, abort_reason = rate_controller.call(send_request) if rate_controller is not None else send_request()
+
+    if cache is not None and abort_reason is None and response_json["choices"][0]["message"]["content"]:
+        cache.put(payload, response_json)
+    return response_json, abort_reason
+
+
+def _read_stream(session, api_url, payload, timeout, max_think_chars, max_output_chars):
+    stream_payload = dict(payload, stream=True)
+    content_parts = []
+    reasoning_parts = []
+    output_chars = 0
+    reasoning_chars = 0
+    finish_reason = None
+    abort_reason = None
+    think_tracker = _ThinkTracker()
+
+    response = (session or requests).post(api_url, json=stream_payload, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        for raw_line in response.iter_lines():
+            # Формат SSE: "data: {...}", завершение - "data: [DONE]"
+            if not raw_line.startswith(b"data:"):
+                continue
+            data = raw_line[5:].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json.loads(data)
+            if not chunk.get('choices'):
+                continue
+            choice = chunk['choices'][0]
+            delta = choice.get('delta') or {}
+            content = delta.get('content')
+            if content:
+                content_parts.append(content)
+                output_chars += len(content)
+                think_tracker.feed(content)
+            reasoning = delta.get('reasoning_content')
+            if reasoning:
+                reasoning_parts.append(reasoning)
+                reasoning_chars += len(reasoning)
+            finish_reason = choice.get('finish_reason') or finish_reason
+
+            if max_think_chars and reasoning_chars + think_tracker.think_chars > max_think_chars:
+                abort_reason = "think_overflow"
+                break
+            if max_output_chars and output_chars + reasoning_chars > max_output_chars:
+                abort_reason = "output_overflow"
+                break
+    finally:
+        # При досрочном выходе закрытие ответа разрывает соединение, и сервер прекращает генерацию
+        response.close()
+
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if reasoning_parts:
+        message["reasoning_content"] = "".join(reasoning_parts)
+    response_json = {
+        "object": "chat.completion",
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": abort_reason or finish_reason}],
+    }
+    return response_json, abort_reason
+
+
+class _ThinkTracker:
+    """Считает символы внутри блоков <think>...</think> по мере поступления текста (теги могут быть разрезаны между частями)."""
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.in_think = False
+        self.think_chars = 0
+        self._tail = "" # Конец предыдущей части, в котором может начинаться тег
+
+    def feed(self, text: str):
+        data = self._tail + text
+        pos = 0
+        while True:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = data.find(tag, pos)
+            if index == -1:
+                break
+            if self.in_think:
+                self.think_chars += index - pos
+            pos = index + len(tag)
+            self.in_think = not self.in_think
+        # Последние символы придерживаем до следующей части - там может быть начало тега
+        keep = min(len(data) - pos, len(self.CLOSE_TAG) - 1)
+        if self.in_think:
+            self.think_chars += len(data) - pos - keep
+        self._tail = data[len(data) - keep:]
+
+
+def extract_message_content(response_json: dict) -> str | None:
+    """
+    Извлекает текст ответа модели из стандартной структуры choices[0].message.content.
+
+    Returns:
+        str | None: Текст ответа или None, если структура ответа неожиданная.
+    """
+    if response_json and 'choices' in response_json and len(response_json['choices']) > 0:
+        message = response_json['choices'][0].get('message') or {}
+        content = message.get('content')
+        if isinstance(content, str):
+            return content
+    return None
+
+
+def run_concurrently(items: list, worker, concurrency: int):
+    """
+    Выполняет worker(item) для всех элементов, держа не более concurrency задач одновременно.
+
+    Результаты отдаются по мере готовности (НЕ в исходном порядке), поэтому каждый
+    результат должен сам нести идентификатор затравки (например, поле 'number').
+    Новые задачи ставятся в очередь только по мере освобождения слотов, так что
+    память не растет вместе с количеством элементов.
+
+    Yields:
+        tuple: (item, result) для каждого обработанного элемента.
+    """
+    concurrency = max(1, int(concurrency))
+    items_iter = iter(items)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        for item in items_iter:
+            in_flight[executor.submit(worker, item)] = item
+            if len(in_flight) >= concurrency:
+                break
+
+        while in_flight:
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                yield item, future.result()
+                # Освободился слот - отправляем следующую затравку
+                next_item = next(items_iter, None)
+                if next_item is not None:
+                    in_flight[executor.submit(worker, next_item)] = next_item
+
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Можно ли повторить запрос после этой ошибки (сбой соединения, таймаут, перегрузка сервера)."""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+class AdaptiveRateController:
+    """
+    Подбирает количество одновременных запросов и паузу между ними по наблюдаемой
+    задержке ответов и ошибкам API (AIMD - аддитивное увеличение, мультипликативное уменьшение).
+
+    - Успешный ответ с обычной задержкой: лимит одновременных запросов растет примерно
+      на 1 за каждые limit ответов, пауза между запросами уменьшается на delay_step.
+    - Задержка заметно выросла относительно базовой (запросы стоят в очереди сервера):
+      лимит умножается на 0.75, пауза увеличивается на delay_step.
+    - Ошибка API: лимит уменьшается вдвое, пауза удваивается.
+    Уменьшения выполняются не чаще одного раза за время ответа, чтобы один всплеск
+    не обрушил лимит до минимума.
+
+    Ошибки, после которых имеет смысл повторить запрос (соединение, таймаут, HTTP 429/5xx),
+    повторяются с экспоненциальной паузой до max_retries раз.
+
+    Потокобезопасен: один контроллер используется всеми потоками run_concurrently.
+
+    Args:
+        max_concurrency: Верхняя граница одновременных запросов (размер пула потоков).
+        min_concurrency: Нижняя граница одновременных запросов.
+        initial_concurrency: Начальный лимит (по умолчанию - min_concurrency).
+        initial_delay: Начальная пауза между стартами запросов (в секундах).
+        max_delay: Максимальная пауза между стартами запросов (в секундах).
+        delay_step: Шаг аддитивного изменения паузы (в секундах).
+        latency_tolerance: Во сколько раз задержка может превысить базовую, прежде чем считать сервер перегруженным.
+        max_retries: Сколько раз повторять запрос после временной ошибки.
+        backoff_base: Пауза перед первым повтором (в секундах), дальше удваивается.
+        backoff_max: Максимальная пауза перед повтором (в секундах).
+        adaptive: False - фиксированные лимит (max_concurrency) и пауза (initial_delay), только повторы.
+    """
+
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1, initial_concurrency: int | None = None,
+                 initial_delay: float = 0.0, max_delay: float = 5.0, delay_step: float = 0.05,
+                 latency_tolerance: float = 2.0, max_retries: int = 4, backoff_base: float = 2.0,
+                 backoff_max: float = 60.0, adaptive: bool = True):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.adaptive = adaptive
+        if not adaptive:
+            initial_concurrency = self.max_concurrency
+        elif initial_concurrency is None:
+            initial_concurrency = self.min_concurrency
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.delay = initial_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.baseline_latency = None # Задержка ненагруженного сервера (медленно отслеживаемый минимум)
+        self.recent_latency = None   # Сглаженная текущая задержка
+        self.requests_count = 0
+        self.errors_count = 0
+        self.retries_count = 0
+        self.decreases_count = 0
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._next_start = 0.0
+        self._last_decrease = 0.0
+
+    def call(self, request_fn):
+        """
+        Выполняет request_fn() с учетом лимита, паузы и повторов.
+
+        Returns:
+            Результат request_fn().
+
+        Raises:
+            Последнее исключение request_fn(), если все попытки неудачны или ошибку нельзя повторить.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            start_time = time.monotonic()
+            try:
+                result = request_fn()
+            except Exception as e:
+                self._release(time.monotonic() - start_time, error=isinstance(e, requests.exceptions.RequestException))
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                with self._cond:
+                    self.retries_count += 1
+                time.sleep(min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                attempt += 1
+                continue
+            self._release(time.monotonic() - start_time, error=False)
+            return result
+
+    def _acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+            # Равномерно разносим старты запросов на self.delay секунд
+            now = time.monotonic()
+            wait_time = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.delay
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def _release(self, latency: float, error: bool):
+        with self._cond:
+            self._in_flight -= 1
+            self.requests_count += 1
+            if error:
+                self.errors_count += 1
+            if self.adaptive:
+                self._adjust(latency, error)
+            self._cond.notify_all()
+
+    def _adjust(self, latency: float, error: bool):
+        now = time.monotonic()
+        can_decrease = now - self._last_decrease > (self.recent_latency or 0.0)
+
+        if error:
+            if can_decrease:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self.delay = min(self.max_delay, max(self.delay * 2, self.delay_step))
+                self._last_decrease = now
+                self.decreases_count += 1
+            return
+
+        if self.baseline_latency is None:
+            self.baseline_latency = self.recent_latency = latency
+        else:
+            # Базовая задержка сразу опускается до нового минимума и медленно поднимается (длина ответов меняется)
+            self.baseline_latency = min(latency, self.baseline_latency + 0.01 * (latency - self.baseline_latency))
+            self.recent_latency += 0.2 * (latency - self.recent_latency)
+
+        if self.recent_latency > self.baseline_latency * self.latency_tolerance:
+            if can_decrease:
+                self.limit = max(self.min_concurrency, self.limit * 0.75)
+                self.delay = min(self.max_delay, self.delay + self.delay_step)
+                self._last_decrease = now
+                self.decreases_count += 1
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.delay = max(0.0, self.delay - self.delay_step)
+
+    def format_stats(self) -> str:
+        """Строка с текущим состоянием контроллера для вывода прогресса."""
+        with self._cond:
+            latency = f"{self.recent_latency:.2f}" if self.recent_latency is not None else "-"
+            return (f"лимит запросов {int(self.limit)}/{self.max_concurrency}, пауза {self.delay:.2f} сек, "
+                    f"задержка ответа {latency} сек, ошибок {self.errors_count}, повторов {self.retries_count}")
+
+class ResponseCache:
+    """
+    Дисковый кэш ответов API (SQLite-файл), адресуемый по содержимому запроса.
+
+    Ключ - SHA-256 от канонического JSON всего payload (модель, сообщения, параметры генерации)
+    и model_identity - имени модели, которая действительно отвечает (resolve_model_identity):
+    LM Studio игнорирует заглушку "model" в payload, и без него после смены загруженной модели кэш
+    отдавал бы ответы прежней. Любое изменение промпта, параметров или модели дает новый ключ, а повторный
+    одинаковый запрос обслуживается локально. При превышении max_bytes вытесняются записи,
+    к которым дольше всего не обращались (LRU).
+
+    Потокобезопасен: можно использовать из run_concurrently.
+
+    Args:
+        path: Путь к файлу кэша (создается, если не существует).
+        max_bytes: Максимальный суммарный размер сохраненных ответов в байтах.
+        model_identity: Имя модели, отвечающей на запросы (результат resolve_model_identity).
+    """
+
+    # Поля payload, которые не влияют на текст ответа
+    IGNORED_PAYLOAD_KEYS = ("stream",)
+
+    def __init__(self, path: str, model_identity: str, max_bytes: int = 1024 * 1024 * 1024):
+        if not model_identity:
+            raise ValueError("ResponseCache: не задано имя модели, отвечающей на запросы (model_identity)")
+        self.path = path
+        self.model_identity = model_identity
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def make_key(self, payload: dict) -> str:
+        """Ключ кэша для payload запроса к модели model_identity."""
+        canonical = {k: v for k, v in payload.items() if k not in self.IGNORED_PAYLOAD_KEYS}
+        canonical = {'payload': canonical, 'model_identity': self.model_identity}
+        data = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, payload: dict) -> dict | None:
+        """Возвращает сохраненный ответ на такой же payload или None."""
+        key = self.make_key(payload)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, payload: dict, response_json: dict):
+        """Сохраняет ответ и при необходимости вытесняет самые давно использованные записи."""
+        key = self.make_key(payload)
+        data = json.dumps(response_json, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Удаляем самые давно использованные записи, пока не освободим место (с запасом 10%, чтобы не вытеснять на каждой записи)
+        target_bytes = int(self.max_bytes * 0.9)
+        self._conn.execute("BEGIN")
+        while self._total_bytes > target_bytes:
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                break
+            evicted_keys = []
+            for key, size in rows:
+                if self._total_bytes <= target_bytes:
+                    break
+                evicted_keys.append((key,))
+                self._total_bytes -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+            self.evictions += len(evicted_keys)
+        self._conn.execute("COMMIT")
+
+    def format_stats(self) -> str:
+        """Строка со статистикой кэша для вывода в конце работы скрипта."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return (f"Кэш ответов '{self.path}': попаданий {self.hits}, промахов {self.misses} ({hit_rate:.1f}% попаданий), "
+                f"вытеснено {self.evictions}, записей {entries}, размер {self._total_bytes / 1024 / 1024:.1f} МБ")
+
+    def close(self):
+        self._conn.close()
+
+
+def open_response_cache(path: str | None, api_url: str, payload_model: str | None, max_bytes: int,
+                        session: requests.Session | None = None) -> ResponseCache | None:
+    """
+    ResponseCache для модели, которая действительно отвечает на api_url, или None: если path не задан
+    или модель определить не удалось (тогда кэш отключается с предупреждением, а не отдает чужие ответы).
+    """
+    if not path:
+        return None
+    try:
+        model_identity = resolve_model_identity(api_url, payload_model, session=session)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"Предупреждение: кэш ответов '{path}' отключен - не удалось определить модель сервера: {e}")
+        return None
+    cache = ResponseCache(path, model_identity, max_bytes=max_bytes)
+    print(f"Кэш ответов: '{path}' (до {max_bytes // (1024 * 1024)} МБ), модель '{model_identity}'")
+    return cache
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Локальная заглушка OpenAI-совместимого API LMStudio для замеров скорости клиентов без GPU.
+
+Отвечает на GET /v1/models и POST /v1/chat/completions фиксированным текстом
+после искусственной задержки, имитирующей время генерации. При "stream": true
+ответ отдается по частям в формате Server-Sent Events, как у LMStudio.
+На промпты, требующие JSON (get_titles_lmstudio_json.py), отвечает JSON-массивом.
+
+Настраивается: задержка до первого токена, скорость генерации (токенов/сек), доля
+ответов с ошибкой HTTP 500, блок <think> перед ответом, количество слотов генерации.
+Сервер сам собирает статистику задержек (см. get_mock_stats), которую использует benchmark_suite.py.
+
+Запуск отдельно:
+$ python mock_lmstudio_server.py --latency 0.2 --token-rate 50 --failure-rate 0.05 --think-chars 500
+после чего в скриптах генерации можно указать LMSTUDIO_API_URL = "http://localhost:1235/v1/chat/completions"
+(или задать переменную окружения LMSTUDIO_API_URL).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Конфигурация (для запуска как отдельного скрипта, значения по умолчанию для аргументов) ---
+HOST = "127.0.0.1"
+PORT = 1235
+# Задержка ответа на один запрос (в секундах). При TOKEN_RATE > 0 - задержка до первого токена
+LATENCY = 0.5
+# Скорость генерации (токенов в секунду), 0 - время генерации задается только LATENCY
+TOKEN_RATE = 0
+# Доля запросов, на которые заглушка отвечает HTTP 500 (0.0 - 1.0)
+FAILURE_RATE = 0.0
+# Длина блока <think>...</think> перед текстом статьи (в символах), 0 - без рассуждений.
+# Большое значение имитирует "зацикливание" модели в рассуждениях.
+THINK_CHARS = 0
+# Количество одновременно генерируемых ответов (как parallel в LMStudio), 0 - без ограничения.
+# Остальные запросы ждут в очереди, и их задержка растет.
+PARALLEL_SLOTS = 0
+# Максимальная длина очереди ожидающих запросов, сверх нее - HTTP 503 (0 - без ограничения)
+MAX_QUEUE = 0
+# --- Конец Конфигурации ---
+
+MOCK_ARTICLE_TEXT = (
+    "Это тестовый текст статьи, сгенерированный заглушкой LMStudio. "
+    "Он нужен только для замеров пропускной способности клиента.\n\n"
+) * 5
+
+# Размер одной части потокового ответа (в символах)
+STREAM_CHUNK_CHARS = 16
+# Среднее количество символов русского текста на один токен (для имитации TOKEN_RATE)
+CHARS_PER_TOKEN = 3
+
+# Количество элементов в промпте get_titles_lmstudio_json.py ("Сгенерируй ровно 20 объектов")
+JSON_ITEMS_REGEX = re.compile(r'ровно (\d+) объектов')
+
+
+def build_mock_response_text(think_chars: int, prompt: str = "") -> str:
+    """Полный текст ответа заглушки: блок рассуждений (если think_chars > 0) и текст статьи или JSON-массив."""
+    if "JSON" in prompt:
+        match = JSON_ITEMS_REGEX.search(prompt)
+        count = int(match.group(1)) if match else 20
+        answer = json.dumps([
+            {"number": n, "title": f"Тестовый заголовок {n}", "description": "Тестовое описание статьи для замеров."}
+            for n in range(1, count + 1)
+        ], ensure_ascii=False, indent=2)
+    else:
+        answer = MOCK_ARTICLE_TEXT
+    if think_chars <= 0:
+        return answer
+    think_text = ("Хм, подумаю еще раз. " * (think_chars // 21 + 1))[:think_chars]
+    return f"<think>{think_text}</think>\n\n{answer}"
+
+
+class MockLMStudioHandler(BaseHTTPRequestHandler):
+    # Параметры задаются через атрибуты сервера (см. configure_mock_server)
+    protocol_version = "HTTP/1.1" # keep-alive, чтобы пул соединений клиента переиспользовал сокеты
+
+    def log_message(self, format, *args):
+        pass # Не засоряем вывод логами каждого запроса
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length) if length else b""
+        if self.path.rstrip('/') != "/v1/chat/completions":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = json.loads(raw_body or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+
+        start_time = time.perf_counter()
+        with self.server.queue_lock:
+            fail = self.server.random.random() < self.server.failure_rate
+            if fail:
+                self.server.failures += 1
+        if fail:
+            self._send_json(500, {"error": "mock failure"})
+            return
+
+        # Ждем свободный "слот" генерации, как при ограниченном parallel в LMStudio
+        if self.server.slots is not None:
+            with self.server.queue_lock:
+                if self.server.max_queue and self.server.waiting >= self.server.max_queue:
+                    self.server.rejected += 1
+                    reject = True
+                else:
+                    self.server.waiting += 1
+                    reject = False
+            if reject:
+                self._send_json(503, {"error": "server overloaded"})
+                return
+            self.server.slots.acquire()
+            with self.server.queue_lock:
+                self.server.waiting -= 1
+        try:
+            completed = self._generate(payload)
+        finally:
+            if self.server.slots is not None:
+                self.server.slots.release()
+
+        with self.server.queue_lock:
+            if completed:
+                self.server.latencies.append(time.perf_counter() - start_time)
+            else:
+                self.server.aborted += 1
+
+    def _generate(self, payload) -> bool:
+        """Генерирует и отправляет ответ. Возвращает False, если клиент прервал потоковый ответ."""
+        messages = payload.get("messages") or [{}]
+        prompt = str(messages[-1].get("content", ""))
+        text = build_mock_response_text(self.server.think_chars, prompt)
+        if self.server.token_rate > 0:
+            # Задержка до первого токена + время генерации всех токенов
+            generation_time = self.server.latency + len(text) / CHARS_PER_TOKEN / self.server.token_rate
+        else:
+            # Время "генерации" пропорционально длине ответа: latency - время на один текст статьи
+            generation_time = self.server.latency * len(text) / len(MOCK_ARTICLE_TEXT)
+
+        if payload.get("stream"):
+            return self._send_stream(payload, text, generation_time)
+
+        time.sleep(generation_time)
+
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": payload.get("model", "mock-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+        })
+        return True
+
+    def _send_stream(self, payload, text, generation_time) -> bool:
+        # Без Content-Length: конец потока обозначается закрытием соединения
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        chunk_delay = generation_time / len(chunks)
+        model = payload.get("model", "mock-model")
+        try:
+            for chunk_text in chunks:
+                time.sleep(chunk_delay)
+                self._write_event({"object": "chat.completion.chunk", "model": model,
+                                   "choices": [{"index": 0, "delta": {"content": chunk_text}, "finish_reason": None}]})
+                with self.server.queue_lock:
+                    self.server.streamed_chars += len(chunk_text)
+            self._write_event({"object": "chat.completion.chunk", "model": model,
+                               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return False # Клиент прервал генерацию - как и LMStudio, просто перестаем генерировать
+        return True
+
+    def _write_event(self, data):
+        self.wfile.write(b"data: " + json.dumps(data, ensure_ascii=False).encode('utf-8') + b"\n\n")
+        self.wfile.flush()
+
+
+def configure_mock_server(server, latency: float, think_chars: int = 0, parallel_slots: int = 0, max_queue: int = 0,
+                          token_rate: float = 0, failure_rate: float = 0.0, seed: int = 0):
+    """Задает параметры заглушки (атрибуты сервера, которые читает MockLMStudioHandler) и обнуляет статистику."""
+    server.latency = latency
+    server.think_chars = think_chars
+    server.token_rate = token_rate
+    server.failure_rate = failure_rate
+    server.random = random.Random(seed) # Воспроизводимая последовательность сбоев
+    server.slots = threading.Semaphore(parallel_slots) if parallel_slots > 0 else None
+    server.max_queue = max_queue
+    server.queue_lock = threading.Lock()
+    server.waiting = 0
+    reset_mock_stats(server)
+
+
+def reset_mock_stats(server):
+    """Обнуляет статистику запросов заглушки (перед очередным замером)."""
+    with server.queue_lock:
+        server.latencies = []      # Задержки успешно завершенных ответов (в секундах), измеренные на сервере
+        server.failures = 0        # Сколько запросов завершено искусственной ошибкой HTTP 500
+        server.rejected = 0        # Сколько запросов отклонено с HTTP 503
+        server.aborted = 0         # Сколько потоковых ответов прервано клиентом
+        server.streamed_chars = 0  # Сколько символов реально отправлено в потоковых ответах
+
+
+def get_mock_stats(server) -> dict:
+    """Статистика запросов с момента последнего reset_mock_stats: количества и перцентили задержки."""
+    with server.queue_lock:
+        latencies = sorted(server.latencies)
+        stats = {
+            'completed': len(latencies),
+            'failures': server.failures,
+            'rejected': server.rejected,
+            'aborted': server.aborted,
+            'streamed_chars': server.streamed_chars,
+        }
+
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    stats['p50_latency'] = percentile(50)
+    stats['p99_latency'] = percentile(99)
+    return stats
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, latency: float = LATENCY, think_chars: int = 0,
+                      parallel_slots: int = 0, max_queue: int = 0, token_rate: float = 0, failure_rate: float = 0.0,
+                      seed: int = 0):
+    """
+    Запускает заглушку в фоновом потоке.
+
+    Args:
+        host: Адрес для прослушивания.
+        port: Порт (0 - выбрать свободный автоматически).
+        latency: Задержка ответа на один запрос (в секундах); при token_rate > 0 - задержка до первого токена.
+        think_chars: Длина блока <think> перед текстом статьи (в символах).
+        parallel_slots: Количество одновременно генерируемых ответов (0 - без ограничения).
+        max_queue: Максимальная длина очереди ожидания, сверх нее - HTTP 503 (0 - без ограничения).
+        token_rate: Скорость генерации в токенах/сек (0 - время задается только latency).
+        failure_rate: Доля запросов, завершаемых ошибкой HTTP 500.
+        seed: Зерно генератора случайных сбоев.
+
+    Returns:
+        tuple: (server, base_url), где base_url вида "http://127.0.0.1:PORT/v1".
+               Остановить сервер: server.shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), MockLMStudioHandler)
+    server.daemon_threads = True
+    configure_mock_server(server, latency, think_chars, parallel_slots, max_queue, token_rate, failure_rate, seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого API LMStudio")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="задержка ответа (или до первого токена), сек")
+    parser.add_argument("--token-rate", type=float, default=TOKEN_RATE, help="скорость генерации, токенов/сек (0 - выкл.)")
+    parser.add_argument("--failure-rate", type=float, default=FAILURE_RATE, help="доля ответов HTTP 500")
+    parser.add_argument("--think-chars", type=int, default=THINK_CHARS, help="длина блока <think>, символов")
+    parser.add_argument("--parallel-slots", type=int, default=PARALLEL_SLOTS, help="слотов генерации (0 - без ограничения)")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="максимальная очередь, сверх нее HTTP 503")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), MockLMStudioHandler)
+    server.daemon_threads = True
+    configure_mock_server(server, args.latency, args.think_chars, args.parallel_slots, args.max_queue,
+                          args.token_rate, args.failure_rate)
+    print(f"Заглушка LMStudio запущена: http://{args.host}:{args.port}/v1 (задержка {args.latency} сек). Ctrl+C для остановки.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    stats = get_mock_stats(server)
+    print(f"Заглушка остановлена. Ответов: {stats['completed']}, сбоев: {stats['failures']}, отклонено: {stats['rejected']}, "
+          f"p50 {stats['p50_latency']:.3f} сек, p99 {stats['p99_latency']:.3f} сек.")
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Динамическая очередь затравок для распределенной генерации описаний.
+
+Вместо статического деления файла по machine_weights (11_split_description_seeds.py)
+все затравки лежат в одной SQLite-базе на машине-координаторе, а скрипты генерации
+на каждой машине берут ("арендуют") небольшие пачки затравок по мере готовности.
+Быстрые машины просто берут больше пачек, поэтому общее время работы определяется
+суммарной скоростью всех машин, а не долей самой медленной.
+
+У каждой аренды есть срок действия: если машина упала и не отчиталась о пачке,
+по истечении срока ее затравки снова выдаются другим машинам (не более MAX_ATTEMPTS выдач на затравку).
+
+Запуск координатора (на машине, где лежит база, созданная 11_split_description_seeds.py):
+$ python seed_queue.py
+В 12_generate_descriptions.py на каждой машине указать SEED_QUEUE_ADDRESS = "http://<ip-координатора>:8765".
+На одной машине можно обойтись без HTTP и указать путь к самой базе.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# --- Конфигурация (для запуска координатора) ---
+QUEUE_DB_PATH = "./wiki_description_seeds_split/seed_queue.sqlite"
+HOST = "0.0.0.0" # Слушать на всех интерфейсах, чтобы остальные машины в сети могли подключиться
+PORT = 8765
+# --- Конец Конфигурации ---
+
+# Сколько раз выдавать затравку, которая завершилась ошибкой API или аренда которой истекла, прежде чем считать ее проваленной
+MAX_ATTEMPTS = 3
+
+
+class SeedQueue:
+    """
+    Очередь затравок в SQLite-файле. Все изменения выполняются в транзакциях
+    BEGIN IMMEDIATE, поэтому очередь безопасна для нескольких процессов и потоков
+    на одной машине (блокировка на уровне файла базы).
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS seeds (
+                    number INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',  -- 'pending', 'leased', 'done', 'failed'
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS seeds_status ON seeds (status, lease_expires)")
+
+    def _connect(self):
+        # Новое соединение на каждый вызов: sqlite3-соединения нельзя делить между потоками
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def add_seeds(self, items) -> int:
+        """Добавляет затравки (словари с полем 'number'). Уже существующие номера не трогаются."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO seeds (number, payload) VALUES (?, ?)",
+                ((item['number'], json.dumps(item, ensure_ascii=False)) for item in items),
+            )
+            conn.execute("COMMIT")
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def lease(self, worker: str, batch_size: int, lease_seconds: float) -> list:
+        """
+        Выдает worker'у до batch_size затравок: новые и те, чья аренда истекла.
+        Затравка с истекшей арендой, выданная уже MAX_ATTEMPTS раз, помечается как 'failed'
+        (например, если на ней раз за разом падает машина) и больше не выдается.
+
+        Returns:
+            list: Список затравок (исходные словари). Пустой список - работы больше нет.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """UPDATE seeds SET status = 'failed', lease_expires = NULL
+                   WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                (now, MAX_ATTEMPTS),
+            )
+            rows = conn.execute(
+                """SELECT number, payload FROM seeds
+                   WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                   ORDER BY number LIMIT ?""",
+                (now, batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE seeds SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE number = ?",
+                ((worker, now + lease_seconds, number) for number, _ in rows),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return [json.loads(payload) for _, payload in rows]
+
+    def complete(self, worker: str, numbers) -> None:
+        """Отмечает затравки как обработанные (результат записан в выходной файл worker'а)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "UPDATE seeds SET status = 'done', worker = ?, lease_expires = NULL WHERE number = ?",
+                ((worker, number) for number in numbers),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def release(self, worker: str, numbers) -> None:
+        """
+        Возвращает затравки в очередь (например, после ошибки API), чтобы их взяла любая машина.
+        После MAX_ATTEMPTS выдач затравка помечается как 'failed'.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """UPDATE seeds SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                    lease_expires = NULL
+                   WHERE number = ? AND worker = ? AND status = 'leased'""",
+                ((MAX_ATTEMPTS, number, worker) for number in numbers),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        """Количество затравок по статусам и количество обработанных по машинам."""
+        conn = self._connect()
+        try:
+            by_status = dict(conn.execute("SELECT status, COUNT(*) FROM seeds GROUP BY status").fetchall())
+            by_worker = dict(conn.execute(
+                "SELECT worker, COUNT(*) FROM seeds WHERE status = 'done' GROUP BY worker").fetchall())
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM seeds WHERE status = 'leased' AND lease_expires < ?", (time.time(),)).fetchone()[0]
+        finally:
+            conn.close()
+        return {'by_status': by_status, 'done_by_worker': by_worker, 'expired_leases': expired}
+
+
+class SeedQueueClient:
+    """HTTP-клиент к координатору с тем же интерфейсом, что и SeedQueue."""
+
+    def __init__(self, base_url: str, timeout: float = 60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _post(self, path: str, data: dict) -> dict:
+        response = self.session.post(f"{self.base_url}{path}", json=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, worker: str, batch_size: int, lease_seconds: float) -> list:
+        return self._post("/lease", {'worker': worker, 'batch_size': batch_size, 'lease_seconds': lease_seconds})['items']
+
+    def complete(self, worker: str, numbers) -> None:
+        self._post("/complete", {'worker': worker, 'numbers': list(numbers)})
+
+    def release(self, worker: str, numbers) -> None:
+        self._post("/release", {'worker': worker, 'numbers': list(numbers)})
+
+    def stats(self) -> dict:
+        response = self.session.get(f"{self.base_url}/stats", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def open_seed_queue(address: str):
+    """Возвращает клиента очереди: HTTP, если address - URL координатора, иначе SeedQueue по пути к базе."""
+    if address.startswith("http://") or address.startswith("https://"):
+        return SeedQueueClient(address)
+    if not os.path.exists(address):
+        raise FileNotFoundError(f"База очереди '{address}' не найдена. Создайте ее скриптом 11_split_description_seeds.py.")
+    return SeedQueue(address)
+
+
+def default_worker_name() -> str:
+    """Имя машины по умолчанию для учета аренды."""
+    return socket.gethostname()
+
+
+class SeedQueueHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/stats":
+            self._send_json(200, self.server.queue.stats())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+            queue = self.server.queue
+            path = self.path.rstrip('/')
+            if path == "/lease":
+                items = queue.lease(data['worker'], int(data['batch_size']), float(data['lease_seconds']))
+                print(f"  Аренда: '{data['worker']}' получил {len(items)} затравок.")
+                self._send_json(200, {'items': items})
+            elif path == "/complete":
+                queue.complete(data['worker'], data['numbers'])
+                self._send_json(200, {'ok': True})
+            elif path == "/release":
+                queue.release(data['worker'], data['numbers'])
+                self._send_json(200, {'ok': True})
+            else:
+                self._send_json(404, {'error': 'not found'})
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json(400, {'error': f"bad request: {e}"})
+
+
+def serve(db_path: str, host: str, port: int):
+    """Запускает HTTP-координатор очереди (блокирующий вызов)."""
+    server = ThreadingHTTPServer((host, port), SeedQueueHandler)
+    server.daemon_threads = True
+    server.queue = SeedQueue(db_path)
+    print(f"Координатор очереди затравок запущен на http://{host}:{port} (база '{db_path}').")
+    print(f"Состояние: {server.queue.stats()}")
+    print("Ctrl+C для остановки.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Координатор остановлен. Состояние: {server.queue.stats()}")
+
+
+if __name__ == "__main__":
+    if not os.path.exists(QUEUE_DB_PATH):
+        print(f"Ошибка: База очереди '{QUEUE_DB_PATH}' не найдена. Сначала запустите 11_split_description_seeds.py с SPLIT_MODE = 'queue'.")
+        raise SystemExit(1)
+    serve(QUEUE_DB_PATH, HOST, PORT)
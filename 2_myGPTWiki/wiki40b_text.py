@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Декодирование и очистка статей wiki40b, общие для скриптов 2-5.
+
+Поле 'text' в сохраненном датасете - строка с литералом байтов Python (b'...'), внутри маркеры
+_START_ARTICLE_, _START_SECTION_, _START_PARAGRAPH_, _NEWLINE_.
+
+clean_wiki_text() разбирает маркеры одним проходом (tokenize_wiki_markers), parse_wiki_article()
+возвращает заголовок, разделы и абзацы (проверка и замер: benchmark_clean_markers.py).
+
+Литерал байтов разбирается decode_bytes_literal() через codecs.escape_decode - тот же разбор
+escape-последовательностей, что у парсера Python, но без ast.literal_eval на каждую статью
+(замер: benchmark_decode_wiki.py). Необычные литералы разбираются ast.literal_eval, как раньше.
+
+Пакетный путь: map_cleaned_articles() запускает Dataset.map(batched=True, num_proc=N) - каждый
+процесс декодирует и очищает целые пакеты Arrow и сразу отбрасывает статьи вне диапазона длин.
+Результат - датасет (в кэш-файлах Arrow на диске) с колонками 'length' и, если нужно, 'cleaned_text'.
+Сравнение скорости с циклом по примерам: benchmark_clean_wiki.py.
+"""
+
+import ast
+import codecs
+import re
+
+
+def clean_wiki_text_reference(text_with_markers: str) -> str:
+    """
+    Прежняя очистка (шесть проходов replace/re.sub). Эталон для clean_wiki_text
+    (проверка - benchmark_clean_markers.py) и запасной путь для неоднозначных маркеров.
+    """
+    cleaned_text = text_with_markers
+    cleaned_text = cleaned_text.replace('_NEWLINE_', '\n')
+    cleaned_text = cleaned_text.replace('_START_PARAGRAPH_', '\n\n')
+    cleaned_text = cleaned_text.replace('_START_SECTION_', '\n\n')
+    cleaned_text = cleaned_text.replace('_START_ARTICLE_', '')
+    # Удаляем любые оставшиеся одиночные маркеры на всякий случай
+    cleaned_text = re.sub(r'_[A-Z_]+_', '', cleaned_text)
+    cleaned_text = cleaned_text.strip()
+    # Заменяем множественные переносы строк (3 и более) на двойные
+    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
+    return cleaned_text
+
+
+# Известные маркеры и их замена в очищенном тексте
+MARKER_REPLACEMENTS = {
+    '_NEWLINE_': '\n',
+    '_START_PARAGRAPH_': '\n\n',
+    '_START_SECTION_': '\n\n',
+    '_START_ARTICLE_': '',
+}
+_MARKER_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+
+
+class _AmbiguousMarkers(Exception):
+    """Маркер склеен с другими символами [A-Z_]: результат зависит от порядка проходов эталонной очистки."""
+
+
+def _split_known_markers(run: str):
+    """Список известных маркеров, из которых целиком состоит run, или None."""
+    markers = []
+    i = 0
+    while i < len(run):
+        for marker in MARKER_REPLACEMENTS:
+            if run.startswith(marker, i):
+                markers.append(marker)
+                i += len(marker)
+                break
+        else:
+            return None
+    return markers
+
+
+def tokenize_wiki_markers(text: str) -> list:
+    """
+    Разбивает текст wiki40b за один проход (str.find('_')) на список чередующихся частей:
+    текст, маркер, текст, маркер, ..., текст. Маркер - известный (MARKER_REPLACEMENTS)
+    или любой другой вида _[A-Z_]+_ (в очищенном тексте удаляется).
+    """
+    parts = []
+    n = len(text)
+    start = 0 # начало еще не выданного текста
+    pos = text.find('_')
+    while pos != -1:
+        # [pos, end) - максимальный отрезок из символов [A-Z_], начинающийся с '_'
+        end = pos + 1
+        while end < n and text[end] in _MARKER_CHARS:
+            end += 1
+        if pos == 0 or text[pos - 1] not in _MARKER_CHARS:
+            # Обычный случай: отрезок - один известный маркер или несколько подряд (_NEWLINE__START_SECTION_)
+            known = _split_known_markers(text[pos:end])
+            if known:
+                parts.append(text[start:pos])
+                parts.append(known[0])
+                for marker in known[1:]:
+                    parts.append('')
+                    parts.append(marker)
+                start = end
+                pos = text.find('_', start)
+                continue
+        # Жадный _[A-Z_]+_ заканчивается на последнем '_' отрезка
+        close = text.rfind('_', pos + 2, end)
+        if close == -1:
+            pos = text.find('_', end)
+            continue
+        marker = text[pos:close + 1]
+        if any(known in text[pos:end] for known in MARKER_REPLACEMENTS):
+            raise _AmbiguousMarkers(marker)
+        parts.append(text[start:pos])
+        parts.append(marker)
+        start = close + 1
+        pos = text.find('_', start)
+    parts.append(text[start:])
+    return parts
+
+
+def _collapse_newlines(text: str) -> str:
+    """Заменяет 3 и более переносов строк подряд на два (как re.sub(r'\\n{3,}', '\\n\\n', text))."""
+    i = text.find('\n\n\n')
+    if i == -1:
+        return text
+    pieces = []
+    start = 0
+    while i != -1:
+        j = i + 3
+        while j < len(text) and text[j] == '\n':
+            j += 1
+        pieces.append(text[start:i + 2])
+        start = j
+        i = text.find('\n\n\n', j)
+    pieces.append(text[start:])
+    return ''.join(pieces)
+
+
+def clean_wiki_text(text_with_markers: str) -> str:
+    """
+    Очищает текст статьи от специфических маркеров wiki40b
+    и преобразует его в формат с абзацами.
+    Результат совпадает с clean_wiki_text_reference, но маркеры разбираются за один проход, без регулярных выражений.
+    """
+    try:
+        parts = tokenize_wiki_markers(text_with_markers)
+    except _AmbiguousMarkers:
+        return clean_wiki_text_reference(text_with_markers)
+    # Нечетные элементы - маркеры: известные заменяются, остальные удаляются
+    for i in range(1, len(parts), 2):
+        parts[i] = MARKER_REPLACEMENTS.get(parts[i], '')
+    return _collapse_newlines(''.join(parts).strip())
+
+
+def parse_wiki_article(text_with_markers: str) -> dict:
+    """
+    Структура статьи wiki40b для следующих этапов:
+    {'title': str, 'sections': [{'title': str, 'paragraphs': [str, ...]}, ...]}.
+    Текст до первого _START_SECTION_ - раздел с пустым заголовком (вступление);
+    _NEWLINE_ внутри абзаца - перенос строки, прочие маркеры удаляются.
+    """
+    try:
+        parts = tokenize_wiki_markers(text_with_markers)
+    except _AmbiguousMarkers:
+        # Неоднозначные склейки маркеров: разбираем только известные маркеры
+        parts = re.split('(' + '|'.join(MARKER_REPLACEMENTS) + ')', text_with_markers)
+    title = ''
+    sections = [{'title': '', 'paragraphs': []}]
+    target = None # куда относится следующий текст: 'title', 'section' или 'paragraph'
+    buffer = []
+
+    def flush():
+        value = ''.join(buffer).strip()
+        buffer.clear()
+        return value
+
+    def close_block():
+        nonlocal title
+        value = flush()
+        if target == 'title':
+            title = value
+        elif target == 'section':
+            sections[-1]['title'] = value
+        elif value:
+            # абзац (или текст без маркера абзаца)
+            sections[-1]['paragraphs'].append(value)
+
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            buffer.append(part)
+        elif part == '_NEWLINE_':
+            buffer.append('\n')
+        elif part in ('_START_ARTICLE_', '_START_SECTION_', '_START_PARAGRAPH_'):
+            close_block()
+            if part == '_START_ARTICLE_':
+                target = 'title'
+            elif part == '_START_SECTION_':
+                sections.append({'title': '', 'paragraphs': []})
+                target = 'section'
+            else:
+                target = 'paragraph'
+    close_block()
+    if not sections[0]['paragraphs']:
+        sections.pop(0)
+    return {'title': title, 'sections': sections}
+
+
+def _has_unescaped_quote(body: str, quote: str) -> bool:
+    """Есть ли в теле литерала кавычка, перед которой четное число обратных слешей (то есть не экранированная)."""
+    i = body.find(quote)
+    while i != -1:
+        j = i
+        while j > 0 and body[j - 1] == '\\':
+            j -= 1
+        if (i - j) % 2 == 0:
+            return True
+        i = body.find(quote, i + 1)
+    return False
+
+
+def decode_bytes_literal(literal: str):
+    """
+    Значение литерала Python: то же, что ast.literal_eval(literal), но литерал байтов вида b'...'
+    (repr байтов, как в wiki40b) разбирается напрямую через codecs.escape_decode.
+    """
+    if len(literal) >= 3 and literal[0] == 'b' and literal[-1] == literal[1] and literal[1] in "'\"" and literal.isascii():
+        body = literal[2:-1]
+        # Неэкранированная кавычка (в т.ч. тройные кавычки) или перенос строки - не простой литерал, пусть разбирает Python
+        if '\n' not in body and '\r' not in body and not _has_unescaped_quote(body, literal[1]):
+            try:
+                return codecs.escape_decode(body)[0]
+            except ValueError:
+                pass # например, обрезанная \x-последовательность: ошибку сформулирует ast.literal_eval
+    return ast.literal_eval(literal)
+
+
+def decode_wiki40b_text(article_content) -> str:
+    """
+    Текст статьи из поля 'text': литерал байтов в строке (b'...') или сами байты.
+    Пустая строка, если содержимое не удалось декодировать.
+    """
+    if isinstance(article_content, str):
+        try:
+            evaluated_content = decode_bytes_literal(article_content)
+        except Exception:
+            return ""
+        if not isinstance(evaluated_content, bytes):
+            return ""
+        article_content = evaluated_content
+    if isinstance(article_content, bytes):
+        try:
+            return article_content.decode('utf-8')
+        except UnicodeDecodeError:
+            return ""
+    return ""
+
+
+def clean_articles_batch(batch, min_len=None, max_len=None, keep_text=True):
+    """
+    Функция для Dataset.map(batched=True): декодирует и очищает пакет статей,
+    оставляет только статьи с длиной очищенного текста в [min_len, max_len] (None - без границы).
+    """
+    lengths = []
+    texts = []
+    for article_content in batch['text']:
+        cleaned_text = clean_wiki_text(decode_wiki40b_text(article_content))
+        length = len(cleaned_text)
+        if (min_len is not None and length < min_len) or (max_len is not None and length > max_len):
+            continue
+        lengths.append(length)
+        if keep_text:
+            texts.append(cleaned_text)
+    result = {'length': lengths}
+    if keep_text:
+        result['cleaned_text'] = texts
+    return result
+
+
+def map_cleaned_articles(dataset, num_proc=1, batch_size=1000, min_len=None, max_len=None, keep_text=True, **map_kwargs):
+    """
+    Очищенные статьи раздела wiki40b одним пакетным Dataset.map в num_proc процессах.
+    Исходные колонки удаляются, порядок статей сохраняется.
+    """
+    return dataset.map(
+        clean_articles_batch,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc > 1 else None,
+        remove_columns=dataset.column_names,
+        fn_kwargs={'min_len': min_len, 'max_len': max_len, 'keep_text': keep_text},
+        desc="Очистка статей",
+        **map_kwargs,
+    )
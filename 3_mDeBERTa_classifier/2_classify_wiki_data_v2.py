@@ -7,6 +7,8 @@ import os
 import traceback
 import sys
 import collections
+import random
+import time
 from datasets import load_dataset
 
 # --- Конфигурация ---
@@ -27,6 +29,20 @@ output_full_path = os.path.join(output_directory, output_filename)
 # Размер батча для классификации (используется пайплайном при работе со списком текстов)
 # Теперь это явно контролируемый размер батча
 BATCH_SIZE = 64 # Начните с 64 или 128, подберите оптимальное для вашей GPU
+
+# Режим усечения и группировки по длине. Каждая статья дает по паре NLI на каждую категорию,
+# и батч дополняется паддингом до самой длинной пары. В этом режиме от статьи остаются только первые
+# TRUNCATE_TOKENS токенов, а статьи сортируются по длине, чтобы в батч попадали тексты близкой длины.
+# Результаты записываются в исходном порядке статей. Категория определяется только по началу статьи,
+# поэтому режим включается явно; согласие с полными текстами проверяется на Шаге 4.5.
+# False (по умолчанию) - прежний режим: полные тексты в исходном порядке (пайплайн обрежет их по лимиту модели).
+TRUNCATE_MODE = False
+TRUNCATE_TOKENS = 256   # Длина префикса статьи в токенах
+BUCKET_SIZE = 2048      # Статей в одной группе (один вызов пайплайна) после сортировки по длине
+# Проверка согласия с полными текстами: случайная выборка статей классифицируется еще и по полному
+# тексту, выводится доля совпавших категорий и скорость обоих режимов. 0 - не проверять.
+AGREEMENT_SAMPLE_SIZE = 500
+AGREEMENT_SEED = 1337
 # --- Конец Конфигурации ---
 
 # --- Шаг 1: Чтение категорий из файла ---
@@ -127,6 +143,58 @@ except Exception as e:
     sys.exit(1)
 
 
+def truncate_to_token_prefix(tokenizer, texts, max_tokens, chunk_size=1000):
+    """
+    Префиксы текстов из первых max_tokens токенов (без специальных), их длины в токенах
+    и признаки усечения (в исходном тексте больше max_tokens токенов).
+    Префикс вырезается из исходной строки по смещениям токенов, поэтому текст не искажается декодированием.
+    """
+    prefixes = []
+    lengths = []
+    truncated = []
+    for start in range(0, len(texts), chunk_size):
+        chunk = texts[start:start + chunk_size]
+        # На один токен больше лимита: так видно, был ли текст длиннее max_tokens
+        if tokenizer.is_fast:
+            encoded = tokenizer(chunk, add_special_tokens=False, truncation=True, max_length=max_tokens + 1,
+                                return_offsets_mapping=True)
+            for text, offsets in zip(chunk, encoded['offset_mapping']):
+                truncated.append(len(offsets) > max_tokens)
+                offsets = offsets[:max_tokens]
+                prefixes.append(text[:offsets[-1][1]] if offsets else "")
+                lengths.append(len(offsets))
+        else:
+            encoded = tokenizer(chunk, add_special_tokens=False, truncation=True, max_length=max_tokens + 1)
+            for input_ids in encoded['input_ids']:
+                truncated.append(len(input_ids) > max_tokens)
+                input_ids = input_ids[:max_tokens]
+                prefixes.append(tokenizer.decode(input_ids))
+                lengths.append(len(input_ids))
+    return prefixes, lengths, truncated
+
+
+def classify_length_bucketed(texts, lengths):
+    """
+    Классифицирует тексты группами по BUCKET_SIZE в порядке возрастания длины
+    и возвращает результаты в исходном порядке texts.
+    """
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+    results = [None] * len(texts)
+    t0 = time.time()
+    for start in range(0, len(order), BUCKET_SIZE):
+        bucket = order[start:start + BUCKET_SIZE]
+        bucket_results = classifier([texts[i] for i in bucket], candidate_labels=candidate_labels,
+                                    multi_label=False, batch_size=BATCH_SIZE)
+        if isinstance(bucket_results, dict):
+            bucket_results = [bucket_results] # Для одного текста пайплайн возвращает словарь, а не список
+        for i, result in zip(bucket, bucket_results):
+            results[i] = result
+        done = start + len(bucket)
+        print(f"  Классифицировано {done}/{len(order)} статей (длина до {lengths[bucket[-1]]} токенов), "
+              f"{done / (time.time() - t0):.1f} статей/сек")
+    return results
+
+
 # --- Шаг 4: Классификация с помощью пайплайна на списке текстов ---
 print("\n" + "="*50)
 print("Шаг 4: Классификация статей с помощью пайплайна на списке текстов...")
@@ -145,23 +213,55 @@ try:
     # --- КОНЕЦ ИЗВЛЕЧЕНИЯ ---
 
 
-    # --- ВЫЗЫВАЕМ ПАЙПЛАЙН С ИЗВЛЕЧЕННЫМ СПИСКОМ ---
-    # Пайплайн сам разобьет этот список на батчи заданного размера
-    # multi_label=False означает, что для каждого текста будет один лучший результат
-    batch_results_list = classifier(
-        texts_list, # Передаем список текстов
-        candidate_labels=candidate_labels, # Передаем список категорий
-        multi_label=False,
-        batch_size=BATCH_SIZE # Передаем размер батча
-        # device=device # Устройство уже передано при создании пайплайна
-    )
+    classification_start_time = time.time()
+    if TRUNCATE_MODE:
+        print(f"Режим усечения: первые {TRUNCATE_TOKENS} токенов статьи, группы по {BUCKET_SIZE} статей в порядке длины.")
+        truncated_texts, token_lengths, truncated_flags = truncate_to_token_prefix(classifier.tokenizer, texts_list, TRUNCATE_TOKENS)
+        print(f"Тексты усечены за {time.time() - classification_start_time:.1f} сек. "
+              f"Усечено статей: {sum(truncated_flags)}/{len(truncated_flags)}")
+        batch_results_list = classify_length_bucketed(truncated_texts, token_lengths)
+    else:
+        # --- ВЫЗЫВАЕМ ПАЙПЛАЙН С ИЗВЛЕЧЕННЫМ СПИСКОМ ---
+        # Пайплайн сам разобьет этот список на батчи заданного размера
+        # multi_label=False означает, что для каждого текста будет один лучший результат
+        batch_results_list = classifier(
+            texts_list, # Передаем список текстов
+            candidate_labels=candidate_labels, # Передаем список категорий
+            multi_label=False,
+            batch_size=BATCH_SIZE # Передаем размер батча
+            # device=device # Устройство уже передано при создании пайплайна
+        )
+    classification_time = time.time() - classification_start_time
     print("\nКлассификация завершена.")
+    print(f"Время классификации: {classification_time:.1f} сек, {len(texts_list) / classification_time:.1f} статей/сек")
 
 except Exception as e:
     print(f"\nКритическая ошибка во время классификации: {e}")
     traceback.print_exc()
     sys.exit(1)
 
+# --- Шаг 4.5: Согласие усеченного режима с классификацией полных текстов ---
+if TRUNCATE_MODE and AGREEMENT_SAMPLE_SIZE > 0:
+    print("\n" + "="*50)
+    sample_indices = random.Random(AGREEMENT_SEED).sample(range(len(texts_list)), min(AGREEMENT_SAMPLE_SIZE, len(texts_list)))
+    print(f"Шаг 4.5: Проверка согласия с полными текстами на выборке из {len(sample_indices)} статей...")
+    try:
+        t0 = time.time()
+        full_results = classifier([texts_list[i] for i in sample_indices], candidate_labels=candidate_labels,
+                                  multi_label=False, batch_size=BATCH_SIZE)
+        full_rate = len(sample_indices) / (time.time() - t0)
+        if isinstance(full_results, dict):
+            full_results = [full_results]
+        agreed = sum(1 for i, full_result in zip(sample_indices, full_results)
+                     if full_result['labels'][0] == batch_results_list[i]['labels'][0])
+        print(f"  Совпадение категорий с полными текстами: {agreed}/{len(sample_indices)} ({agreed / len(sample_indices):.1%})")
+        print(f"  Скорость: полные тексты (выборка) {full_rate:.1f} статей/сек, "
+              f"усеченные {len(texts_list) / classification_time:.1f} статей/сек (x{len(texts_list) / classification_time / full_rate:.1f})")
+    except Exception as e:
+        # Проверка не влияет на результаты: сообщаем об ошибке и продолжаем запись
+        print(f"\n  Ошибка при проверке согласия: {e}")
+        traceback.print_exc()
+
 # batch_results_list теперь является СПИСКОМ словарей,
 # где каждый словарь соответствует одной статье и имеет ключи 'sequence', 'labels', 'scores'.
 # Порядок результатов в batch_results_list соответствует порядку текстов в texts_list (и в dataset).
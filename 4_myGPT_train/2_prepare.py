@@ -4,9 +4,11 @@ import json
 import os
 import traceback
 import sys
+import time
 import numpy as np
 import collections
-import random
+import multiprocessing
+import hashlib
 import re # Импортируем re для регулярных выражений
 # Импортируем AutoTokenizer для загрузки токенизатора из Hugging Face
 from transformers import AutoTokenizer
@@ -27,6 +29,15 @@ output_dir = 'data/custom_corpus'
 # Соотношение данных для обучения и валидации (например, 0.9 для 90% train, 10% val)
 train_val_split = 0.9
 
+# Разделение на train/val определяется хэшем (blake2b) текста статьи, а не случайным числом:
+# при повторных запусках статья всегда попадает в ту же часть, а одинаковые тексты - в одну и ту же часть.
+
+# Инкрементальный режим: в '{output_dir}/prepare_manifest.json' запоминается, какие файлы (и до какого байта)
+# уже записаны в train.bin/val.bin. При повторном запуске обрабатываются только новые файлы и строки,
+# дописанные в конец уже обработанных (скрипты генерации только дописывают файлы).
+# Если файл был изменен не дописыванием, удален или изменились настройки - корпус пересобирается полностью.
+INCREMENTAL = True
+
 # Имя модели на Hugging Face для загрузки токенизатора
 MODEL_NAME = "google/gemma-3-27b-it"
 
@@ -36,320 +47,683 @@ GENERATION_SUCCESS_STATUS = "ok"
 # Регулярное выражение для удаления тегов <think>...</think>
 THINK_TAG_REGEX = re.compile(r'<think>.*?</think>', re.DOTALL)
 
-# --- Конец Конфигурации ---
-
-# --- Шаг 1: Загрузка и настройка токенизатора ---
-print("="*50)
-print(f"Шаг 1: Загрузка токенизатора для модели '{MODEL_NAME}'...")
-
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    print("Токенизатор загружен успешно.")
-
-    if tokenizer.bos_token_id is None:
-         print(f"\nКритическая ошибка: Токенизатор '{MODEL_NAME}' не имеет стандартного <bos> токена.")
-         sys.exit(1)
-    if tokenizer.eos_token_id is None:
-         print(f"\nКритическая ошибка: Токенизатор '{MODEL_NAME}' не имеет стандартного <eos> токена.")
-         sys.exit(1)
-
-    bos_token_id = tokenizer.bos_token_id
-    eos_token_id = tokenizer.eos_token_id
-    vocab_size = len(tokenizer)
-
-    print(f"  Размер словаря (vocab size): {vocab_size}")
-    print(f"  ID токена начала последовательности (<bos>): {bos_token_id}")
-    print(f"  ID токена конца последовательности (<eos>): {eos_token_id}")
-
-except Exception as e:
-    print(f"\nКритическая ошибка: Не удалось загрузить или настроить токенизатор для модели '{MODEL_NAME}'.")
-    print(f"Убедитесь, что у вас установлен transformers (`pip install transformers`) и huggingface_hub (`pip install huggingface_hub`),")
-    print(f"есть доступ к интернету и при необходимости выполнена аутентификация (`huggingface-cli login`).")
-    print(f"Ошибка: {e}")
-    traceback.print_exc()
-    sys.exit(1)
-
-print("="*50)
-
-# --- Шаг 2: Подготовка выходных файлов и директории ---
-print("\n" + "="*50)
-print(f"Шаг 2: Подготовка выходной директории '{output_dir}' и бинарных файлов...")
-
-try:
-    os.makedirs(output_dir, exist_ok=True)
-    train_filepath = os.path.join(output_dir, 'train.bin')
-    val_filepath = os.path.join(output_dir, 'val.bin')
-
-    # Открываем файлы в бинарном режиме для записи
-    # Используем with open для гарантии закрытия файлов
-    train_file = open(train_filepath, 'wb')
-    val_file = open(val_filepath, 'wb')
-
-
-    print(f"Директория '{output_dir}' готова.")
-    print(f"Файлы '{train_filepath}' и '{val_filepath}' открыты для записи.")
-
-except Exception as e:
-    print(f"\nКритическая ошибка: Не удалось подготовить выходную директорию или файлы.")
-    print(f"Ошибка: {e}")
-    traceback.print_exc()
-    sys.exit(1)
+# --- Параллельная токенизация ---
+# Количество процессов, которые разбирают JSON и токенизируют статьи (по умолчанию - все ядра).
+# 1 - все делается в основном процессе.
+NUM_WORKERS = os.cpu_count() or 1
+# Сколько строк JSONL отправлять процессу за раз (статьи токенизируются пакетом, это быстрее по одной)
+BATCH_SIZE = 256
+# Сколько пакетов на процесс может ждать записи (ограничивает потребление памяти)
+MAX_PENDING_BATCHES_PER_WORKER = 4
+
+# --- Компактный словарь ---
+# True - после токенизации перенумеровать реально встречающиеся в корпусе ID токенов подряд (0..N-1).
+# Таблица соответствия сохраняется в meta.json ('token_id_map': индекс - новый ID, значение - ID токенизатора),
+# а vocab_size в meta.json становится равен N. Матрица эмбеддингов и softmax модели уменьшаются
+# с 262k строк до размера реально используемого словаря. train.py и mysample.py учитывают эту таблицу.
+COMPACT_VOCAB = False
+# Сколько токенов перекодировать за раз при перезаписи train.bin/val.bin
+REMAP_CHUNK_TOKENS = 16 * 1024 * 1024
 
-print("="*50)
-
-
-# --- Шаг 3: Чтение, токенизация, разделение и запись статей ---
-print("\n" + "="*50)
-print("Шаг 3: Чтение, токенизация, разделение и запись статей...")
-
-total_articles_processed = 0 # Всего статей, которые скрипт ПЫТАЛСЯ обработать (попыток чтения строк из файлов)
-total_articles_successfully_processed = 0 # Всего статей, из которых успешно извлечен текст И они успешно токенизированы
-total_articles_skipped = 0 # <<< ИНИЦИАЛИЗАЦИЯ ЗДЕСЬ
-token_counts = collections.defaultdict(int) # Для подсчета токенов текста статьи (без BOS/EOS) по источникам
-article_counts = collections.defaultdict(int) # Для подсчета статей по источникам (только успешно обработанные)
-output_token_counts = {'train': 0, 'val': 0} # Для подсчета токенов в train/val файлах (включая BOS/EOS)
-
-
-for source_config in input_sources:
-    source_path = source_config['path']
-    source_format = source_config['format']
-    print(f"\nОбработка источника: '{source_path}' (Формат: {source_format})")
+# --- Конец Конфигурации ---
 
-    file_list = []
+MANIFEST_FILENAME = 'prepare_manifest.json'
+# Размер блока чтения при хэшировании уже обработанной части файла
+FINGERPRINT_CHUNK_BYTES = 16 * 1024 * 1024
+SPLIT_METHOD = 'blake2b-text'
+
+
+# --- Функции обработки статей (выполняются в процессах токенизации) ---
+
+# Токенизатор процесса токенизации (загружается в _init_worker или берется из основного процесса)
+_worker_tokenizer = None
+
+
+def _init_worker(model_name):
+    """Загружает токенизатор в процессе токенизации (из локального кэша Hugging Face)."""
+    global _worker_tokenizer
+    # Каждый процесс токенизирует в один поток - параллелизм дают сами процессы
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+
+def extract_article_text(line, source_format):
+    """
+    Разбирает строку JSONL и возвращает очищенный текст статьи.
+
+    Returns:
+        tuple: (article_text_cleaned, status): status 'ok' - текст есть,
+               'skip' - статья пропущена (статус, короткий текст и т.п.), 'error' - ошибка разбора строки.
+    """
+    article_text_cleaned = None # Очищенный текст для токенизации
+    skip_reason = None
+
+    try:
+        item = json.loads(line)
+
+        # Логика извлечения и ПЕРВИЧНОЙ очистки текста в зависимости от формата
+        if source_format == 'generated_original':
+            article_text_raw = item.get('text')
+            # УДАЛЯЕМ <think> блоки из generated_original
+            if isinstance(article_text_raw, str):
+                article_text_cleaned = THINK_TAG_REGEX.sub('', article_text_raw).strip()
+            else:
+                skip_reason = "text field missing or not string"
+
+        elif source_format == 'wiki_original':
+            article_text_raw = item.get('text')
+            # Для wiki_original просто берем текст и чистим пробелы
+            if isinstance(article_text_raw, str):
+                article_text_cleaned = article_text_raw.strip()
+            else:
+                skip_reason = "text field missing or not string"
+
+        elif source_format == 'wiki_generated':
+            # Для сгенерированных статей проверяем статус и удаляем <think> блоки (уже должно быть сделано, но повторим для безопасности)
+            status = item.get('generation_status')
+            if status == GENERATION_SUCCESS_STATUS:
+                article_text_raw = item.get('generated_text')
+                if isinstance(article_text_raw, str):
+                     article_text_cleaned = THINK_TAG_REGEX.sub('', article_text_raw).strip()
+                else:
+                    skip_reason = f"generated_text missing or not string (status '{status}')"
+            else:
+                skip_reason = f"status is '{status}' != '{GENERATION_SUCCESS_STATUS}'"
+
+        else:
+             skip_reason = f"unknown format '{source_format}'"
+
+        # Дополнительная проверка: текст не должен быть пустым или слишком коротким после очистки
+        if article_text_cleaned and len(article_text_cleaned) < 50: # Минимальная длина текста, например, 50 символов
+             skip_reason = f"text too short after cleaning ({len(article_text_cleaned)} chars)"
+             article_text_cleaned = None # Сбрасываем текст, если слишком короткий
+        elif not article_text_cleaned and skip_reason is None:
+             # Если текст None/пуст после очистки, но skip_reason не установлен (напр. исходно был пуст)
+             skip_reason = "text empty after cleaning"
+
+    except json.JSONDecodeError:
+        return None, 'error'
+    except Exception:
+        return None, 'error'
+
+    if article_text_cleaned:
+        return article_text_cleaned, 'ok'
+    return None, 'skip'
+
+
+def split_value(text):
+    """Детерминированное число в [0, 1) по хэшу текста статьи (для разделения train/val)."""
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') / 2**64
+
+
+def process_batch(task):
+    """
+    Разбирает и токенизирует пакет строк JSONL одного источника.
+
+    Args:
+        task: (source_format, lines)
+
+    Returns:
+        list: Для каждой строки (в том же порядке) кортеж (status, token_ids, split_value), где status:
+              'ok' - token_ids (np.uint32, без BOS/EOS), 'skip', 'error' - ошибка разбора строки,
+              'empty_tokens' - токенизатор вернул пустой список, 'tok_error' - ошибка токенизации.
+              split_value - хэш текста в [0, 1) для статуса 'ok', иначе None.
+    """
+    source_format, lines = task
+    results = [None] * len(lines)
+    texts = []
+    text_positions = []
+    for position, line in enumerate(lines):
+        article_text_cleaned, status = extract_article_text(line, source_format)
+        if status == 'ok':
+            texts.append(article_text_cleaned)
+            text_positions.append(position)
+        else:
+            results[position] = (status, None, None)
+
+    if texts:
+        try:
+            # Пакетная токенизация быстрым токенизатором
+            # add_special_tokens=False, чтобы не добавлять стандартные BOS/EOS
+            batch_token_ids = _worker_tokenizer(texts, add_special_tokens=False)['input_ids']
+        except Exception:
+            # Ищем статью, на которой падает токенизатор, кодируя по одной
+            batch_token_ids = []
+            for text in texts:
+                try:
+                    batch_token_ids.append(_worker_tokenizer.encode(text, add_special_tokens=False))
+                except Exception:
+                    batch_token_ids.append(None)
+
+        for position, text, token_ids in zip(text_positions, texts, batch_token_ids):
+            if token_ids is None:
+                results[position] = ('tok_error', None, None)
+            elif not token_ids:
+                results[position] = ('empty_tokens', None, None)
+            else:
+                results[position] = ('ok', np.asarray(token_ids, dtype=np.uint32), split_value(text))
+    return results
+
+
+def list_source_files(source_path):
+    """Возвращает список файлов .jsonl источника (папки или одного файла)."""
     if os.path.isdir(source_path):
-        file_list = [os.path.join(source_path, f) for f in os.listdir(source_path) if f.endswith('.jsonl')]
+        # Сортируем, чтобы порядок статей в train.bin/val.bin не зависел от файловой системы
+        file_list = sorted(os.path.join(source_path, f) for f in os.listdir(source_path) if f.endswith('.jsonl'))
         if not file_list:
              print(f"  Внимание: В папке '{source_path}' не найдено файлов .jsonl. Пропускаем источник.")
-             continue
-        print(f"  Найдено {len(file_list)} файл(ов) в папке.")
-    elif os.path.isfile(source_path) and source_path.endswith('.jsonl'):
-        file_list = [source_path]
-        print(f"  Обрабатывается один файл.")
-    else:
-        print(f"  Внимание: Путь '{source_path}' не является папкой или файлом .jsonl. Пропускаем источник.")
-        continue
-
+        else:
+            print(f"  '{source_path}': найдено {len(file_list)} файл(ов) в папке.")
+        return file_list
+    if os.path.isfile(source_path) and source_path.endswith('.jsonl'):
+        print(f"  '{source_path}': обрабатывается один файл.")
+        return [source_path]
+    print(f"  Внимание: Путь '{source_path}' не является папкой или файлом .jsonl. Пропускаем источник.")
+    return []
+
+
+def iter_file_batches(file_items, source_format, complete_lines_only=False):
+    """
+    Читает файлы источника (с указанного байта) пакетами строк по BATCH_SIZE.
+
+    Args:
+        file_items: список (file_path, start_offset)
+        complete_lines_only: не читать последнюю строку без '\\n' - ее, возможно, еще дописывает
+            скрипт генерации (инкрементальный режим: end_offset не должен заходить за недописанную строку)
+
+    Yields:
+        tuple: (file_path, (source_format, lines), is_last_batch_of_file, end_offset),
+               где end_offset - байт файла, до которого прочитаны строки.
+    """
+    for file_path, start_offset in file_items:
+        try:
+            # Бинарный режим: позиции в файле - точные байты (json.loads принимает bytes в UTF-8)
+            with open(file_path, 'rb') as f:
+                f.seek(start_offset)
+                offset = start_offset
+                lines = []
+                for line in f:
+                    if complete_lines_only and not line.endswith(b'\n'):
+                        print(f"  Последняя строка файла '{os.path.basename(file_path)}' не завершена переводом строки - она будет обработана при следующем запуске.")
+                        break
+                    lines.append(line)
+                    offset += len(line)
+                    if len(lines) >= BATCH_SIZE:
+                        yield file_path, (source_format, lines), False, offset
+                        lines = []
+            yield file_path, (source_format, lines), True, offset
 
-    for file_path in file_list:
-        # print(f"  Чтение файла: '{file_path}'") # Слишком много вывода при большом количестве файлов
-        articles_in_file_processed = 0
-        articles_in_file_successfully_processed = 0
-        error_in_file_lines = 0
+        except FileNotFoundError:
+            print(f"  Ошибка: Файл не найден '{file_path}'. Пропускаем.")
+        except Exception as e:
+            print(f"  Критическая ошибка при чтении файла '{file_path}': {e}")
+            traceback.print_exc()
+            # Продолжаем с другими файлами/источниками
+
+
+def file_fingerprint(file_path, end_offset):
+    """
+    Хэш первых end_offset байт файла (проверка, что уже обработанная часть не менялась).
+    Чтение файла намного дешевле его токенизации, поэтому хэшируется вся обработанная часть.
+    """
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        remaining = end_offset
+        while remaining > 0:
+            chunk = f.read(min(remaining, FINGERPRINT_CHUNK_BYTES))
+            if not chunk:
+                break
+            file_hash.update(chunk)
+            remaining -= len(chunk)
+    return file_hash.hexdigest()
+
+
+def load_manifest(manifest_filepath):
+    if not os.path.exists(manifest_filepath):
+        return None
+    try:
+        with open(manifest_filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"  Внимание: Не удалось прочитать манифест '{manifest_filepath}': {e}")
+        return None
+
+
+def save_manifest(manifest_filepath, manifest):
+    # Через временный файл, чтобы прерывание не оставило манифест недописанным
+    tmp_filepath = manifest_filepath + '.tmp'
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_filepath, manifest_filepath)
+
+
+def plan_incremental(manifest, settings, source_files, train_filepath, val_filepath):
+    """
+    Проверяет, можно ли дописать корпус по манифесту предыдущего запуска.
+
+    Returns:
+        tuple: (start_offsets, reason): start_offsets - {file_path: байт, с которого читать} или None,
+               если нужна полная пересборка (reason - причина).
+    """
+    if manifest.get('settings') != settings:
+        return None, "изменились настройки подготовки (токенизатор, train_val_split, <bos>/<eos>)"
+    for filepath, key in ((train_filepath, 'train_bytes'), (val_filepath, 'val_bytes')):
+        if not os.path.exists(filepath) or os.path.getsize(filepath) < manifest[key]:
+            return None, f"файл '{filepath}' отсутствует или короче, чем записано в манифесте"
+
+    current_formats = {file_path: source_format for source_format, file_list in source_files for file_path in file_list}
+    start_offsets = {}
+    for file_path, entry in manifest['files'].items():
+        if current_formats.get(file_path) != entry['format']:
+            return None, f"файл '{file_path}' удален из источников или изменился его формат"
+        if not os.path.exists(file_path) or os.path.getsize(file_path) < entry['processed_bytes']:
+            return None, f"файл '{file_path}' удален или стал короче"
+        if file_fingerprint(file_path, entry['processed_bytes']) != entry['fingerprint']:
+            return None, f"файл '{file_path}' изменен не дописыванием в конец"
+        start_offsets[file_path] = entry['processed_bytes']
+    return start_offsets, None
+
+
+def ordered_map(pool, tasks, max_pending):
+    """
+    Выполняет process_batch для задач в пуле процессов (или в текущем процессе, если pool is None)
+    и отдает результаты строго в порядке задач, удерживая в работе не более max_pending пакетов.
+
+    Yields:
+        tuple: (meta, result), где tasks - итератор (meta, task, ...).
+    """
+    if pool is None:
+        for meta, task, *rest in tasks:
+            yield (meta, *rest), process_batch(task)
+        return
+
+    pending = collections.deque()
+    for meta, task, *rest in tasks:
+        pending.append(((meta, *rest), pool.apply_async(process_batch, (task,))))
+        if len(pending) >= max_pending:
+            meta_done, async_result = pending.popleft()
+            yield meta_done, async_result.get()
+    while pending:
+        meta_done, async_result = pending.popleft()
+        yield meta_done, async_result.get()
+
+
+def compact_bin_file(filepath, remap_table, out_dtype):
+    """
+    Перезаписывает бинарный файл токенов (np.uint32) в компактной нумерации.
+    Файл обрабатывается кусками по REMAP_CHUNK_TOKENS и подменяется атомарно.
+    """
+    tmp_filepath = filepath + '.tmp'
+    data = np.memmap(filepath, dtype=np.uint32, mode='r')
+    with open(tmp_filepath, 'wb') as out_f:
+        for start in range(0, len(data), REMAP_CHUNK_TOKENS):
+            chunk = data[start:start + REMAP_CHUNK_TOKENS]
+            remap_table[chunk].astype(out_dtype, copy=False).tofile(out_f)
+    del data # Закрываем memmap до замены файла (иначе на Windows замена не удастся)
+    os.replace(tmp_filepath, filepath)
+
+
+def main():
+    global _worker_tokenizer
+
+    # --- Шаг 1: Загрузка и настройка токенизатора ---
+    print("="*50)
+    print(f"Шаг 1: Загрузка токенизатора для модели '{MODEL_NAME}'...")
+
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        print("Токенизатор загружен успешно.")
+
+        if tokenizer.bos_token_id is None:
+             print(f"\nКритическая ошибка: Токенизатор '{MODEL_NAME}' не имеет стандартного <bos> токена.")
+             sys.exit(1)
+        if tokenizer.eos_token_id is None:
+             print(f"\nКритическая ошибка: Токенизатор '{MODEL_NAME}' не имеет стандартного <eos> токена.")
+             sys.exit(1)
+
+        bos_token_id = tokenizer.bos_token_id
+        eos_token_id = tokenizer.eos_token_id
+        vocab_size = len(tokenizer)
+
+        print(f"  Размер словаря (vocab size): {vocab_size}")
+        print(f"  ID токена начала последовательности (<bos>): {bos_token_id}")
+        print(f"  ID токена конца последовательности (<eos>): {eos_token_id}")
+
+    except Exception as e:
+        print(f"\nКритическая ошибка: Не удалось загрузить или настроить токенизатор для модели '{MODEL_NAME}'.")
+        print(f"Убедитесь, что у вас установлен transformers (`pip install transformers`) и huggingface_hub (`pip install huggingface_hub`),")
+        print(f"есть доступ к интернету и при необходимости выполнена аутентификация (`huggingface-cli login`).")
+        print(f"Ошибка: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+    print("="*50)
+
+    # --- Шаг 2: Подготовка выходных файлов и директории ---
+    print("\n" + "="*50)
+    print(f"Шаг 2: Подготовка выходной директории '{output_dir}' и бинарных файлов...")
 
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f):
+    train_filepath = os.path.join(output_dir, 'train.bin')
+    val_filepath = os.path.join(output_dir, 'val.bin')
+    manifest_filepath = os.path.join(output_dir, MANIFEST_FILENAME)
+    # Настройки, при изменении которых уже записанные токены становятся неверными
+    prepare_settings = {
+        'tokenizer_model': MODEL_NAME,
+        'bos_token_id': bos_token_id,
+        'eos_token_id': eos_token_id,
+        'train_val_split': train_val_split,
+        'split_method': SPLIT_METHOD,
+    }
+
+    # Список файлов всех источников: (формат, [файлы])
+    source_files = [(src['format'], list_source_files(src['path'])) for src in input_sources]
+
+    start_offsets = {}
+    manifest = None
+    incremental = False
+    if INCREMENTAL and COMPACT_VOCAB:
+        print("  Внимание: COMPACT_VOCAB перенумеровывает весь корпус - инкрементальный режим отключен, полная пересборка.")
+    elif INCREMENTAL:
+        manifest = load_manifest(manifest_filepath)
+        if manifest is None:
+            print("  Манифест предыдущего запуска не найден - полная сборка корпуса.")
+        else:
+            start_offsets, reason = plan_incremental(manifest, prepare_settings, source_files, train_filepath, val_filepath)
+            if start_offsets is None:
+                print(f"  Полная пересборка корпуса: {reason}.")
+                manifest = None
+            else:
+                incremental = True
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+
+        if incremental:
+            # Отрезаем хвосты, записанные прерванным запуском после последнего сохранения манифеста
+            os.truncate(train_filepath, manifest['train_bytes'])
+            os.truncate(val_filepath, manifest['val_bytes'])
+            train_file = open(train_filepath, 'ab')
+            val_file = open(val_filepath, 'ab')
+            print(f"Инкрементальный режим: дописываем новые статьи к существующим train.bin ({manifest['train_bytes'] // 4} токенов) и val.bin ({manifest['val_bytes'] // 4} токенов).")
+        else:
+            if os.path.exists(manifest_filepath):
+                os.remove(manifest_filepath)
+            # Открываем файлы в бинарном режиме для записи
+            train_file = open(train_filepath, 'wb')
+            val_file = open(val_filepath, 'wb')
+            if INCREMENTAL and not COMPACT_VOCAB:
+                manifest = {'settings': prepare_settings, 'train_bytes': 0, 'val_bytes': 0, 'files': {}, 'totals': None}
+
+        print(f"Директория '{output_dir}' готова.")
+        print(f"Файлы '{train_filepath}' и '{val_filepath}' открыты для записи.")
+
+    except Exception as e:
+        print(f"\nКритическая ошибка: Не удалось подготовить выходную директорию или файлы.")
+        print(f"Ошибка: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+    print("="*50)
+
+
+    # --- Шаг 3: Чтение, токенизация, разделение и запись статей ---
+    print("\n" + "="*50)
+    print("Шаг 3: Чтение, токенизация, разделение и запись статей...")
+
+    num_workers = max(1, int(NUM_WORKERS))
+    pool = None
+    if num_workers > 1:
+        # Процессы загружают токенизатор из локального кэша (он уже скачан на Шаге 1)
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(MODEL_NAME,))
+        print(f"Процессов токенизации: {num_workers}, статей в пакете: {BATCH_SIZE}")
+    else:
+        _worker_tokenizer = tokenizer
+        print("Токенизация в основном процессе (NUM_WORKERS = 1).")
+
+    total_articles_processed = 0 # Всего статей, которые скрипт ПЫТАЛСЯ обработать (попыток чтения строк из файлов)
+    total_articles_successfully_processed = 0 # Всего статей, из которых успешно извлечен текст
+    total_articles_skipped = 0
+    token_counts = collections.defaultdict(int) # Для подсчета токенов текста статьи (без BOS/EOS) по источникам
+    article_counts = collections.defaultdict(int) # Для подсчета статей по источникам (только успешно обработанные)
+    output_token_counts = {'train': 0, 'val': 0} # Для подсчета токенов в train/val файлах (включая BOS/EOS)
+
+    if incremental and manifest.get('totals'):
+        # Продолжаем статистику предыдущих запусков
+        totals = manifest['totals']
+        total_articles_processed = totals['total_articles_processed']
+        total_articles_successfully_processed = totals['total_articles_successfully_processed']
+        total_articles_skipped = totals['total_articles_skipped']
+        token_counts.update(totals['token_counts'])
+        article_counts.update(totals['article_counts'])
+        output_token_counts.update(totals['output_token_counts'])
+    tokens_at_start = sum(token_counts.values())
+    articles_at_start = total_articles_processed
+
+    bos_eos_ids = np.array([bos_token_id, eos_token_id], dtype=np.uint32)
+    # Какие ID токенов реально встречаются в корпусе (для COMPACT_VOCAB)
+    used_token_ids = np.zeros(max(vocab_size, bos_token_id + 1, eos_token_id + 1), dtype=bool)
+    used_token_ids[bos_eos_ids] = True
+    start_time = time.time()
+
+    try:
+        for source_format, file_list in source_files:
+            if not file_list:
+                continue
+            print(f"\nОбработка источника: формат {source_format}, файлов: {len(file_list)}")
+
+            file_items = []
+            for file_path in file_list:
+                start_offset = start_offsets.get(file_path, 0)
+                if start_offset > 0 and start_offset >= os.path.getsize(file_path):
+                    print(f"  Файл '{os.path.basename(file_path)}' не изменился с прошлого запуска. Пропускаем.")
+                    continue
+                if start_offset > 0:
+                    print(f"  Файл '{os.path.basename(file_path)}' дописан: обрабатываем с байта {start_offset}.")
+                file_items.append((file_path, start_offset))
+
+            articles_in_file_processed = 0
+            articles_in_file_successfully_processed = 0
+            error_in_file_lines = 0
+
+            batches = iter_file_batches(file_items, source_format, complete_lines_only=manifest is not None)
+            for (file_path, is_last_batch, end_offset), batch_results in ordered_map(pool, batches, num_workers * MAX_PENDING_BATCHES_PER_WORKER):
+                for status, article_token_ids, article_split_value in batch_results:
                     total_articles_processed += 1
                     articles_in_file_processed += 1
 
-                    article_text_raw = None # Исходный текст из JSON
-                    article_text_cleaned = None # Очищенный текст для токенизации
-                    skip_reason = None
-
-                    try:
-                        item = json.loads(line)
-
-                        # Логика извлечения и ПЕРВИЧНОЙ очистки текста в зависимости от формата
-                        if source_format == 'generated_original':
-                            article_text_raw = item.get('text')
-                            # УДАЛЯЕМ <think> блоки из generated_original
-                            if isinstance(article_text_raw, str):
-                                article_text_cleaned = THINK_TAG_REGEX.sub('', article_text_raw).strip()
-                            else:
-                                skip_reason = "text field missing or not string"
-
-
-                        elif source_format == 'wiki_original':
-                            article_text_raw = item.get('text')
-                            # Для wiki_original просто берем текст и чистим пробелы
-                            if isinstance(article_text_raw, str):
-                                article_text_cleaned = article_text_raw.strip()
-                            else:
-                                skip_reason = "text field missing or not string"
-
-
-                        elif source_format == 'wiki_generated':
-                            # Для сгенерированных статей проверяем статус и удаляем <think> блоки (уже должно быть сделано, но повторим для безопасности)
-                            status = item.get('generation_status')
-                            if status == GENERATION_SUCCESS_STATUS:
-                                article_text_raw = item.get('generated_text')
-                                if isinstance(article_text_raw, str):
-                                     article_text_cleaned = THINK_TAG_REGEX.sub('', article_text_raw).strip()
-                                else:
-                                    skip_reason = f"generated_text missing or not string (status '{status}')"
-                            else:
-                                skip_reason = f"status is '{status}' != '{GENERATION_SUCCESS_STATUS}'"
-
-                        else:
-                             skip_reason = f"unknown format '{source_format}'"
-
-                        # Дополнительная проверка: текст не должен быть пустым или слишком коротким после очистки
-                        if article_text_cleaned and len(article_text_cleaned) < 50: # Минимальная длина текста, например, 50 символов
-                             skip_reason = f"text too short after cleaning ({len(article_text_cleaned)} chars)"
-                             article_text_cleaned = None # Сбрасываем текст, если слишком короткий
-                        elif not article_text_cleaned and skip_reason is None:
-                             # Если текст None/пуст после очистки, но skip_reason не установлен (напр. исходно был пуст)
-                             skip_reason = "text empty after cleaning"
-
-
-                    except json.JSONDecodeError:
-                        skip_reason = "JSONDecodeError"
-                        error_in_file_lines += 1
-                    except Exception as e:
-                        skip_reason = f"ExtractionError: {e}"
-                        error_in_file_lines += 1
-                        # traceback.print_exc() # Опционально
-
-
-                    # Если очищенный текст статьи доступен и не пропущен
-                    if article_text_cleaned:
+                    if status in ('ok', 'empty_tokens', 'tok_error'):
+                        # Текст статьи извлечен успешно
                         articles_in_file_successfully_processed += 1
                         total_articles_successfully_processed += 1
 
-                        try:
-                            # Токенизация текста статьи
-                            # add_special_tokens=False, чтобы не добавлять стандартные BOS/EOS от encode
-                            article_token_ids = tokenizer.encode(article_text_cleaned, add_special_tokens=False)
-
-                            if not article_token_ids:
-                                skip_reason = "empty token_ids after encoding"
-                                # Если нет токенов, это ошибка обработки
-                                # print(f"  Внимание: Статья {total_articles_processed} дала 0 токенов после кодирования.") # Отладочное сообщение
-                                total_articles_skipped += 1 # Считаем пропущенной
-                                continue # Переходим к следующей статье
-
-                            # Подсчет токенов для статистики по источникам (без BOS/EOS)
-                            token_counts[source_format] += len(article_token_ids)
-                            article_counts[source_format] += 1 # Считаем только успешно токенизированные статьи
-
-                            # Случайное разделение на train/val
-                            if random.random() < train_val_split:
-                                target_file = train_file
-                                split_type = 'train'
-                            else:
-                                target_file = val_file
-                                split_type = 'val'
-
-                            # Формируем последовательность ID для записи: <bos> + текст + <eos>
-                            ids_to_write = [bos_token_id] + article_token_ids + [eos_token_id]
-
-                            # Записываем последовательность ID в бинарный файл
-                            # ИСПОЛЬЗУЕМ np.uint32
-                            np.array(ids_to_write, dtype=np.uint32).tofile(target_file)
-
-                            # Подсчет токенов в выходных файлах (включая BOS/EOS)
-                            output_token_counts[split_type] += len(ids_to_write)
-
-                        except Exception as e:
-                            skip_reason = f"Tokenization/WritingError: {e}"
+                    if status != 'ok':
+                        total_articles_skipped += 1
+                        if status in ('error', 'tok_error'):
                             error_in_file_lines += 1
-                            total_articles_skipped += 1 # Считаем пропущенной
-                            # print(f"  Ошибка при токенизации/записи статьи {total_articles_processed}: {e}") # Отладочное сообщение
-                            # traceback.print_exc() # Опционально
-
-                    # Если статья была пропущена на этапе извлечения/очистки текста
-                    elif skip_reason:
-                         total_articles_skipped += 1
-                         # Опционально: выводить причину пропуска для каждой статьи, если нужно отлаживать
-                         # print(f"  Пропущена статья {total_articles_processed} (из файла {os.path.basename(file_path)}, строка {line_num + 1}): {skip_reason}")
-
-
-            # Статистика по текущему файлу
-            print(f"  Завершено чтение файла '{os.path.basename(file_path)}'. Всего записей в файле: {articles_in_file_processed}, Успешно обработано: {articles_in_file_successfully_processed}, Ошибки чтения/парсинга: {error_in_file_lines}")
-
-
-        except FileNotFoundError:
-            print(f"  Ошибка: Файл не найден '{file_path}'. Пропускаем.")
-            # articles_in_file_processed статей из этого файла не были учтены в total_articles_processed
-            # Статьи, пропущенные в этом файле, уже должны были быть учтены в total_articles_skipped
-            pass
-
+                        continue
+
+                    # Подсчет токенов для статистики по источникам (без BOS/EOS)
+                    token_counts[source_format] += len(article_token_ids)
+                    article_counts[source_format] += 1 # Считаем только успешно токенизированные статьи
+
+                    if COMPACT_VOCAB:
+                        if article_token_ids.max() >= len(used_token_ids):
+                            # ID за пределами len(tokenizer) - маловероятно, но расширяем таблицу
+                            used_token_ids = np.concatenate([used_token_ids, np.zeros(int(article_token_ids.max()) + 1 - len(used_token_ids), dtype=bool)])
+                        used_token_ids[article_token_ids] = True
+
+                    # Разделение на train/val по хэшу текста (не меняется между запусками)
+                    if article_split_value < train_val_split:
+                        target_file = train_file
+                        split_type = 'train'
+                    else:
+                        target_file = val_file
+                        split_type = 'val'
+
+                    # Записываем последовательность ID: <bos> + текст + <eos> (np.uint32)
+                    bos_eos_ids[:1].tofile(target_file)
+                    article_token_ids.tofile(target_file)
+                    bos_eos_ids[1:].tofile(target_file)
+
+                    # Подсчет токенов в выходных файлах (включая BOS/EOS)
+                    output_token_counts[split_type] += len(article_token_ids) + 2
+
+                if is_last_batch:
+                    # Статистика по текущему файлу
+                    elapsed = time.time() - start_time
+                    run_tokens = sum(token_counts.values()) - tokens_at_start
+                    print(f"  Завершено чтение файла '{os.path.basename(file_path)}'. Всего записей в файле: {articles_in_file_processed}, Успешно обработано: {articles_in_file_successfully_processed}, Ошибки чтения/парсинга: {error_in_file_lines}")
+                    print(f"    Скорость: {run_tokens / max(elapsed, 1e-9):.0f} токенов/сек")
+                    articles_in_file_processed = 0
+                    articles_in_file_successfully_processed = 0
+                    error_in_file_lines = 0
+
+                    if manifest is not None:
+                        # Файл целиком записан: фиксируем его в манифесте вместе с размерами train.bin/val.bin
+                        train_file.flush()
+                        val_file.flush()
+                        manifest['files'][file_path] = {
+                            'format': source_format,
+                            'processed_bytes': end_offset,
+                            'fingerprint': file_fingerprint(file_path, end_offset),
+                        }
+                        manifest['train_bytes'] = train_file.tell()
+                        manifest['val_bytes'] = val_file.tell()
+                        manifest['totals'] = {
+                            'total_articles_processed': total_articles_processed,
+                            'total_articles_successfully_processed': total_articles_successfully_processed,
+                            'total_articles_skipped': total_articles_skipped,
+                            'token_counts': dict(token_counts),
+                            'article_counts': dict(article_counts),
+                            'output_token_counts': dict(output_token_counts),
+                        }
+                        save_manifest(manifest_filepath, manifest)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    tokenization_time = time.time() - start_time
+
+
+    # --- Шаг 4: Завершение и вывод статистики ---
+    print("\n" + "="*50)
+    print("Шаг 4: Завершение обработки и вывод статистики...")
+
+    # Закрываем бинарные файлы
+    try:
+        train_file.close()
+        val_file.close()
+        print("Бинарные файлы train.bin и val.bin успешно закрыты.")
+    except Exception as e:
+         print(f"Ошибка при закрытии бинарных файлов: {e}")
+
+    # Компактный словарь: перенумеровываем ID и перезаписываем бинарные файлы
+    model_vocab_size = vocab_size
+    bin_dtype = np.uint32
+    token_id_map = None
+    if COMPACT_VOCAB:
+        print("\nКомпактный словарь: перенумерация используемых ID токенов...")
+        try:
+            token_id_map = np.flatnonzero(used_token_ids) # Индекс - новый ID, значение - ID токенизатора
+            model_vocab_size = len(token_id_map)
+            remap_table = np.zeros(len(used_token_ids), dtype=np.uint32)
+            remap_table[token_id_map] = np.arange(model_vocab_size, dtype=np.uint32)
+            # uint16 вдвое уменьшает файлы и чтение с диска, если словарь в него помещается
+            bin_dtype = np.uint16 if model_vocab_size <= 65536 else np.uint32
+            compact_start_time = time.time()
+            for filepath in (train_filepath, val_filepath):
+                compact_bin_file(filepath, remap_table, bin_dtype)
+            print(f"  Используется {model_vocab_size} из {vocab_size} токенов словаря ({model_vocab_size / vocab_size:.1%}).")
+            print(f"  Бинарные файлы перезаписаны в формате {np.dtype(bin_dtype).name} за {time.time() - compact_start_time:.1f} сек.")
         except Exception as e:
-            print(f"  Критическая ошибка при чтении файла '{file_path}': {e}")
+            print(f"\nКритическая ошибка: Не удалось перенумеровать токены: {e}")
             traceback.print_exc()
-            # Статьи, пропущенные в этом файле, уже должны были быть учтены в total_articles_skipped
-            pass # Продолжаем с другими файлами/источниками
-
-
-# --- Шаг 4: Завершение и вывод статистики ---
-print("\n" + "="*50)
-print("Шаг 4: Завершение обработки и вывод статистики...")
-
-# Закрываем бинарные файлы
-try:
-    train_file.close()
-    val_file.close()
-    print("Бинарные файлы train.bin и val.bin успешно закрыты.")
-except Exception as e:
-     print(f"Ошибка при закрытии бинарных файлов: {e}")
-
-# Сохраняем meta.json
-meta_filepath = os.path.join(output_dir, 'meta.json')
-meta_info = {
-    'vocab_size': vocab_size,
-    'bos_token_id': bos_token_id,
-    'eos_token_id': eos_token_id,
-    'source_files': [src['path'] for src in input_sources],
-    'train_val_split': train_val_split,
-    'tokenizer_model': MODEL_NAME,
-    'total_articles_processed_attempts': total_articles_processed,
-    'total_articles_successfully_processed': total_articles_successfully_processed,
-    'total_articles_skipped': total_articles_skipped, # ЭТА ПЕРЕМЕННАЯ ТЕПЕРЬ ИНИЦИАЛИЗИРОВАНА
-    'total_tokens_in_output_including_special': output_token_counts['train'] + output_token_counts['val'],
-    'train_token_count': output_token_counts['train'],
-    'val_token_count': output_token_counts['val'],
-    'average_tokens_per_article_by_source_without_special': {}, # Будет заполнено ниже
-    'article_counts_by_source': dict(article_counts), # Сохраняем количество успешно обработанных статей по источникам
-    'token_counts_by_source_without_special': dict(token_counts), # Сохраняем количество токенов по источникам (без BOS/EOS)
-}
-
-# Расчет средней длины статьи в токенах (без учета <bos>/<eos>) по источникам
-print("\nСредняя длина статьи в токенах (без учета <bos>/<eos>) по источникам:")
-for source_config in input_sources:
-    fmt = source_config['format']
-    num_articles = article_counts.get(fmt, 0)
-    num_tokens = token_counts.get(fmt, 0)
-    if num_articles > 0:
-        avg_tokens = num_tokens / num_articles
-        meta_info['average_tokens_per_article_by_source_without_special'][fmt] = avg_tokens
-        print(f"  '{fmt}': {avg_tokens:.2f} токенов/статья ({num_articles} статей)")
-    else:
-        meta_info['average_tokens_per_article_by_source_without_special'][fmt] = 0
-        print(f"  '{fmt}': Нет успешно обработанных статей из этого источника.")
-
-
-try:
-    with open(meta_filepath, 'w', encoding='utf-8') as meta_f:
-        json.dump(meta_info, meta_f, ensure_ascii=False, indent=4)
-    print(f"\nФайл метаданных '{meta_filepath}' сохранен.")
-except Exception as e:
-    print(f"\nОшибка при сохранении файла метаданных: {e}")
-
-
-print("\nОбщая статистика обработки:")
-print(f"Всего статей обработано (попыток чтения): {total_articles_processed}")
-print(f"Всего статей успешно обработано и включено в корпус: {total_articles_successfully_processed}")
-print(f"Всего статей пропущено (ошибки, статус, слишком короткие): {total_articles_skipped}")
-
-
-print("\nКоличество токенов в выходных файлах (включая <bos>/<eos>):")
-print(f"  train.bin: {output_token_counts['train']} токенов")
-print(f"  val.bin:   {output_token_counts['val']} токенов")
-total_output_tokens = output_token_counts['train'] + output_token_counts['val']
-print(f"  Всего записано токенов: {total_output_tokens}")
-
-print("\nСкрипт prepare.py завершил работу.")
-print("Дальнейшие действия:")
-print(f"1. Убедитесь, что в '{output_dir}' созданы файлы train.bin, val.bin и meta.json.")
-print("2. Используйте информацию из meta.json для настройки конфигурации модели nanoGPT (в файле config.py или аналогичном):")
-print(f"   - Размер словаря (vocab_size) должен быть: {meta_info['vocab_size']}")
-print("   - ID токенов <bos> и <eos> (если нужны в логике модели/сэмплинга):")
-print(f"     bos_token_id = {meta_info['bos_token_id']}")
-print(f"     eos_token_id = {meta_info['eos_token_id']}")
-print("   - Укажите путь к данным: data_dir = '{output_dir}'")
-print("   - Подберите параметры модели (n_layer, n_embd, n_head) так, чтобы общее количество параметров было ~50-60M с учетом нового vocab_size.")
-print("3. Настройте скрипт сэмплирования (sample.py), чтобы он использовал токенизатор")
-print(f"   '{MODEL_NAME}' и знал ID <bos>/<eos> (из meta.json) для декодирования.")
-print("4. Запускайте тренировку nanoGPT.")
-
-print("="*50)
\ No newline at end of file
+            sys.exit(1)
+
+    # Сохраняем meta.json
+    meta_filepath = os.path.join(output_dir, 'meta.json')
+    meta_info = {
+        'vocab_size': model_vocab_size, # Размер словаря модели (при COMPACT_VOCAB - компактного)
+        'tokenizer_vocab_size': vocab_size,
+        'bin_dtype': np.dtype(bin_dtype).name,
+        'bos_token_id': bos_token_id,
+        'eos_token_id': eos_token_id,
+        'source_files': [src['path'] for src in input_sources],
+        'train_val_split': train_val_split,
+        'split_method': SPLIT_METHOD,
+        'tokenizer_model': MODEL_NAME,
+        'total_articles_processed_attempts': total_articles_processed,
+        'total_articles_successfully_processed': total_articles_successfully_processed,
+        'total_articles_skipped': total_articles_skipped,
+        'total_tokens_in_output_including_special': output_token_counts['train'] + output_token_counts['val'],
+        'train_token_count': output_token_counts['train'],
+        'val_token_count': output_token_counts['val'],
+        'average_tokens_per_article_by_source_without_special': {}, # Будет заполнено ниже
+        'article_counts_by_source': dict(article_counts), # Сохраняем количество успешно обработанных статей по источникам
+        'token_counts_by_source_without_special': dict(token_counts), # Сохраняем количество токенов по источникам (без BOS/EOS)
+    }
+    if token_id_map is not None:
+        # bos_token_id/eos_token_id остаются ID токенизатора, в бинарных файлах они перенумерованы по этой таблице
+        meta_info['token_id_map'] = token_id_map.tolist()
+
+    # Расчет средней длины статьи в токенах (без учета <bos>/<eos>) по источникам
+    print("\nСредняя длина статьи в токенах (без учета <bos>/<eos>) по источникам:")
+    for source_config in input_sources:
+        fmt = source_config['format']
+        num_articles = article_counts.get(fmt, 0)
+        num_tokens = token_counts.get(fmt, 0)
+        if num_articles > 0:
+            avg_tokens = num_tokens / num_articles
+            meta_info['average_tokens_per_article_by_source_without_special'][fmt] = avg_tokens
+            print(f"  '{fmt}': {avg_tokens:.2f} токенов/статья ({num_articles} статей)")
+        else:
+            meta_info['average_tokens_per_article_by_source_without_special'][fmt] = 0
+            print(f"  '{fmt}': Нет успешно обработанных статей из этого источника.")
+
+
+    try:
+        with open(meta_filepath, 'w', encoding='utf-8') as meta_f:
+            json.dump(meta_info, meta_f, ensure_ascii=False, indent=4)
+        print(f"\nФайл метаданных '{meta_filepath}' сохранен.")
+    except Exception as e:
+        print(f"\nОшибка при сохранении файла метаданных: {e}")
+
+
+    print("\nОбщая статистика обработки:")
+    print(f"Всего статей обработано (попыток чтения): {total_articles_processed}")
+    print(f"Всего статей успешно обработано и включено в корпус: {total_articles_successfully_processed}")
+    print(f"Всего статей пропущено (ошибки, статус, слишком короткие): {total_articles_skipped}")
+
+
+    print("\nКоличество токенов в выходных файлах (включая <bos>/<eos>):")
+    print(f"  train.bin: {output_token_counts['train']} токенов")
+    print(f"  val.bin:   {output_token_counts['val']} токенов")
+    total_output_tokens = output_token_counts['train'] + output_token_counts['val']
+    print(f"  Всего записано токенов: {total_output_tokens}")
+    if tokenization_time > 0:
+        print(f"  Время Шага 3: {tokenization_time:.1f} сек, скорость: {(sum(token_counts.values()) - tokens_at_start) / tokenization_time:.0f} токенов/сек "
+              f"({(total_articles_processed - articles_at_start) / tokenization_time:.0f} статей/сек, процессов: {num_workers})")
+
+    print("\nСкрипт prepare.py завершил работу.")
+    print("Дальнейшие действия:")
+    print(f"1. Убедитесь, что в '{output_dir}' созданы файлы train.bin, val.bin и meta.json.")
+    print("2. Используйте информацию из meta.json для настройки конфигурации модели nanoGPT (в файле config.py или аналогичном):")
+    print(f"   - Размер словаря (vocab_size) должен быть: {meta_info['vocab_size']}")
+    print("   - ID токенов <bos> и <eos> (если нужны в логике модели/сэмплинга):")
+    print(f"     bos_token_id = {meta_info['bos_token_id']}")
+    print(f"     eos_token_id = {meta_info['eos_token_id']}")
+    print("   - Укажите путь к данным: data_dir = '{output_dir}'")
+    print("   - Подберите параметры модели (n_layer, n_embd, n_head) так, чтобы общее количество параметров было ~50-60M с учетом нового vocab_size.")
+    print("3. Настройте скрипт сэмплирования (sample.py), чтобы он использовал токенизатор")
+    print(f"   '{MODEL_NAME}' и знал ID <bos>/<eos> (из meta.json) для декодирования.")
+    print("4. Запускайте тренировку nanoGPT.")
+
+    print("="*50)
+
+
+# Точка входа под защитой __main__: процессы токенизации (на Windows - spawn) импортируют этот файл
+# и не должны повторно выполнять основную логику
+if __name__ == "__main__":
+    main()
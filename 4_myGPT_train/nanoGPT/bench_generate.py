@@ -0,0 +1,63 @@
+"""
+Скорость генерации GPT.generate с KV-кэшем и без него (токенов/сек) и проверка, что при жадном
+выборе (top_k=1) обе версии генерируют одинаковые токены, в том числе за пределами block_size.
+Веса случайные, по умолчанию модель - как в config/train_custom_corpus_small.py, но меньший словарь.
+$ python bench_generate.py
+$ python bench_generate.py --device=cuda --max_new_tokens=1000
+"""
+import time
+from contextlib import nullcontext
+
+import torch
+from model import GPTConfig, GPT
+
+# -----------------------------------------------------------------------------
+batch_size = 1
+prompt_len = 16
+max_new_tokens = 300
+block_size = 256 # prompt_len + max_new_tokens > block_size - проверяется и скользящее окно
+n_layer = 6
+n_head = 8
+n_embd = 512
+vocab_size = 32768
+seed = 1337
+device = 'cpu' # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
+dtype = 'float32' # 'float32' or 'bfloat16' or 'float16'
+exec(open('configurator.py').read()) # overrides from command line or config file
+# -----------------------------------------------------------------------------
+
+torch.manual_seed(seed)
+device_type = 'cuda' if 'cuda' in device else 'cpu' # for later use in torch.autocast
+ptdtype = {'float32': torch.float32, 'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype]
+ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=device_type, dtype=ptdtype)
+
+gptconf = GPTConfig(block_size=block_size, vocab_size=vocab_size, n_layer=n_layer, n_head=n_head, n_embd=n_embd,
+                    dropout=0.0, bias=False)
+model = GPT(gptconf)
+model.eval()
+model.to(device)
+
+x = torch.randint(vocab_size, (batch_size, prompt_len), device=device)
+
+def sync():
+    if device_type == 'cuda':
+        torch.cuda.synchronize()
+
+def run(use_kv_cache):
+    with torch.no_grad(), ctx:
+        model.generate(x, 8, top_k=1, use_kv_cache=use_kv_cache) # прогрев
+        sync()
+        t0 = time.time()
+        y = model.generate(x, max_new_tokens, top_k=1, use_kv_cache=use_kv_cache)
+        sync()
+    return y, batch_size * max_new_tokens / (time.time() - t0)
+
+print(f"batch_size={batch_size}, prompt_len={prompt_len}, max_new_tokens={max_new_tokens}, block_size={block_size}, device={device}, dtype={dtype}")
+y_full, tps_full = run(False)
+y_cached, tps_cached = run(True)
+print(f"without KV cache: {tps_full:.1f} tokens/s")
+print(f"with KV cache:    {tps_cached:.1f} tokens/s ({tps_cached / tps_full:.1f}x)")
+generated_full = y_full[:, prompt_len:]
+generated_cached = y_cached[:, prompt_len:]
+match = (generated_full == generated_cached).float().mean().item()
+print(f"greedy tokens identical: {match:.1%}")
@@ -0,0 +1,84 @@
+"""
+Сравнение обычного и чанкового (loss_chunk_size) расчета loss: пиковая память, токены/сек
+и совпадение loss/градиентов. Модель - как в config/train_custom_corpus_long.py.
+$ python bench_loss.py
+$ python bench_loss.py --batch_size=8 --loss_chunk_size=2048
+"""
+import time
+from contextlib import nullcontext
+
+import torch
+from model import GPTConfig, GPT
+
+# -----------------------------------------------------------------------------
+batch_size = 4
+block_size = 512
+n_layer = 6
+n_head = 8
+n_embd = 512
+vocab_size = 262144
+loss_chunk_size = 1024 # токенов в чанке для чанкового режима
+num_steps = 10 # замеряемых шагов forward+backward на режим (после 3 шагов прогрева)
+seed = 1337
+device = 'cuda' # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
+dtype = 'bfloat16' if torch.cuda.is_available() and torch.cuda.is_bf16_supported() else 'float16' # 'float32' or 'bfloat16' or 'float16'
+exec(open('configurator.py').read()) # overrides from command line or config file
+# -----------------------------------------------------------------------------
+
+torch.manual_seed(seed)
+torch.backends.cuda.matmul.allow_tf32 = True # allow tf32 on matmul
+torch.backends.cudnn.allow_tf32 = True # allow tf32 on cudnn
+device_type = 'cuda' if 'cuda' in device else 'cpu' # for later use in torch.autocast
+ptdtype = {'float32': torch.float32, 'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype]
+ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=device_type, dtype=ptdtype)
+
+gptconf = GPTConfig(block_size=block_size, vocab_size=vocab_size, n_layer=n_layer, n_head=n_head, n_embd=n_embd,
+                    dropout=0.0, bias=False)
+model = GPT(gptconf)
+model.to(device)
+
+X = torch.randint(vocab_size, (batch_size, block_size), device=device)
+Y = torch.randint(vocab_size, (batch_size, block_size), device=device)
+
+def sync():
+    if device_type == 'cuda':
+        torch.cuda.synchronize()
+
+def run(chunk_size):
+    """Возвращает (loss, градиент lm_head, токенов/сек, пиковая память МБ или None)."""
+    model.config.loss_chunk_size = chunk_size
+    model.zero_grad(set_to_none=True)
+    with ctx:
+        _, loss = model(X, Y)
+    loss.backward()
+    reference = (loss.item(), model.lm_head.weight.grad.float().clone())
+    for _ in range(2): # прогрев
+        model.zero_grad(set_to_none=True)
+        with ctx:
+            _, loss = model(X, Y)
+        loss.backward()
+    model.zero_grad(set_to_none=True)
+    sync()
+    if device_type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    t0 = time.time()
+    for _ in range(num_steps):
+        model.zero_grad(set_to_none=True)
+        with ctx:
+            _, loss = model(X, Y)
+        loss.backward()
+    sync()
+    dt = time.time() - t0
+    peak_mb = torch.cuda.max_memory_allocated() / 2**20 if device_type == 'cuda' else None
+    return reference[0], reference[1], batch_size * block_size * num_steps / dt, peak_mb
+
+print(f"batch_size={batch_size}, block_size={block_size}, vocab_size={vocab_size}, dtype={dtype}, device={device}")
+full_loss, full_grad, full_tps, full_mem = run(0)
+chunk_loss, chunk_grad, chunk_tps, chunk_mem = run(loss_chunk_size)
+
+fmt_mem = lambda mb: f"{mb:.0f} MB" if mb is not None else "n/a"
+print(f"{'mode':<22} {'loss':>10} {'tokens/s':>10} {'peak memory':>12}")
+print(f"{'full logits':<22} {full_loss:>10.4f} {full_tps:>10.0f} {fmt_mem(full_mem):>12}")
+print(f"{f'chunked ({loss_chunk_size})':<22} {chunk_loss:>10.4f} {chunk_tps:>10.0f} {fmt_mem(chunk_mem):>12}")
+grad_diff = (full_grad - chunk_grad).abs().max().item() / full_grad.abs().max().item()
+print(f"loss diff: {abs(full_loss - chunk_loss):.2e}, lm_head grad max rel diff: {grad_diff:.2e}")
@@ -0,0 +1,136 @@
+"""
+Нагрузочный тест: запросы приходят по пуассоновскому потоку (arrival_rate запросов/сек)
+с разной длиной затравки и разным max_new_tokens. Сравниваются
+- static: динамическое батчирование как в serve.py (пришедшие запросы собираются в батч до num_slots
+  и генерируются GPT.generate_batch до конца самого длинного),
+- continuous: ContinuousBatchingScheduler (scheduler.py) - запросы входят в батч и выходят из него на каждом шаге.
+Для каждого режима: пропускная способность (запросов/сек, токенов/сек) и p50/p99 задержки запроса.
+Веса случайные, eos не используется - длина ответа задается max_new_tokens.
+Перед замером проверяется, что жадный вывод (top_k=1) планировщика для нескольких одновременных
+затравок совпадает с GPT.generate.
+$ python loadtest_scheduler.py
+$ python loadtest_scheduler.py --device=cuda --arrival_rate=20.0 --num_requests=500
+"""
+import random
+import time
+from contextlib import nullcontext
+
+import torch
+from model import GPTConfig, GPT
+from scheduler import ContinuousBatchingScheduler
+
+# -----------------------------------------------------------------------------
+num_requests = 100
+arrival_rate = 4.0 # запросов в секунду (пуассоновский поток)
+prompt_len_min = 8
+prompt_len_max = 64
+new_tokens_min = 8
+new_tokens_max = 128
+num_slots = 8 # размер батча / число слотов KV-кэша
+block_size = 256
+n_layer = 6
+n_head = 8
+n_embd = 512
+vocab_size = 32768
+seed = 1337
+device = 'cpu' # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
+dtype = 'float32' # 'float32' or 'bfloat16' or 'float16'
+exec(open('configurator.py').read()) # overrides from command line or config file
+# -----------------------------------------------------------------------------
+
+torch.manual_seed(seed)
+device_type = 'cuda' if 'cuda' in device else 'cpu' # for later use in torch.autocast
+ptdtype = {'float32': torch.float32, 'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype]
+ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=device_type, dtype=ptdtype)
+
+model = GPT(GPTConfig(block_size=block_size, vocab_size=vocab_size, n_layer=n_layer, n_head=n_head, n_embd=n_embd,
+                      dropout=0.0, bias=False))
+model.eval()
+model.to(device)
+
+# одинаковая нагрузка для обоих режимов: (время прихода, затравка, max_new_tokens)
+rng = random.Random(seed)
+workload = []
+arrival = 0.0
+for _ in range(num_requests):
+    arrival += rng.expovariate(arrival_rate)
+    prompt = [rng.randrange(vocab_size) for _ in range(rng.randint(prompt_len_min, prompt_len_max))]
+    workload.append((arrival, prompt, rng.randint(new_tokens_min, new_tokens_max)))
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def wait_for(t0, arrival_time):
+    delay = t0 + arrival_time - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+def check_greedy_matches_generate(num_new_tokens=12):
+    # затравок больше, чем слотов: часть входит в батч по мере освобождения слотов;
+    # последняя затравка выходит за block_size и проверяет перезаполнение окна
+    lengths = [1, 5, prompt_len_min, prompt_len_max] + [rng.randint(prompt_len_min, prompt_len_max) for _ in range(num_slots - 3)]
+    lengths.append(block_size - num_new_tokens // 2)
+    prompts = [[rng.randrange(vocab_size) for _ in range(n)] for n in lengths]
+    max_new = [num_new_tokens - i % 4 for i in range(len(prompts))]
+    scheduler = ContinuousBatchingScheduler(model, num_slots)
+    seqs = [scheduler.submit(p, n, top_k=1) for p, n in zip(prompts, max_new)]
+    scheduler.run_until_idle()
+    for i, (prompt, n, seq) in enumerate(zip(prompts, max_new, seqs)):
+        idx = torch.tensor([prompt], dtype=torch.long, device=device)
+        expected = model.generate(idx, n, top_k=1)[0, len(prompt):].tolist()
+        assert seq.generated == expected, f"scheduler output differs from GPT.generate for prompt {i} (length {len(prompt)})"
+    print(f"greedy check: {len(prompts)} concurrent prompts match GPT.generate")
+
+def run_static():
+    latencies = []
+    tokens = 0
+    t0 = time.time()
+    next_request = 0
+    while next_request < len(workload):
+        if t0 + workload[next_request][0] > time.time():
+            wait_for(t0, workload[next_request][0])
+        # все пришедшие к этому моменту запросы, не больше num_slots
+        batch = []
+        now = time.time() - t0
+        while next_request < len(workload) and workload[next_request][0] <= now and len(batch) < num_slots:
+            batch.append(workload[next_request])
+            next_request += 1
+        rows = model.generate_batch([p for _, p, _ in batch], [n for _, _, n in batch])
+        finished = time.time() - t0
+        for (arrival_time, prompt, _), row in zip(batch, rows):
+            latencies.append(finished - arrival_time)
+            tokens += len(row) - len(prompt)
+    return time.time() - t0, latencies, tokens
+
+def run_continuous():
+    scheduler = ContinuousBatchingScheduler(model, num_slots)
+    latencies = []
+    tokens = 0
+    t0 = time.time()
+    next_request = 0
+    while next_request < len(workload) or scheduler.has_work():
+        if not scheduler.has_work():
+            wait_for(t0, workload[next_request][0])
+        now = time.time() - t0
+        while next_request < len(workload) and workload[next_request][0] <= now:
+            arrival_time, prompt, max_new_tokens = workload[next_request]
+            scheduler.submit(prompt, max_new_tokens, user_data=arrival_time)
+            next_request += 1
+        for seq in scheduler.step():
+            latencies.append(seq.finished_time - t0 - seq.user_data)
+            tokens += len(seq.generated)
+    return time.time() - t0, latencies, tokens
+
+print(f"{num_requests} requests, Poisson arrivals {arrival_rate}/s, prompt {prompt_len_min}-{prompt_len_max}, "
+      f"new tokens {new_tokens_min}-{new_tokens_max}, slots {num_slots}, device {device}")
+with torch.no_grad():
+    check_greedy_matches_generate() # в float32, без autocast: в половинной точности возможны расхождения округления
+with torch.no_grad(), ctx:
+    model.generate_batch([[0]], 2) # прогрев
+    results = [('static', run_static()), ('continuous', run_continuous())]
+
+print(f"{'mode':<12} {'time, s':>8} {'req/s':>7} {'tokens/s':>9} {'p50, s':>7} {'p99, s':>7}")
+for name, (elapsed, latencies, tokens) in results:
+    print(f"{name:<12} {elapsed:>8.1f} {len(latencies) / elapsed:>7.2f} {tokens / elapsed:>9.1f} "
+          f"{percentile(latencies, 0.5):>7.2f} {percentile(latencies, 0.99):>7.2f}")
@@ -14,6 +14,7 @@ from dataclasses import dataclass
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
+from torch.utils.checkpoint import checkpoint
 
 class LayerNorm(nn.Module):
     """ LayerNorm but with an optional bias. PyTorch doesn't support simply bias=False """
@@ -26,6 +27,26 @@ class LayerNorm(nn.Module):
     def forward(self, input):
         return F.layer_norm(input, self.weight.shape, self.weight, self.bias, 1e-5)
 
+class KVCache:
+    """ per-layer key/value cache for incremental decoding, preallocated for max_len positions """
+
+    def __init__(self, max_len):
+        self.max_len = max_len
+        self.length = 0 # number of positions already in the cache
+        self.k = None # (B, nh, max_len, hs), allocated on first append with the dtype of the keys
+        self.v = None
+
+    def append(self, k, v):
+        B, nh, T, hs = k.size()
+        assert self.length + T <= self.max_len, "KV cache overflow, re-fill it with a cropped window"
+        if self.k is None:
+            self.k = k.new_empty(B, nh, self.max_len, hs)
+            self.v = v.new_empty(B, nh, self.max_len, hs)
+        self.k[:, :, self.length:self.length + T] = k
+        self.v[:, :, self.length:self.length + T] = v
+        self.length += T
+        return self.k[:, :, :self.length], self.v[:, :, :self.length]
+
 class CausalSelfAttention(nn.Module):
 
     def __init__(self, config):
@@ -49,7 +70,7 @@ class CausalSelfAttention(nn.Module):
             self.register_buffer("bias", torch.tril(torch.ones(config.block_size, config.block_size))
                                         .view(1, 1, config.block_size, config.block_size))
 
-    def forward(self, x):
+    def forward(self, x, kv_cache=None, attn_mask=None):
         B, T, C = x.size() # batch size, sequence length, embedding dimensionality (n_embd)
 
         # calculate query, key, values for all heads in batch and move head forward to be the batch dim
@@ -58,8 +79,28 @@ class CausalSelfAttention(nn.Module):
         q = q.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
         v = v.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
 
+        if kv_cache is not None:
+            # incremental decoding: attend over all cached positions plus the new ones.
+            # With an explicit attn_mask the cache length is not needed (and e.g. the per-slot
+            # decode view of scheduler.py has no single length)
+            past = kv_cache.length if attn_mask is None else None
+            k, v = kv_cache.append(k, v) # (B, nh, past + T, hs)
+            if attn_mask is None and T > 1:
+                # query i (absolute position past + i) sees keys 0..past + i;
+                # a single new query may attend to every cached key, no mask needed
+                attn_mask = torch.ones(T, past + T, dtype=torch.bool, device=x.device).tril(diagonal=past)
+        if kv_cache is not None or attn_mask is not None:
+            # explicit boolean mask (True = may attend), e.g. causal + left padding from generate_batch
+            if self.flash:
+                y = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, dropout_p=0)
+            else:
+                att = (q @ k.transpose(-2, -1)) * (1.0 / math.sqrt(k.size(-1)))
+                if attn_mask is not None:
+                    att = att.masked_fill(~attn_mask, float('-inf'))
+                att = F.softmax(att, dim=-1)
+                y = att @ v
         # causal self-attention; Self-attend: (B, nh, T, hs) x (B, nh, hs, T) -> (B, nh, T, T)
-        if self.flash:
+        elif self.flash:
             # efficient attention using Flash Attention CUDA kernels
             y = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=None, dropout_p=self.dropout if self.training else 0, is_causal=True)
         else:
@@ -100,8 +141,8 @@ class Block(nn.Module):
         self.ln_2 = LayerNorm(config.n_embd, bias=config.bias)
         self.mlp = MLP(config)
 
-    def forward(self, x):
-        x = x + self.attn(self.ln_1(x))
+    def forward(self, x, kv_cache=None, attn_mask=None):
+        x = x + self.attn(self.ln_1(x), kv_cache=kv_cache, attn_mask=attn_mask)
         x = x + self.mlp(self.ln_2(x))
         return x
 
@@ -114,6 +155,7 @@ class GPTConfig:
     n_embd: int = 768
     dropout: float = 0.0
     bias: bool = True # True: bias in Linears and LayerNorms, like GPT-2. False: a bit better and faster
+    loss_chunk_size: int = 0 # >0: compute lm_head + cross-entropy in chunks of this many tokens, recomputed in backward
 
 class GPT(nn.Module):
 
@@ -167,21 +209,30 @@ class GPT(nn.Module):
         elif isinstance(module, nn.Embedding):
             torch.nn.init.normal_(module.weight, mean=0.0, std=0.02)
 
-    def forward(self, idx, targets=None):
+    def forward(self, idx, targets=None, kv_caches=None, pos=None, attn_mask=None):
         device = idx.device
         b, t = idx.size()
-        assert t <= self.config.block_size, f"Cannot forward sequence of length {t}, block size is only {self.config.block_size}"
-        pos = torch.arange(0, t, dtype=torch.long, device=device) # shape (t)
+        if pos is None:
+            # with a KV cache idx holds only the new tokens, their positions continue after the cached ones
+            start_pos = kv_caches[0].length if kv_caches is not None else 0
+            assert start_pos + t <= self.config.block_size, f"Cannot forward sequence of length {start_pos + t}, block size is only {self.config.block_size}"
+            pos = torch.arange(start_pos, start_pos + t, dtype=torch.long, device=device) # shape (t)
+        # else: per-row positions of shape (b, t) with a boolean attn_mask (b, 1, t, keys),
+        # see iter_generate_batch and scheduler.py
 
         # forward the GPT model itself
         tok_emb = self.transformer.wte(idx) # token embeddings of shape (b, t, n_embd)
         pos_emb = self.transformer.wpe(pos) # position embeddings of shape (t, n_embd)
         x = self.transformer.drop(tok_emb + pos_emb)
-        for block in self.transformer.h:
-            x = block(x)
+        for i, block in enumerate(self.transformer.h):
+            x = block(x, kv_cache=kv_caches[i] if kv_caches is not None else None, attn_mask=attn_mask)
         x = self.transformer.ln_f(x)
 
-        if targets is not None:
+        if targets is not None and self.config.loss_chunk_size > 0:
+            # memory-bounded loss: the full (b, t, vocab_size) logits are never materialized
+            logits = None
+            loss = self.chunked_cross_entropy(x, targets)
+        elif targets is not None:
             # if we are given some desired targets also calculate the loss
             logits = self.lm_head(x)
             loss = F.cross_entropy(logits.view(-1, logits.size(-1)), targets.view(-1), ignore_index=-1)
@@ -192,6 +243,33 @@ class GPT(nn.Module):
 
         return logits, loss
 
+    def chunked_cross_entropy(self, x, targets):
+        """
+        Same value as F.cross_entropy(self.lm_head(x), targets, ignore_index=-1), but the lm_head
+        projection and the loss are computed loss_chunk_size tokens at a time. Each chunk is
+        checkpointed, so its logits are freed after the forward and recomputed during backward:
+        peak memory is one chunk of (loss_chunk_size, vocab_size) logits instead of (b*t, vocab_size).
+        """
+        x = x.reshape(-1, x.size(-1))
+        targets = targets.reshape(-1)
+        weight = self.lm_head.weight
+
+        def chunk_loss(x_chunk, targets_chunk):
+            logits = F.linear(x_chunk, weight)
+            return F.cross_entropy(logits.float(), targets_chunk, ignore_index=-1, reduction='sum')
+
+        loss_sum = None
+        for start in range(0, x.size(0), self.config.loss_chunk_size):
+            x_chunk = x[start:start + self.config.loss_chunk_size]
+            targets_chunk = targets[start:start + self.config.loss_chunk_size]
+            if torch.is_grad_enabled():
+                chunk = checkpoint(chunk_loss, x_chunk, targets_chunk, use_reentrant=False)
+            else:
+                chunk = chunk_loss(x_chunk, targets_chunk)
+            loss_sum = chunk if loss_sum is None else loss_sum + chunk
+        # mean over non-ignored targets, like reduction='mean'
+        return loss_sum / (targets != -1).sum().clamp(min=1)
+
     def crop_block_size(self, block_size):
         # model surgery to decrease the block size if necessary
         # e.g. we may load the GPT2 pretrained model checkpoint (block size 1024)
@@ -302,18 +380,39 @@ class GPT(nn.Module):
         mfu = flops_achieved / flops_promised
         return mfu
 
+    def new_kv_caches(self):
+        return [KVCache(self.config.block_size) for _ in range(self.config.n_layer)]
+
     @torch.no_grad()
-    def generate(self, idx, max_new_tokens, temperature=1.0, top_k=None):
+    def generate(self, idx, max_new_tokens, temperature=1.0, top_k=None, use_kv_cache=True, window_shift=1):
         """
         Take a conditioning sequence of indices idx (LongTensor of shape (b,t)) and complete
         the sequence max_new_tokens times, feeding the predictions back into the model each time.
         Most likely you'll want to make sure to be in model.eval() mode of operation for this.
+
+        With use_kv_cache=True keys/values of past positions are cached per layer and each step
+        forwards only the newly sampled token. Position embeddings are absolute, so once the
+        sequence outgrows block_size the cropped window gets new positions and the cache is
+        re-filled from the last block_size - window_shift + 1 tokens. window_shift=1 reproduces
+        the uncached sliding window exactly (but re-fills on every step past block_size);
+        a larger shift re-fills only every window_shift steps at the cost of a shorter context.
         """
+        assert 1 <= window_shift <= self.config.block_size
+        kv_caches = None
         for _ in range(max_new_tokens):
-            # if the sequence context is growing too long we must crop it at block_size
-            idx_cond = idx if idx.size(1) <= self.config.block_size else idx[:, -self.config.block_size:]
-            # forward the model to get the logits for the index in the sequence
-            logits, _ = self(idx_cond)
+            if not use_kv_cache:
+                # if the sequence context is growing too long we must crop it at block_size
+                idx_cond = idx if idx.size(1) <= self.config.block_size else idx[:, -self.config.block_size:]
+                # forward the model to get the logits for the index in the sequence
+                logits, _ = self(idx_cond)
+            elif kv_caches is None or kv_caches[0].length >= self.config.block_size:
+                # (re-)fill the cache with the prompt or with the cropped window
+                keep = self.config.block_size if kv_caches is None else self.config.block_size - window_shift + 1
+                kv_caches = self.new_kv_caches()
+                logits, _ = self(idx[:, -keep:], kv_caches=kv_caches)
+            else:
+                # forward only the last sampled token
+                logits, _ = self(idx[:, -1:], kv_caches=kv_caches)
             # pluck the logits at the final step and scale by desired temperature
             logits = logits[:, -1, :] / temperature
             # optionally crop the logits to only the top k options
@@ -328,3 +427,91 @@ class GPT(nn.Module):
             idx = torch.cat((idx, idx_next), dim=1)
 
         return idx
+
+    @torch.no_grad()
+    def iter_generate_batch(self, prompts, max_new_tokens, temperature=1.0, top_k=None, eos_token_id=None,
+                            use_kv_cache=True, window_shift=1):
+        """
+        Generate continuations for several prompts (lists of token ids, any lengths) in one batch,
+        yielding after every step a list with the new token of each row and a list of finished flags.
+        Prompts are left-padded; each row gets its own positions (starting at 0 on its first real
+        token) and never attends to padding, so every row behaves like its own generate() call.
+        max_new_tokens is an int or a per-row list. A row is finished once it samples eos_token_id
+        or reaches its max_new_tokens (finished rows keep producing filler tokens);
+        generation stops when all rows are finished.
+        """
+        device = self.transformer.ln_f.weight.device # not lm_head: int8 lm_head (quantize.py) has no .weight tensor
+        block_size = self.config.block_size
+        assert 1 <= window_shift <= block_size
+        B = len(prompts)
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * B
+        limits = torch.tensor(max_new_tokens, dtype=torch.long, device=device)
+        prompt_lens = [len(p) for p in prompts]
+        assert min(prompt_lens) > 0, "every prompt needs at least one token"
+        L = max(prompt_lens)
+        idx = torch.zeros((B, L), dtype=torch.long, device=device)
+        for i, p in enumerate(prompts):
+            idx[i, L - len(p):] = torch.tensor(p, dtype=torch.long, device=device)
+        pad_lens = torch.tensor([L - n for n in prompt_lens], dtype=torch.long, device=device)
+        finished = limits <= 0
+
+        kv_caches = None
+        step = 0
+        while not finished.all():
+            total = idx.size(1)
+            if not use_kv_cache or kv_caches is None or kv_caches[0].length >= block_size:
+                # forward a whole window: the prompt, or the cropped sequence like in generate()
+                keep = block_size if kv_caches is None else block_size - window_shift + 1
+                start = max(0, total - keep)
+                cols = torch.arange(start, total, device=device)
+                row_start = pad_lens.clamp(min=start) # first real column of each row inside the window
+                valid = cols[None, :] >= row_start[:, None] # (B, T), False = padding
+                pos = (cols[None, :] - row_start[:, None]).clamp(min=0)
+                T = cols.size(0)
+                causal = torch.ones(T, T, dtype=torch.bool, device=device).tril()
+                # padding queries attend to themselves only, so no row of the mask is empty (NaN)
+                eye = torch.eye(T, dtype=torch.bool, device=device)
+                attn_mask = (causal & (valid[:, None, :] | eye))[:, None] # (B, 1, T, T)
+                kv_caches = self.new_kv_caches() if use_kv_cache else None
+                logits, _ = self(idx[:, start:], kv_caches=kv_caches, pos=pos, attn_mask=attn_mask)
+            else:
+                # forward only the last sampled token, it is a real token in every row
+                valid = torch.cat((valid, torch.ones((B, 1), dtype=torch.bool, device=device)), dim=1)
+                pos = (total - 1 - row_start)[:, None]
+                logits, _ = self(idx[:, -1:], kv_caches=kv_caches, pos=pos, attn_mask=valid[:, None, None, :])
+            # same sampling as in generate()
+            logits = logits[:, -1, :] / temperature
+            if top_k is not None:
+                v, _ = torch.topk(logits, min(top_k, logits.size(-1)))
+                logits[logits < v[:, [-1]]] = -float('Inf')
+            probs = F.softmax(logits, dim=-1)
+            idx_next = torch.multinomial(probs, num_samples=1)
+            if eos_token_id is not None:
+                # finished rows keep emitting eos
+                idx_next = idx_next.masked_fill(finished[:, None], eos_token_id)
+                finished = finished | (idx_next[:, 0] == eos_token_id)
+            step += 1
+            finished = finished | (limits <= step)
+            idx = torch.cat((idx, idx_next), dim=1)
+            yield idx_next[:, 0].tolist(), finished.tolist()
+
+    @torch.no_grad()
+    def generate_batch(self, prompts, max_new_tokens, temperature=1.0, top_k=None, eos_token_id=None,
+                       use_kv_cache=True, window_shift=1):
+        """
+        Batched generation, see iter_generate_batch. Returns a list of token lists:
+        prompt + generated tokens, cut after the first generated eos or at max_new_tokens.
+        """
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * len(prompts)
+        results = [list(p) for p in prompts]
+        done = [n <= 0 for n in max_new_tokens]
+        for next_tokens, finished in self.iter_generate_batch(prompts, max_new_tokens, temperature=temperature, top_k=top_k,
+                                                               eos_token_id=eos_token_id, use_kv_cache=use_kv_cache,
+                                                               window_shift=window_shift):
+            for i, token in enumerate(next_tokens):
+                if not done[i]:
+                    results[i].append(token)
+                    done[i] = finished[i]
+        return results
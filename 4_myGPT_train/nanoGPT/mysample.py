@@ -4,6 +4,7 @@
 Sample from a trained model using our custom dataset and tokenizer
 """
 import os
+import time
 import json # Импортируем json для работы с meta.json
 from contextlib import nullcontext
 import torch
@@ -34,21 +35,32 @@ start = "Пушкин, Александр Сергеевич\n\nБиографи
 
 #start = "Гринпульки - это неизвестные науке инопланетные технологии"
 
-num_samples = 5 # Количество примеров для генерации
+# Дополнительные затравки (в том же формате, что и start): все затравки и все их примеры генерируются одним батчем
+extra_starts = []
+
+num_samples = 5 # Количество примеров для генерации (на каждую затравку)
 max_new_tokens = 500 # Максимальное количество новых токенов в каждом примере
 temperature = 0.8 # Температура генерации (0.0 - детерминированно, 1.0 - более случайное)
 top_k = 200 # Учитывать только top_k наиболее вероятных токенов
+use_kv_cache = True # Кэшировать ключи/значения внимания: каждый шаг генерации обрабатывает только новый токен
+batched = True # Генерировать все примеры одним батчем (с остановкой, когда все примеры дошли до <eos>); False - по одному
 
 seed = 1337 # Случайное зерно для воспроизводимости
 device = 'cuda' # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
 dtype = 'bfloat16' if torch.cuda.is_available() and torch.cuda.is_bf16_supported() else 'float16' # 'float32' or 'bfloat16' or 'float16'
 compile = False # use PyTorch 2.0 to compile the model to be faster
+quantize = False # int8 на CPU: загрузить out_dir/ckpt_int8.pt (см. quantize.py), а если его нет - квантовать ckpt.pt при загрузке
 
 # Загружаем конфигурацию, она может переопределить параметры выше (например, из config/train_custom_corpus_small.py)
 # Важно, чтобы out_dir здесь загрузился правильно из вашего файла конфига тренировки
 exec(open('configurator.py').read())
 # -----------------------------------------------------------------------------
 
+if quantize:
+    # int8-ядра квантованных слоев есть только для CPU
+    device = 'cpu'
+    dtype = 'float32'
+
 torch.manual_seed(seed)
 torch.cuda.manual_seed(seed)
 torch.backends.cuda.matmul.allow_tf32 = True # allow tf32 on matmul
@@ -62,20 +74,30 @@ print(f"Загрузка модели из директории {out_dir}...")
 if init_from == 'resume':
     # init from a model saved in a specific directory
     ckpt_path = os.path.join(out_dir, 'ckpt.pt')
-    if not os.path.exists(ckpt_path):
+    ckpt_int8_path = os.path.join(out_dir, 'ckpt_int8.pt')
+    if not os.path.exists(ckpt_path) and not (quantize and os.path.exists(ckpt_int8_path)):
         print(f"Ошибка: Чекпойнт модели не найден по пути: {ckpt_path}")
         print("Убедитесь, что директория out_dir в вашем конфиге sample.py (или в командной строке)")
         print("совпадает с директорией, куда сохранялись результаты тренировки.")
         exit(1)
-    checkpoint = torch.load(ckpt_path, map_location=device)
-    gptconf = GPTConfig(**checkpoint['model_args']) # Загружаем параметры модели из чекпойнта
-    model = GPT(gptconf)
-    state_dict = checkpoint['model']
-    unwanted_prefix = '_orig_mod.'
-    for k,v in list(state_dict.items()):
-        if k.startswith(unwanted_prefix):
-            state_dict[k[len(unwanted_prefix):]] = state_dict.pop(k)
-    model.load_state_dict(state_dict)
+    if quantize and os.path.exists(ckpt_int8_path):
+        from quantize import load_quantized
+        print(f"Загрузка int8 модели из {ckpt_int8_path}...")
+        model, checkpoint = load_quantized(ckpt_int8_path)
+    else:
+        checkpoint = torch.load(ckpt_path, map_location=device)
+        gptconf = GPTConfig(**checkpoint['model_args']) # Загружаем параметры модели из чекпойнта
+        model = GPT(gptconf)
+        state_dict = checkpoint['model']
+        unwanted_prefix = '_orig_mod.'
+        for k,v in list(state_dict.items()):
+            if k.startswith(unwanted_prefix):
+                state_dict[k[len(unwanted_prefix):]] = state_dict.pop(k)
+        model.load_state_dict(state_dict)
+        if quantize:
+            from quantize import quantize_model
+            print("ckpt_int8.pt не найден, квантование в int8 при загрузке (сохранить: python quantize.py)")
+            model = quantize_model(model, inplace=True)
 elif init_from.startswith('gpt2'):
     # init from a given GPT-2 model (не наш случай)
     print(f"Инициализация из GPT-2 весов: {init_from} (не стандартный режим для нашего корпуса)")
@@ -107,6 +129,7 @@ decode = None
 bos_token_id = None
 eos_token_id = None
 tokenizer_model_name = None
+token_id_map = None # Таблица компактного словаря (COMPACT_VOCAB в 2_prepare.py): индекс - ID модели, значение - ID токенизатора
 
 
 if os.path.exists(meta_filepath):
@@ -129,6 +152,14 @@ if os.path.exists(meta_filepath):
         print(f"Размер словаря из метаданных: {vocab_size}")
         print(f"<bos> ID: {bos_token_id}, <eos> ID: {eos_token_id}")
 
+        if 'token_id_map' in meta:
+            token_id_map = meta['token_id_map']
+            tokenizer_to_model_id = {tokenizer_id: model_id for model_id, tokenizer_id in enumerate(token_id_map)}
+            # Дальше bos/eos используются как ID модели
+            bos_token_id = tokenizer_to_model_id[bos_token_id]
+            eos_token_id = tokenizer_to_model_id[eos_token_id]
+            print(f"Компактный словарь: {len(token_id_map)} токенов (ID модели <bos>: {bos_token_id}, <eos>: {eos_token_id})")
+
         # Загружаем токенизатор Hugging Face
         try:
             tokenizer = AutoTokenizer.from_pretrained(tokenizer_model_name)
@@ -147,8 +178,18 @@ if os.path.exists(meta_filepath):
 
             # Определяем функции encode и decode с использованием загруженного токенизатора
             # add_special_tokens=False чтобы не добавлять токены BOS/EOS по умолчанию при кодировании затравки
-            encode = lambda s: tokenizer.encode(s, add_special_tokens=False)
-            decode = lambda l: tokenizer.decode(l, skip_special_tokens=True) # skip_special_tokens=True чтобы <eos> не декодировался в конце
+            if token_id_map is None:
+                encode = lambda s: tokenizer.encode(s, add_special_tokens=False)
+                decode = lambda l: tokenizer.decode(l, skip_special_tokens=True) # skip_special_tokens=True чтобы <eos> не декодировался в конце
+            else:
+                def encode(s):
+                    tokenizer_ids = tokenizer.encode(s, add_special_tokens=False)
+                    model_ids = [tokenizer_to_model_id[i] for i in tokenizer_ids if i in tokenizer_to_model_id]
+                    if len(model_ids) != len(tokenizer_ids):
+                        # Токенов, не встретившихся в корпусе, нет в словаре модели - пропускаем их
+                        print(f"Предупреждение: {len(tokenizer_ids) - len(model_ids)} токен(ов) затравки отсутствуют в компактном словаре и пропущены.")
+                    return model_ids
+                decode = lambda l: tokenizer.decode([token_id_map[i] for i in l], skip_special_tokens=True)
 
         except Exception as e:
             print(f"Ошибка при загрузке токенизатора Hugging Face '{tokenizer_model_name}': {e}")
@@ -171,72 +212,91 @@ else:
     exit(1)
 
 
-# --- Кодирование начальной затравки ---
-if start.startswith('FILE:'):
-    try:
-        with open(start[5:], 'r', encoding='utf-8') as f:
-            start = f.read()
-    except FileNotFoundError:
-        print(f"Ошибка: Файл затравки не найден: {start[5:]}")
-        exit(1)
-    except Exception as e:
-        print(f"Ошибка при чтении файла затравки: {e}")
-        exit(1)
+# --- Кодирование затравок ---
+def encode_start(start):
+    """Кодирует затравку (строку, "FILE:путь" или "" для новой статьи) в список ID токенов."""
+    if start.startswith('FILE:'):
+        try:
+            with open(start[5:], 'r', encoding='utf-8') as f:
+                start = f.read()
+        except FileNotFoundError:
+            print(f"Ошибка: Файл затравки не найден: {start[5:]}")
+            exit(1)
+        except Exception as e:
+            print(f"Ошибка при чтении файла затравки: {e}")
+            exit(1)
 
+    # Если start - пустая строка, начинаем с токена <bos>
+    if start == "":
+        if bos_token_id is None:
+            print("Ошибка: Невозможно начать с пустой строки, так как ID токена <bos> неизвестен.")
+            exit(1)
+        print("Начата генерация новой статьи (с токена <bos>).")
+        return [bos_token_id]
 
-# Если start - пустая строка, начинаем с токена <bos>
-if start == "":
-    if bos_token_id is None:
-        print("Ошибка: Невозможно начать с пустой строки, так как ID токена <bos> неизвестен.")
-        exit(1)
-    start_ids = [bos_token_id]
-    print("Начата генерация новой статьи (с токена <bos>).")
-else:
     # Иначе кодируем предоставленную строку затравки
     start_ids = encode(start)
     if not start_ids:
         print("Предупреждение: Предоставленная затравка пуста или не дала ни одного токена после кодирования.")
         # Если затравка пуста после кодирования, все равно начнем с <bos>
         if bos_token_id is not None:
-            start_ids = [bos_token_id]
             print("Начата генерация новой статьи (с токена <bos>).")
-        else:
-            print("Ошибка: Пустая затравка после кодирования и ID токена <bos> неизвестен.")
-            exit(1)
+            return [bos_token_id]
+        print("Ошибка: Пустая затравка после кодирования и ID токена <bos> неизвестен.")
+        exit(1)
+    print(f"Начата генерация с предоставленной затравки ({len(start_ids)} токенов).")
+    return start_ids
+
+
+# Каждая затравка повторяется num_samples раз
+prompts = []
+for prompt_text in [start] + list(extra_starts):
+    prompts.extend([encode_start(prompt_text)] * num_samples)
+
+
+def print_sample(generated_tokens, prompt_len):
+    # Сообщаем, остановилась ли генерация по токену <eos>
+    if eos_token_id is not None and generated_tokens[-1] == eos_token_id and len(generated_tokens) > prompt_len:
+        print(f"Генерация остановлена по токену <eos> (после {len(generated_tokens)} токенов).")
     else:
-        print(f"Начата генерация с предоставленной затравки ({len(start_ids)} токенов).")
+        print(f"Сгенерировано максимальное количество токенов ({max_new_tokens}). Токен <eos> не найден.")
 
+    # Декодируем обрезанную последовательность токенов в текст
+    generated_text = decode(generated_tokens)
 
-# Преобразуем список ID затравки в тензор для модели
-x = (torch.tensor(start_ids, dtype=torch.long, device=device)[None, ...])
+    print("\n--- СГЕНЕРИРОВАННЫЙ ТЕКСТ ---")
+    print(generated_text)
+    print('-----------------------------')
 
 
 # --- Запуск генерации ---
 print("\nЗапуск генерации...")
+generation_start_time = time.time()
+generated_token_count = 0
 with torch.no_grad():
     with ctx:
-        for k in range(num_samples):
-            # Генерация токенов моделью
-            # model.generate - это метод, который мы ожидаем от модели GPT в model.py
-            y = model.generate(x, max_new_tokens, temperature=temperature, top_k=top_k)
-
-            # Декодирование сгенерированных ID токенов в текст
-            generated_tokens = y[0].tolist() # Получаем список ID токенов из тензора
+        if batched:
+            # Все примеры одним батчем: затравки выравниваются паддингом слева,
+            # генерация останавливается, когда каждый пример выдал <eos>
+            rows = model.generate_batch(prompts, max_new_tokens, temperature=temperature, top_k=top_k,
+                                        eos_token_id=eos_token_id, use_kv_cache=use_kv_cache)
+            for prompt_ids, generated_tokens in zip(prompts, rows):
+                generated_token_count += len(generated_tokens) - len(prompt_ids)
+                print_sample(generated_tokens, len(prompt_ids))
+        else:
+            for prompt_ids in prompts:
+                # Преобразуем список ID затравки в тензор для модели
+                x = (torch.tensor(prompt_ids, dtype=torch.long, device=device)[None, ...])
+                y = model.generate(x, max_new_tokens, temperature=temperature, top_k=top_k, use_kv_cache=use_kv_cache)
+                generated_tokens = y[0].tolist() # Получаем список ID токенов из тензора
 
-            # Находим позицию токена <eos> в сгенерированной последовательности
-            if eos_token_id is not None and eos_token_id in generated_tokens:
-                eos_index = generated_tokens.index(eos_token_id)
                 # Обрезаем последовательность до токена <eos> (включая его)
-                generated_tokens = generated_tokens[:eos_index + 1]
-                print(f"Генерация остановлена по токену <eos> (после {eos_index + 1} токенов).")
-            else:
-                print(f"Сгенерировано максимальное количество токенов ({max_new_tokens}). Токен <eos> не найден.")
-
-            # Декодируем обрезанную последовательность токенов в текст
-            generated_text = decode(generated_tokens)
-
-            print("\n--- СГЕНЕРИРОВАННЫЙ ТЕКСТ ---")
-            print(generated_text)
-            print('-----------------------------')
-
-print("\nСэмплирование завершено.")
\ No newline at end of file
+                if eos_token_id is not None and eos_token_id in generated_tokens[len(prompt_ids):]:
+                    generated_tokens = generated_tokens[:generated_tokens.index(eos_token_id, len(prompt_ids)) + 1]
+                generated_token_count += len(generated_tokens) - len(prompt_ids)
+                print_sample(generated_tokens, len(prompt_ids))
+
+generation_time = time.time() - generation_start_time
+print(f"\nСгенерировано {generated_token_count} токенов в {len(prompts)} примерах за {generation_time:.1f} сек "
+      f"({generated_token_count / max(generation_time, 1e-9):.1f} токенов/сек).")
+print("\nСэмплирование завершено.")
@@ -0,0 +1,148 @@
+"""
+Int8-квантование GPT для инференса на CPU (машины без GPU).
+- Все nn.Linear (attention, MLP и lm_head vocab_size x n_embd) - динамическое квантование:
+  веса хранятся в int8 с масштабом на выходной канал, активации квантуются на лету в каждом matmul.
+- Эмбеддинг токенов wte - только веса в int8 с масштабом на строку.
+  Связь весов wte/lm_head (weight tying) после квантования разрывается: у каждого своя int8-копия.
+Скрипт квантует out_dir/ckpt.pt, сохраняет out_dir/ckpt_int8.pt и сравнивает fp32 и int8:
+размер весов, скорость генерации (токенов/сек) и перплексию на val.bin.
+$ python quantize.py --out_dir=out-custom-long
+$ python quantize.py --out_dir=out-custom-long --eval_iters=50 --num_threads=8
+mysample.py --quantize=True использует ckpt_int8.pt (или квантует ckpt.pt при загрузке).
+"""
+import io
+import json
+import math
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+from model import GPTConfig, GPT
+
+
+def load_fp32(ckpt_path):
+    """GPT из чекпойнта train.py на CPU. Возвращает (model, checkpoint)."""
+    checkpoint = torch.load(ckpt_path, map_location='cpu')
+    model = GPT(GPTConfig(**checkpoint['model_args']))
+    state_dict = checkpoint['model']
+    unwanted_prefix = '_orig_mod.'
+    for k, v in list(state_dict.items()):
+        if k.startswith(unwanted_prefix):
+            state_dict[k[len(unwanted_prefix):]] = state_dict.pop(k)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model, checkpoint
+
+
+def quantize_model(model, inplace=False):
+    """Int8-версия модели (только CPU): динамическое квантование Linear, int8 веса эмбеддинга токенов."""
+    model = model.cpu().eval()
+    qconfig_spec = {
+        nn.Linear: torch.ao.quantization.default_dynamic_qconfig,
+        'transformer.wte': torch.ao.quantization.float_qparams_weight_only_qconfig,
+    }
+    qmodel = torch.ao.quantization.quantize_dynamic(model, qconfig_spec, inplace=inplace)
+    # chunked_cross_entropy берет lm_head.weight напрямую, у квантованного Linear его нет
+    qmodel.config.loss_chunk_size = 0
+    return qmodel
+
+
+def load_quantized(ckpt_path):
+    """Int8-модель из ckpt_int8.pt (сохраненного этим скриптом). Возвращает (model, checkpoint)."""
+    # Свой файл: упакованные int8 веса не загружаются в режиме weights_only
+    checkpoint = torch.load(ckpt_path, map_location='cpu', weights_only=False)
+    model = quantize_model(GPT(GPTConfig(**checkpoint['model_args'])), inplace=True)
+    model.load_state_dict(checkpoint['model'])
+    model.eval()
+    return model, checkpoint
+
+
+def state_dict_bytes(model):
+    """Размер сериализованных весов (общие тензоры учитываются один раз)."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+if __name__ == '__main__':
+    # -----------------------------------------------------------------------------
+    out_dir = 'out-custom-long'
+    eval_iters = 20 # Сколько окон block_size из val.bin использовать для перплексии
+    eval_batch_size = 1 # Логиты окна на CPU: eval_batch_size * block_size * vocab_size * 4 байт
+    gen_prompt_len = 32 # Длина затравки (из val.bin) для замера скорости генерации
+    gen_new_tokens = 100
+    num_threads = 0 # >0: torch.set_num_threads
+    save = True # Сохранять out_dir/ckpt_int8.pt
+    seed = 1337
+    exec(open('configurator.py').read()) # overrides from command line or config file
+    # -----------------------------------------------------------------------------
+    import numpy as np
+
+    torch.manual_seed(seed)
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    ckpt_path = os.path.join(out_dir, 'ckpt.pt')
+    print(f"Загрузка fp32 модели из {ckpt_path}...")
+    model, checkpoint = load_fp32(ckpt_path)
+    t0 = time.time()
+    qmodel = quantize_model(model)
+    print(f"Квантование заняло {time.time() - t0:.1f} сек")
+
+    if save:
+        ckpt_int8_path = os.path.join(out_dir, 'ckpt_int8.pt')
+        torch.save({
+            'model': qmodel.state_dict(),
+            'model_args': checkpoint['model_args'],
+            'iter_num': checkpoint.get('iter_num'),
+            'config': checkpoint.get('config'),
+            'quantization': 'int8-dynamic-linear+int8-embedding',
+        }, ckpt_int8_path)
+        print(f"Сохранено: {ckpt_int8_path}")
+
+    # val.bin того же датасета (ID модели, с учетом компактного словаря), dtype - из meta.json
+    data_dir = os.path.join('data', checkpoint['config']['dataset'])
+    bin_dtype = np.uint32
+    meta_path = os.path.join(out_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            bin_dtype = np.dtype(json.load(f).get('bin_dtype', 'uint32')).type
+    data = np.memmap(os.path.join(data_dir, 'val.bin'), dtype=bin_dtype, mode='r')
+    block_size = model.config.block_size
+    rng = np.random.default_rng(seed)
+    # одинаковые окна для обеих моделей
+    starts = rng.integers(0, len(data) - block_size - 1, size=(eval_iters, eval_batch_size))
+    prompt_start = int(rng.integers(0, len(data) - gen_prompt_len))
+    prompt = torch.from_numpy(data[prompt_start:prompt_start + gen_prompt_len].astype(np.int64))[None, :]
+
+    def evaluate(m):
+        """(перплексия на val, токенов/сек генерации, сгенерированные токены)"""
+        losses = []
+        with torch.no_grad():
+            for batch_starts in starts:
+                x = torch.stack([torch.from_numpy(data[i:i + block_size].astype(np.int64)) for i in batch_starts])
+                y = torch.stack([torch.from_numpy(data[i + 1:i + 1 + block_size].astype(np.int64)) for i in batch_starts])
+                _, loss = m(x, y)
+                losses.append(loss.item())
+            m.generate(prompt, 4, top_k=1) # прогрев
+            t0 = time.time()
+            generated = m.generate(prompt, gen_new_tokens, top_k=1)
+            tokens_per_sec = gen_new_tokens / (time.time() - t0)
+        return math.exp(sum(losses) / len(losses)), tokens_per_sec, generated[0, gen_prompt_len:]
+
+    print(f"Оценка: {eval_iters * eval_batch_size} окон по {block_size} токенов из {data_dir}/val.bin, "
+          f"генерация {gen_new_tokens} токенов, потоков {torch.get_num_threads()}")
+    fp32_size, int8_size = state_dict_bytes(model), state_dict_bytes(qmodel)
+    fp32_ppl, fp32_tps, fp32_tokens = evaluate(model)
+    int8_ppl, int8_tps, int8_tokens = evaluate(qmodel)
+
+    print("=" * 50)
+    print(f"{'':<6} {'weights, MB':>12} {'tokens/s':>9} {'val ppl':>9}")
+    print(f"{'fp32':<6} {fp32_size / 2**20:>12.1f} {fp32_tps:>9.1f} {fp32_ppl:>9.3f}")
+    print(f"{'int8':<6} {int8_size / 2**20:>12.1f} {int8_tps:>9.1f} {int8_ppl:>9.3f}")
+    print(f"Память весов: x{fp32_size / int8_size:.2f} меньше, скорость генерации: x{int8_tps / fp32_tps:.2f}, "
+          f"перплексия: {int8_ppl - fp32_ppl:+.3f} ({(int8_ppl / fp32_ppl - 1) * 100:+.2f}%)")
+    print(f"Совпадение жадных токенов с fp32: {(fp32_tokens == int8_tokens).float().mean().item():.1%}")
+    print("=" * 50)
@@ -0,0 +1,218 @@
+"""
+Continuous batching for GPT inference: sequences join and leave the running batch at every decode
+step instead of waiting for the longest sequence of a static batch (generate_batch).
+
+Keys/values live in a preallocated pool of num_slots slots per layer (KVSlotPool).
+Every scheduler step
+1) admits waiting sequences into free slots (prefill of the prompt, samples the first token),
+2) runs one decode step for all running sequences together (one new token per slot),
+3) evicts finished sequences (eos, max_new_tokens or cancelled) and frees their slots.
+
+See loadtest_scheduler.py for a Poisson-arrival comparison with static batching and
+serve.py --scheduler=continuous for the HTTP server.
+"""
+import collections
+import time
+
+import torch
+from torch.nn import functional as F
+
+
+class KVSlotPool:
+    """ per-layer key/value pool: (num_slots, nh, max_len, hs), allocated on first write with the dtype of the keys """
+
+    def __init__(self, num_slots, max_len):
+        self.num_slots = num_slots
+        self.max_len = max_len
+        self.k = None
+        self.v = None
+
+    def _ensure(self, k):
+        if self.k is None:
+            nh, hs = k.size(1), k.size(3)
+            self.k = k.new_empty(self.num_slots, nh, self.max_len, hs)
+            self.v = k.new_empty(self.num_slots, nh, self.max_len, hs)
+
+class _PrefillView:
+    """ KV cache interface for CausalSelfAttention: prefill of one sequence into one slot """
+    length = 0
+
+    def __init__(self, pool, slot):
+        self.pool = pool
+        self.slot = slot
+
+    def append(self, k, v):
+        # k, v: (1, nh, T, hs) for positions 0..T-1
+        self.pool._ensure(k)
+        T = k.size(2)
+        self.pool.k[self.slot, :, :T] = k[0]
+        self.pool.v[self.slot, :, :T] = v[0]
+        return k, v
+
+class _DecodeView:
+    """ KV cache interface for CausalSelfAttention: one new token for each of several slots """
+
+    def __init__(self, pool, slots, positions, kv_len):
+        self.pool = pool
+        self.slots = slots # (A,) slot of each row
+        self.positions = positions # (A,) position of the new token of each row
+        self.kv_len = kv_len # keys to attend over: max(positions) + 1, the rest is masked
+
+    def append(self, k, v):
+        # k, v: (A, nh, 1, hs)
+        self.pool.k[self.slots, :, self.positions] = k[:, :, 0]
+        self.pool.v[self.slots, :, self.positions] = v[:, :, 0]
+        return self.pool.k[self.slots, :, :self.kv_len], self.pool.v[self.slots, :, :self.kv_len]
+
+
+class Sequence:
+    """ one generation request inside the scheduler """
+
+    def __init__(self, prompt_ids, max_new_tokens, temperature=1.0, top_k=None, on_token=None, user_data=None):
+        assert len(prompt_ids) > 0, "prompt needs at least one token"
+        self.tokens = list(prompt_ids) # prompt + generated tokens
+        self.prompt_len = len(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.on_token = on_token # callback(sequence, token) after every generated token
+        self.user_data = user_data
+        self.slot = None
+        self.length = 0 # positions of this sequence currently in its KV slot
+        self.finished = False
+        self.finish_reason = None # 'stop' (eos), 'length' or 'cancelled'
+        self.cancelled = False # set from outside to stop generating for this sequence
+        self.submitted_time = time.time()
+        self.first_token_time = None
+        self.finished_time = None
+
+    @property
+    def generated(self):
+        return self.tokens[self.prompt_len:]
+
+
+class ContinuousBatchingScheduler:
+
+    def __init__(self, model, num_slots, eos_token_id=None, window_shift=1):
+        self.model = model
+        self.config = model.config
+        self.num_slots = num_slots
+        self.eos_token_id = eos_token_id
+        assert 1 <= window_shift <= self.config.block_size
+        self.window_shift = window_shift
+        self.device = model.transformer.ln_f.weight.device
+        self.pools = [KVSlotPool(num_slots, self.config.block_size) for _ in range(self.config.n_layer)]
+        self.free_slots = list(range(num_slots - 1, -1, -1))
+        self.waiting = collections.deque()
+        self.running = []
+        self.steps = 0
+
+    def submit(self, prompt_ids, max_new_tokens, temperature=1.0, top_k=None, on_token=None, user_data=None):
+        seq = Sequence(prompt_ids, max_new_tokens, temperature=temperature, top_k=top_k, on_token=on_token, user_data=user_data)
+        if max_new_tokens <= 0:
+            self._finish(seq, 'length')
+        else:
+            self.waiting.append(seq)
+        return seq
+
+    def has_work(self):
+        return bool(self.waiting or self.running)
+
+    def _sample(self, logits, seqs):
+        # same sampling as GPT.generate, but temperature and top_k per row
+        temperatures = torch.tensor([s.temperature for s in seqs], dtype=logits.dtype, device=logits.device)
+        logits = logits / temperatures[:, None]
+        top_ks = [min(s.top_k, logits.size(-1)) if s.top_k else None for s in seqs]
+        if any(top_ks):
+            v, _ = torch.topk(logits, max(k for k in top_ks if k))
+            kth = torch.tensor([(k or 1) - 1 for k in top_ks], device=logits.device)
+            threshold = v.gather(1, kth[:, None])
+            no_top_k = torch.tensor([k is None for k in top_ks], device=logits.device)
+            threshold = threshold.masked_fill(no_top_k[:, None], -float('Inf'))
+            logits = logits.masked_fill(logits < threshold, -float('Inf'))
+        probs = F.softmax(logits.float(), dim=-1)
+        return torch.multinomial(probs, num_samples=1)[:, 0].tolist()
+
+    def _finish(self, seq, reason):
+        seq.finished = True
+        seq.finish_reason = reason
+        seq.finished_time = time.time()
+
+    def _accept(self, seq, token):
+        seq.tokens.append(token)
+        if seq.first_token_time is None:
+            seq.first_token_time = time.time()
+        if seq.on_token is not None:
+            seq.on_token(seq, token)
+        if self.eos_token_id is not None and token == self.eos_token_id:
+            self._finish(seq, 'stop')
+        elif len(seq.tokens) - seq.prompt_len >= seq.max_new_tokens:
+            self._finish(seq, 'length')
+
+    def _prefill(self, seq, keep):
+        # forward the last keep tokens of the sequence into its slot (positions restart at 0 like in generate)
+        window = seq.tokens[-keep:]
+        idx = torch.tensor([window], dtype=torch.long, device=self.device)
+        views = [_PrefillView(pool, seq.slot) for pool in self.pools]
+        logits, _ = self.model(idx, kv_caches=views)
+        seq.length = len(window)
+        return logits[:, -1, :]
+
+    @torch.no_grad()
+    def step(self):
+        """One scheduler iteration. Returns the sequences finished during this step."""
+        block_size = self.config.block_size
+        self.steps += 1
+
+        # 1) admit waiting sequences into free slots
+        while self.waiting and self.free_slots:
+            seq = self.waiting.popleft()
+            if seq.cancelled:
+                self._finish(seq, 'cancelled')
+                continue
+            seq.slot = self.free_slots.pop()
+            logits = self._prefill(seq, block_size)
+            self._accept(seq, self._sample(logits, [seq])[0])
+            self.running.append(seq)
+
+        # 2) one decode step for every running sequence (sequences admitted above already got a token)
+        decode = [s for s in self.running if not s.finished and not s.cancelled and s.length < len(s.tokens)]
+        refill = [s for s in decode if s.length >= block_size]
+        decode = [s for s in decode if s.length < block_size]
+        for seq in refill:
+            # the window is full: re-fill the slot from the cropped sequence (exact for window_shift=1)
+            logits = self._prefill(seq, block_size - self.window_shift + 1)
+            self._accept(seq, self._sample(logits, [seq])[0])
+        if decode:
+            slots = torch.tensor([s.slot for s in decode], dtype=torch.long, device=self.device)
+            positions = torch.tensor([s.length for s in decode], dtype=torch.long, device=self.device)
+            kv_len = max(s.length for s in decode) + 1
+            idx = torch.tensor([[s.tokens[-1]] for s in decode], dtype=torch.long, device=self.device)
+            views = [_DecodeView(pool, slots, positions, kv_len) for pool in self.pools]
+            # each row sees only its own keys 0..position
+            attn_mask = (torch.arange(kv_len, device=self.device)[None, :] <= positions[:, None])[:, None, None, :]
+            logits, _ = self.model(idx, kv_caches=views, pos=positions[:, None], attn_mask=attn_mask)
+            for seq, token in zip(decode, self._sample(logits[:, -1, :], decode)):
+                seq.length += 1
+                self._accept(seq, token)
+
+        # 3) evict finished and cancelled sequences, free their slots
+        done = []
+        still_running = []
+        for seq in self.running:
+            if seq.cancelled and not seq.finished:
+                self._finish(seq, 'cancelled')
+            if seq.finished:
+                self.free_slots.append(seq.slot)
+                seq.slot = None
+                done.append(seq)
+            else:
+                still_running.append(seq)
+        self.running = still_running
+        return done
+
+    def run_until_idle(self):
+        finished = []
+        while self.has_work():
+            finished.extend(self.step())
+        return finished
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+
+"""
+OpenAI-совместимый HTTP-сервер для обученной модели (чекпойнт из out_dir), чтобы клиенты LM Studio
+из 1_myGPTdistr/2_myGPTWiki могли работать с нашей моделью: LMSTUDIO_API_URL=http://<host>:<port>/v1/chat/completions
+
+Модель и токенизатор загружаются один раз. Одновременные запросы собираются в батчи
+(динамическое батчирование: до max_batch_size запросов, ожидание до batch_wait_ms),
+батч генерируется одним вызовом GPT.iter_generate_batch. С --scheduler=continuous запросы
+обрабатывает ContinuousBatchingScheduler (scheduler.py) - без ожидания самого длинного запроса батча.
+
+Эндпоинты:
+  POST /v1/completions       - {"prompt": "...", "max_tokens", "temperature", "top_k", "stop", "stream"}
+  POST /v1/chat/completions  - {"messages": [...], ...}; модель не диалоговая, содержимое сообщений
+                               склеивается через два перевода строки (пустая строка между сообщениями)
+                               и продолжается как текст
+  GET  /v1/models            - список моделей (одна)
+  GET  /metrics              - счетчики и p50/p99 по запросам: ожидание в очереди, первый токен, всего (сек), токенов/сек
+
+$ python serve.py
+$ python serve.py config/train_custom_corpus_long.py --port=1234
+"""
+import collections
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from transformers import AutoTokenizer
+
+from model import GPTConfig, GPT
+from scheduler import ContinuousBatchingScheduler
+
+# -----------------------------------------------------------------------------
+out_dir = 'out-custom-long' # Директория с ckpt.pt и meta.json (train.py копирует туда meta.json)
+host = '0.0.0.0'
+port = 1234 # Порт LM Studio по умолчанию
+model_name = 'mygpt' # Имя модели в ответах и /v1/models
+# 'static' - батч собирается из пришедших запросов и генерируется до конца самого длинного;
+# 'continuous' - scheduler.py: новые запросы входят в свободные слоты батча на каждом шаге генерации
+scheduler = 'static'
+max_batch_size = 8 # Сколько запросов генерировать одним батчем (в режиме 'continuous' - число слотов KV-кэша)
+batch_wait_ms = 20 # Сколько ждать дополнительных запросов после первого, прежде чем запускать батч ('static')
+default_max_tokens = 256 # max_tokens, если клиент не указал (или указал -1, как LM Studio)
+max_tokens_limit = 2048 # Верхняя граница max_tokens
+default_temperature = 0.8
+default_top_k = 200
+use_kv_cache = True
+metrics_window = 1000 # По скольким последним запросам считать p50/p99
+seed = 1337
+device = 'cuda' # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
+dtype = 'bfloat16' if torch.cuda.is_available() and torch.cuda.is_bf16_supported() else 'float16' # 'float32' or 'bfloat16' or 'float16'
+compile = False # use PyTorch 2.0 to compile the model to be faster
+exec(open('configurator.py').read()) # overrides from command line or config file
+# -----------------------------------------------------------------------------
+
+torch.manual_seed(seed)
+torch.backends.cuda.matmul.allow_tf32 = True # allow tf32 on matmul
+torch.backends.cudnn.allow_tf32 = True # allow tf32 on cudnn
+device_type = 'cuda' if 'cuda' in device else 'cpu' # for later use in torch.autocast
+ptdtype = {'float32': torch.float32, 'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype]
+ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=device_type, dtype=ptdtype)
+
+
+def load_model(out_dir):
+    """Загружает GPT из out_dir/ckpt.pt (как mysample.py)."""
+    checkpoint = torch.load(os.path.join(out_dir, 'ckpt.pt'), map_location=device)
+    model = GPT(GPTConfig(**checkpoint['model_args']))
+    state_dict = checkpoint['model']
+    unwanted_prefix = '_orig_mod.'
+    for k, v in list(state_dict.items()):
+        if k.startswith(unwanted_prefix):
+            state_dict[k[len(unwanted_prefix):]] = state_dict.pop(k)
+    model.load_state_dict(state_dict)
+    model.eval()
+    model.to(device)
+    return model
+
+
+class TextCodec:
+    """Токенизатор из meta.json (с учетом таблицы компактного словаря token_id_map)."""
+
+    def __init__(self, meta_filepath):
+        with open(meta_filepath, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(meta['tokenizer_model'])
+        self.token_id_map = meta.get('token_id_map')
+        self.tokenizer_to_model_id = None
+        self.bos_token_id = meta['bos_token_id']
+        self.eos_token_id = meta['eos_token_id']
+        if self.token_id_map is not None:
+            self.tokenizer_to_model_id = {tokenizer_id: model_id for model_id, tokenizer_id in enumerate(self.token_id_map)}
+            self.bos_token_id = self.tokenizer_to_model_id[self.bos_token_id]
+            self.eos_token_id = self.tokenizer_to_model_id[self.eos_token_id]
+
+    def encode(self, text):
+        """ID модели для текста; пустой текст - начало новой статьи (<bos>)."""
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        if self.tokenizer_to_model_id is not None:
+            # Токенов, не встретившихся в корпусе, нет в словаре модели
+            ids = [self.tokenizer_to_model_id[i] for i in ids if i in self.tokenizer_to_model_id]
+        return ids or [self.bos_token_id]
+
+    def decode(self, ids):
+        if self.token_id_map is not None:
+            ids = [self.token_id_map[i] for i in ids]
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+
+class GenerationRequest:
+    """Запрос в очереди генерации. Поток генерации кладет в events новые куски текста и итог."""
+
+    def __init__(self, prompt_ids, max_tokens, temperature, top_k, stop):
+        self.prompt_ids = prompt_ids
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.stop = stop
+        self.events = queue.Queue() # ('text', delta) ... ('done', finish_reason) или ('error', message)
+        self.cancelled = False # клиент отключился или сработал stop - дальше генерировать не нужно
+        self.generated_ids = []
+        self.text = ""
+        self.created = time.time()
+        self.started = None
+        self.first_token = None
+        self.finished = None
+
+    def sampling_key(self):
+        # В один батч попадают запросы с одинаковыми параметрами выборки
+        return (self.temperature, self.top_k)
+
+
+class Metrics:
+    """Счетчики сервера и задержки последних metrics_window запросов."""
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.latencies = {name: collections.deque(maxlen=window) for name in ('queue_wait', 'time_to_first_token', 'total', 'tokens_per_second')}
+        self.batch_sizes = collections.deque(maxlen=window)
+
+    def record_request(self, request, finish_reason):
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters[f'finish_{finish_reason}'] += 1
+            self.counters['prompt_tokens'] += len(request.prompt_ids)
+            self.counters['completion_tokens'] += len(request.generated_ids)
+            self.latencies['queue_wait'].append(request.started - request.created)
+            if request.first_token is not None:
+                self.latencies['time_to_first_token'].append(request.first_token - request.created)
+            total = request.finished - request.created
+            self.latencies['total'].append(total)
+            if request.generated_ids and request.finished > request.started:
+                self.latencies['tokens_per_second'].append(len(request.generated_ids) / (request.finished - request.started))
+
+    def record_batch(self, batch_size, step_count):
+        with self.lock:
+            self.counters['batches'] += 1
+            self.counters['batch_steps'] += step_count
+            self.batch_sizes.append(batch_size)
+
+    def snapshot(self):
+        def percentiles(values):
+            if not values:
+                return None
+            ordered = sorted(values)
+            pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+            return {'p50': pick(0.5), 'p99': pick(0.99), 'mean': sum(ordered) / len(ordered)}
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'request_stats': {name: percentiles(values) for name, values in self.latencies.items()},
+                'mean_batch_size': sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else None,
+                'queued_requests': request_queue.qsize(),
+            }
+
+
+def apply_stop(text, stop):
+    """Обрезает text по первому stop-слову. Returns: (text, найдено ли stop-слово)."""
+    cut = min((text.find(s) for s in stop if s and s in text), default=-1)
+    return (text[:cut], True) if cut >= 0 else (text, False)
+
+
+def finish_request(request, finish_reason):
+    request.cancelled = True
+    request.finished = time.time()
+    request.events.put(('done', finish_reason))
+    metrics.record_request(request, finish_reason)
+
+
+def deliver_token(request, token, token_time, reached_limit):
+    """Отправляет клиенту текст, появившийся с новым токеном, и завершает запрос по eos/stop/max_tokens."""
+    if token == codec.eos_token_id:
+        finish_request(request, 'stop')
+        return
+    request.generated_ids.append(token)
+    if request.first_token is None:
+        request.first_token = token_time
+    text = codec.decode(request.generated_ids)
+    text, stopped = apply_stop(text, request.stop)
+    # незаконченный многобайтный символ - ждем следующий токен
+    if len(text) > len(request.text) and (stopped or not text.endswith('\ufffd')):
+        request.events.put(('text', text[len(request.text):]))
+        request.text = text
+    if stopped:
+        finish_request(request, 'stop')
+    elif reached_limit:
+        finish_request(request, 'length')
+
+
+def run_batch(batch):
+    """Генерирует батч запросов с одинаковыми параметрами выборки, отправляя текст по мере генерации."""
+    now = time.time()
+    for request in batch:
+        request.started = now
+    temperature, top_k = batch[0].sampling_key()
+    active = list(batch)
+    steps = 0
+    with torch.no_grad(), ctx:
+        generator = model.iter_generate_batch([r.prompt_ids for r in batch], [r.max_tokens for r in batch],
+                                              temperature=temperature, top_k=top_k, eos_token_id=codec.eos_token_id,
+                                              use_kv_cache=use_kv_cache)
+        for next_tokens, finished in generator:
+            steps += 1
+            step_time = time.time()
+            for i, request in enumerate(batch):
+                if not request.cancelled:
+                    deliver_token(request, next_tokens[i], step_time, finished[i])
+            active = [r for r in active if not r.cancelled]
+            if not active:
+                # все запросы батча завершены (или клиенты отключились) - дальше не генерируем
+                generator.close()
+                break
+    for request in batch:
+        if not request.cancelled:
+            # max_tokens = 0: генерация не понадобилась
+            finish_request(request, 'length')
+    metrics.record_batch(len(batch), steps)
+
+
+def batching_loop():
+    """Поток генерации: собирает запросы из очереди в батчи и генерирует их."""
+    pending = [] # запросы с другими параметрами выборки, ожидающие своего батча
+    while True:
+        if not pending:
+            pending.append(request_queue.get())
+        # ждем до batch_wait_ms, пока набирается батч
+        deadline = time.time() + batch_wait_ms / 1000
+        while len(pending) < max_batch_size * 4:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(request_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        while True:
+            try:
+                pending.append(request_queue.get_nowait())
+            except queue.Empty:
+                break
+        # Группы обслуживаются по возрасту: батч - самые старые запросы с теми же параметрами выборки,
+        # что и у самого старого ожидающего запроса. Так запрос с редкими параметрами не пропускается
+        # бесконечно: его ждут только запросы, пришедшие раньше него.
+        pending = sorted((r for r in pending if not r.cancelled), key=lambda r: r.created)
+        if not pending:
+            continue
+        key = pending[0].sampling_key()
+        batch = [r for r in pending if r.sampling_key() == key][:max_batch_size]
+        pending = [r for r in pending if r not in batch]
+        try:
+            run_batch(batch)
+        except Exception as e:
+            traceback.print_exc()
+            for request in batch:
+                if not request.cancelled:
+                    request.cancelled = True
+                    request.events.put(('error', str(e)))
+
+
+def continuous_batching_loop():
+    """Поток генерации (scheduler = 'continuous'): запросы входят в батч и выходят из него на каждом шаге."""
+    def on_token(seq, token):
+        request = seq.user_data
+        if not request.cancelled:
+            deliver_token(request, token, time.time(), len(seq.generated) >= seq.max_new_tokens)
+        if request.cancelled:
+            seq.cancelled = True
+
+    def submit(request):
+        if request.cancelled:
+            return
+        request.started = time.time()
+        seq = cb.submit(request.prompt_ids, request.max_tokens, temperature=request.temperature, top_k=request.top_k,
+                        on_token=on_token, user_data=request)
+        if seq.finished:
+            # max_tokens = 0: планировщик завершает такую последовательность сразу, step() ее не вернет
+            finish_request(request, 'length')
+
+    cb = ContinuousBatchingScheduler(model, max_batch_size, eos_token_id=codec.eos_token_id)
+    while True:
+        if not cb.has_work():
+            submit(request_queue.get())
+        while True:
+            try:
+                submit(request_queue.get_nowait())
+            except queue.Empty:
+                break
+        for seq in cb.running + list(cb.waiting):
+            if seq.user_data.cancelled:
+                # клиент отключился
+                seq.cancelled = True
+        try:
+            with torch.no_grad(), ctx:
+                finished = cb.step()
+        except Exception as e:
+            traceback.print_exc()
+            for seq in cb.running + list(cb.waiting):
+                if not seq.user_data.cancelled:
+                    seq.user_data.cancelled = True
+                    seq.user_data.events.put(('error', str(e)))
+            cb = ContinuousBatchingScheduler(model, max_batch_size, eos_token_id=codec.eos_token_id)
+            continue
+        metrics.record_batch(len(cb.running) + len(finished), 1)
+        for seq in finished:
+            if not seq.user_data.cancelled:
+                # страховка: последовательность завершена планировщиком, а запрос еще ждет ответа
+                finish_request(seq.user_data, 'length')
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status_code, message):
+        self._send_json(status_code, {'error': {'message': message, 'type': 'invalid_request_error'}})
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == "/v1/models":
+            self._send_json(200, {'object': 'list', 'data': [{'id': model_name, 'object': 'model', 'owned_by': 'mygpt'}]})
+        elif path == "/metrics":
+            self._send_json(200, metrics.snapshot())
+        else:
+            self._send_error(404, 'not found')
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path not in ("/v1/completions", "/v1/chat/completions"):
+            self._send_error(404, 'not found')
+            return
+        chat = path == "/v1/chat/completions"
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if chat:
+                prompt = "\n\n".join(str(m.get('content') or '') for m in body['messages'])
+            else:
+                prompt = body.get('prompt', '')
+                if isinstance(prompt, list):
+                    prompt = prompt[0] if prompt else ''
+            max_tokens = body.get('max_tokens')
+            if max_tokens is None or int(max_tokens) < 0:
+                max_tokens = default_max_tokens
+            max_tokens = min(int(max_tokens), max_tokens_limit)
+            temperature = float(body.get('temperature', default_temperature))
+            top_k = body.get('top_k', default_top_k)
+            if temperature <= 0:
+                # жадный выбор
+                temperature, top_k = 1.0, 1
+            top_k = int(top_k) if top_k else None
+            stop = body.get('stop') or []
+            if isinstance(stop, str):
+                stop = [stop]
+            stream = bool(body.get('stream', False))
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            self._send_error(400, f"bad request: {e}")
+            return
+
+        request = GenerationRequest(codec.encode(prompt), max_tokens, temperature, top_k, stop)
+        request_queue.put(request)
+        completion_id = f"{'chatcmpl' if chat else 'cmpl'}-{uuid.uuid4().hex[:24]}"
+        try:
+            if stream:
+                self._stream_response(request, completion_id, chat)
+            else:
+                self._full_response(request, completion_id, chat)
+        except (BrokenPipeError, ConnectionResetError):
+            # клиент отключился - батч перестанет генерировать для этого запроса
+            request.cancelled = True
+
+    def _full_response(self, request, completion_id, chat):
+        while True:
+            kind, value = request.events.get()
+            if kind == 'error':
+                self._send_json(500, {'error': {'message': value, 'type': 'server_error'}})
+                return
+            if kind == 'done':
+                finish_reason = value
+                break
+        choice = {'index': 0, 'finish_reason': finish_reason}
+        if chat:
+            choice['message'] = {'role': 'assistant', 'content': request.text}
+        else:
+            choice['text'] = request.text
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion' if chat else 'text_completion',
+            'created': int(request.created),
+            'model': model_name,
+            'choices': [choice],
+            'usage': {
+                'prompt_tokens': len(request.prompt_ids),
+                'completion_tokens': len(request.generated_ids),
+                'total_tokens': len(request.prompt_ids) + len(request.generated_ids),
+            },
+        })
+
+    def _stream_response(self, request, completion_id, chat):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta_text, finish_reason=None, role=False):
+            if chat:
+                delta = {'role': 'assistant'} if role else ({'content': delta_text} if delta_text else {})
+                choice = {'index': 0, 'delta': delta, 'finish_reason': finish_reason}
+            else:
+                choice = {'index': 0, 'text': delta_text, 'finish_reason': finish_reason}
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk' if chat else 'text_completion',
+                     'created': int(request.created), 'model': model_name, 'choices': [choice]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        if chat:
+            send_chunk("", role=True)
+        while True:
+            kind, value = request.events.get()
+            if kind == 'text':
+                send_chunk(value)
+            elif kind == 'done':
+                send_chunk("", finish_reason=value)
+                break
+            else:
+                self.wfile.write(f"data: {json.dumps({'error': {'message': value}}, ensure_ascii=False)}\n\n".encode('utf-8'))
+                break
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+if __name__ == "__main__":
+    print(f"Загрузка модели из {out_dir}...")
+    model = load_model(out_dir)
+    if compile:
+        model = torch.compile(model)
+    codec = TextCodec(os.path.join(out_dir, 'meta.json'))
+    request_queue = queue.Queue()
+    metrics = Metrics(metrics_window)
+    if scheduler == 'continuous':
+        threading.Thread(target=continuous_batching_loop, name='batching', daemon=True).start()
+    else:
+        threading.Thread(target=batching_loop, name='batching', daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), CompletionHandler)
+    server.daemon_threads = True
+    print(f"Сервер запущен: http://{host}:{port}/v1 (модель '{model_name}', режим '{scheduler}', батч до {max_batch_size})")
+    print("Ctrl+C для остановки.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Сервер остановлен. Метрики: {json.dumps(metrics.snapshot(), ensure_ascii=False)}")
@@ -20,6 +20,10 @@ import os
 import time
 import math
 import pickle
+import json
+import shutil
+import queue
+import threading
 from contextlib import nullcontext
 
 import numpy as np
@@ -48,12 +52,14 @@ dataset = 'openwebtext'
 gradient_accumulation_steps = 5 * 8 # used to simulate larger batch sizes
 batch_size = 12 # if gradient_accumulation_steps > 1, this is the micro-batch size
 block_size = 1024
+prefetch_batches = 0 # >0: готовить столько батчей заранее в фоновом потоке (memmap открыт постоянно, выборка одним векторным чтением)
 # model
 n_layer = 12
 n_head = 12
 n_embd = 768
 dropout = 0.0 # for pretraining 0 is good, for finetuning try 0.1+
 bias = False # do we use bias inside LayerNorm and Linear layers?
+loss_chunk_size = 0 # >0: chunked lm_head + cross-entropy (tokens per chunk), bounds logits memory for a large vocab_size
 # adamw optimizer
 learning_rate = 6e-4 # max learning rate
 max_iters = 600000 # total number of training iterations
@@ -103,6 +109,9 @@ print(f"tokens per iteration will be: {tokens_per_iter:,}")
 
 if master_process:
     os.makedirs(out_dir, exist_ok=True)
+    if os.path.exists(os.path.join('data', dataset, 'meta.json')):
+        # mysample.py читает meta.json (токенизатор, <bos>/<eos>, таблицу компактного словаря) из out_dir
+        shutil.copyfile(os.path.join('data', dataset, 'meta.json'), os.path.join(out_dir, 'meta.json'))
 torch.manual_seed(1337 + seed_offset)
 torch.backends.cuda.matmul.allow_tf32 = True # allow tf32 on matmul
 torch.backends.cudnn.allow_tf32 = True # allow tf32 on cudnn
@@ -113,11 +122,66 @@ ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=
 
 # poor man's data loader
 data_dir = os.path.join('data', dataset)
+
+# meta.json из 2_prepare.py: тип бинарных файлов и (при COMPACT_VOCAB) компактный словарь
+data_meta_path = os.path.join(data_dir, 'meta.json')
+data_meta = None
+bin_dtype = np.uint32
+if os.path.exists(data_meta_path):
+    with open(data_meta_path, 'r', encoding='utf-8') as f:
+        data_meta = json.load(f)
+    bin_dtype = np.dtype(data_meta.get('bin_dtype', 'uint32')).type
+    print(f"found {data_meta_path}: bin dtype {np.dtype(bin_dtype).name}")
+
+class BatchPrefetcher:
+    """
+    Фоновый поток, который заранее готовит prefetch_batches батчей для одного split.
+    memmap открывается один раз, окна всех строк батча читаются одной векторной выборкой,
+    батч сразу кладется в pinned-память, чтобы копирование на GPU было асинхронным.
+    """
+
+    def __init__(self, split, num_batches, seed):
+        self.data = np.memmap(os.path.join(data_dir, f'{split}.bin'), dtype=bin_dtype, mode='r')
+        self.generator = torch.Generator().manual_seed(seed)
+        self.offsets = np.arange(block_size + 1)
+        self.batches = queue.Queue(maxsize=num_batches)
+        self.thread = threading.Thread(target=self._run, name=f'prefetch-{split}', daemon=True)
+        self.thread.start()
+
+    def _make_batch(self):
+        ix = torch.randint(len(self.data) - block_size, (batch_size,), generator=self.generator).numpy()
+        # (batch_size, block_size + 1) окон за одно чтение; x и y - сдвинутые срезы одного буфера
+        windows = torch.from_numpy(self.data[ix[:, None] + self.offsets].astype(np.int64))
+        if device_type == 'cuda':
+            windows = windows.pin_memory()
+        return windows
+
+    def _run(self):
+        try:
+            while True:
+                self.batches.put(self._make_batch())
+        except Exception as e:
+            self.batches.put(e)
+
+    def get(self):
+        windows = self.batches.get()
+        if isinstance(windows, Exception):
+            raise windows
+        windows = windows.to(device, non_blocking=(device_type == 'cuda'))
+        # contiguous: model.py делает targets.view(-1), срезы одного буфера для этого не подходят
+        return windows[:, :-1].contiguous(), windows[:, 1:].contiguous()
+
+prefetchers = {}
+
 def get_batch(split):
+    if prefetch_batches > 0:
+        if split not in prefetchers:
+            prefetchers[split] = BatchPrefetcher(split, prefetch_batches, 1337 + seed_offset + (0 if split == 'train' else 1000))
+        return prefetchers[split].get()
     if split == 'train':
-        data = np.memmap(os.path.join(data_dir, 'train.bin'), dtype=np.uint32, mode='r') # <--- ИСПРАВЛЕНО
+        data = np.memmap(os.path.join(data_dir, 'train.bin'), dtype=bin_dtype, mode='r') # <--- ИСПРАВЛЕНО
     else:
-        data = np.memmap(os.path.join(data_dir, 'val.bin'), dtype=np.uint32, mode='r') # <--- ИСПРАВЛЕНО
+        data = np.memmap(os.path.join(data_dir, 'val.bin'), dtype=bin_dtype, mode='r') # <--- ИСПРАВЛЕНО
     ix = torch.randint(len(data) - block_size, (batch_size,))
     x = torch.stack([torch.from_numpy((data[i:i+block_size]).astype(np.int64)) for i in ix])
     y = torch.stack([torch.from_numpy((data[i+1:i+1+block_size]).astype(np.int64)) for i in ix])
@@ -140,10 +204,14 @@ if os.path.exists(meta_path):
         meta = pickle.load(f)
     meta_vocab_size = meta['vocab_size']
     print(f"found vocab_size = {meta_vocab_size} (inside {meta_path})")
+elif data_meta is not None and 'token_id_map' in data_meta:
+    # компактный словарь: модель работает с перенумерованными ID, размер словаря берем из meta.json
+    meta_vocab_size = data_meta['vocab_size']
+    print(f"found compact vocab_size = {meta_vocab_size} of {data_meta.get('tokenizer_vocab_size')} (inside {data_meta_path})")
 
 # model init
 model_args = dict(n_layer=n_layer, n_head=n_head, n_embd=n_embd, block_size=block_size,
-                  bias=bias, vocab_size=None, dropout=dropout) # start with model_args from command line
+                  bias=bias, vocab_size=None, dropout=dropout, loss_chunk_size=loss_chunk_size) # start with model_args from command line
                   
 # --- НОВЫЙ КОД ---
 # Принудительно используем vocab_size из глобальной переменной,
@@ -254,6 +322,7 @@ if wandb_log and master_process:
 # training loop
 X, Y = get_batch('train') # fetch the very first batch
 t0 = time.time()
+data_wait = 0.0 # время ожидания батчей за итерацию
 local_iter_num = 0 # number of iterations in the lifetime of this process
 raw_model = model.module if ddp else model # unwrap DDP container if needed
 running_mfu = -1.0
@@ -305,7 +374,9 @@ while True:
             logits, loss = model(X, Y)
             loss = loss / gradient_accumulation_steps # scale the loss to account for gradient accumulation
         # immediately async prefetch next batch while model is doing the forward pass on the GPU
+        t_data = time.time()
         X, Y = get_batch('train')
+        data_wait += time.time() - t_data
         # backward pass, with gradient scaling if training in fp16
         scaler.scale(loss).backward()
     # clip the gradient
@@ -329,7 +400,8 @@ while True:
         if local_iter_num >= 5: # let the training loop settle a bit
             mfu = raw_model.estimate_mfu(batch_size * gradient_accumulation_steps, dt)
             running_mfu = mfu if running_mfu == -1.0 else 0.9*running_mfu + 0.1*mfu
-        print(f"iter {iter_num}: loss {lossf:.4f}, time {dt*1000:.2f}ms, mfu {running_mfu*100:.2f}%")
+        print(f"iter {iter_num}: loss {lossf:.4f}, time {dt*1000:.2f}ms, data {data_wait*1000:.2f}ms, mfu {running_mfu*100:.2f}%")
+    data_wait = 0.0
     iter_num += 1
     local_iter_num += 1
 